@@ -0,0 +1,118 @@
+# batch rendering of ISM-FDN room impulse responses across rooms and source / mic positions.
+#
+# each room reads its materials and finds the image sources of every position in one vectorised pass,
+# then every (room, position) is rendered in a worker process with the numpy FDN engine. workers are
+# reused across jobs, so filter designs are shared by their renders (and across workers with a filter cache dir).
+# all rirs are written to one store: rirs.npy (renders, variants, length) and index.json describing each render.
+import numpy as np
+import json
+from os import path, makedirs
+from dataclasses import replace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import SimulationConfig, RoomConfig
+from utils.signals import signal
+from utils.absorption import Absorption
+from utils.filters import filter_design_cache
+from early_reflections.ism import ImageSourceMethod
+from ism_fdn import ISMFDN
+
+VARIANTS = ['ISMFDN, One-pole', 'ISMFDN, FIR']
+
+def _init_worker(filter_cache_dir):
+    filter_design_cache.cache_dir = filter_cache_dir
+
+def _render(job):
+    """
+    Render one room and position in a worker process.
+
+    Returns: render index, rirs (variants, length)
+    """
+    index, fs, simulation_config, room_config, absorption, image_sources, fdn_N, signal_length = job
+    unit_impulse, _ = signal('unit', signal_length, fs)
+    rirs = ISMFDN(
+        fs,
+        simulation_config,
+        room_config,
+        fdn_N=fdn_N,
+        processing_type='parallel',
+        fdn_engine='python',
+        absorption=absorption,
+        image_sources=image_sources,
+    ).process(unit_impulse)
+    return index, np.array(rirs)
+
+def make_jobs(fs, simulation_config: SimulationConfig, room_configs, source_locs, mic_locs, fdn_N=-1, signal_length=None):
+    """
+    Share the absorption of each room and find the image sources of all its positions at once.
+
+    Returns: jobs for _render, index of each render
+    """
+    if signal_length is None: signal_length = simulation_config.SIGNAL_LENGTH
+    source_locs = np.atleast_2d(np.array(source_locs, dtype=float))
+    mic_locs = np.atleast_2d(np.array(mic_locs, dtype=float))
+    assert source_locs.shape == mic_locs.shape, 'source and mic positions are pairs'
+
+    jobs, index = [], []
+    for room_index, room_config in enumerate(room_configs):
+        room_dims = np.array(room_config.ROOM_DIMS, dtype=float)
+        assert np.all((source_locs > 0) & (source_locs < room_dims)), f'source outside room {room_index}'
+        assert np.all((mic_locs > 0) & (mic_locs < room_dims)), f'mic outside room {room_index}'
+
+        absorption = Absorption(room_config.WALL_MATERIALS, room_config.MATERIALS_DIR, fs)
+        ism = ImageSourceMethod(room_config, fs=fs, c=simulation_config.SPEED_OF_SOUND, absorption=absorption)
+        image_sources = ism.batch_image_sources(source_locs, mic_locs, direct_path=True)
+
+        for position, (source, mic) in enumerate(zip(source_locs, mic_locs)):
+            # replace copies every field, so the room model is not parsed again
+            position_config = replace(room_config, SOURCE_LOC=tuple(source), MIC_LOC=tuple(mic))
+            position_sources = {key: value if key == 'orders' else value[position] for key, value in image_sources.items()}
+            jobs.append((len(jobs), fs, simulation_config, position_config, absorption, position_sources, fdn_N, signal_length))
+            index.append({
+                'room': room_index,
+                'room_dims': room_dims.tolist(),
+                'wall_materials': dict(room_config.WALL_MATERIALS),
+                'source': source.tolist(),
+                'mic': mic.tolist(),
+            })
+    return jobs, index
+
+def batch_render(fs, simulation_config: SimulationConfig, room_configs, source_locs, mic_locs, output_dir, fdn_N=-1, signal_length=None, max_workers=None, filter_cache_dir=None):
+    """
+    Render an ISM-FDN rir (one-pole and FIR late reverberation) for every position in every room.
+
+    Params:
+    room_configs: RoomConfig or list of RoomConfig
+    source_locs, mic_locs: positions (positions, 3), pairs of source and mic rendered in every room
+    output_dir: directory of the store, rirs.npy is written as renders complete
+    max_workers: number of worker processes, None for the number of cpus
+    filter_cache_dir: on disk filter design cache shared by the workers
+
+    Returns: rirs (renders, variants, length) memory mapped from the store, index of each render
+    """
+    if isinstance(room_configs, RoomConfig): room_configs = [room_configs]
+    if signal_length is None: signal_length = simulation_config.SIGNAL_LENGTH
+    jobs, index = make_jobs(fs, simulation_config, room_configs, source_locs, mic_locs, fdn_N, signal_length)
+
+    if not path.exists(output_dir): makedirs(output_dir)
+    with open(path.join(output_dir, 'index.json'), 'w') as file:
+        json.dump({'fs': fs, 'variants': VARIANTS, 'renders': index}, file, indent=2)
+    rirs = np.lib.format.open_memmap(path.join(output_dir, 'rirs.npy'), mode='w+', dtype=np.float32, shape=(len(jobs), len(VARIANTS), signal_length))
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(filter_cache_dir,)) as executor:
+        futures = [executor.submit(_render, job) for job in jobs]
+        for future in as_completed(futures):
+            i, rir = future.result()
+            rirs[i] = rir
+            print(f'Rendered {i + 1} / {len(jobs)}')
+
+    rirs.flush()
+    return rirs, index
+
+def load_batch(output_dir):
+    """
+    Returns: rirs (renders, variants, length) memory mapped, index dict
+    """
+    with open(path.join(output_dir, 'index.json'), 'r') as file:
+        index = json.load(file)
+    return np.load(path.join(output_dir, 'rirs.npy'), mmap_mode='r'), index
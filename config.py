@@ -58,6 +58,7 @@ class TestConfig:
     REAL_RIR_FILE: str = "Small Hallway RIR.wav"
     PROCESSED_SAMPLES_DIR: str = '_output/processed_samples/'
     STIMULI_DIR: str = '_output/stimuli/'
+    EVALUATION_CACHE_DIR: str = '_output/evaluation_cache/'
     ROOM_DIR: str = ROOM_DIR
 
 @dataclass
@@ -2,12 +2,23 @@ import numpy as np
 
 from utils.point3D import Point3D
 from utils.delay import TappedDelayLine
-from utils.delay import delay_array
+from utils.delay import delay_array, delay_arrays, SparseChannels
 from utils.geometry import euclid_dist, distance_to_delay
 from utils.convolve import fft_convolution
-from utils.filters import fir_type_1, fir_type_2
+from utils.filters import fir_type_1, fir_type_2, iir_wall_filter
 from config import SimulationConfig, RoomConfig
 
+def wall_filter(fir_type, center_freqs, absorption, nyquist):
+    """
+    Minimum phase wall filter of a material, fir_type "I", "II" or "IIR" (biquad cascade, type I taps where the fit is poor).
+    
+    Returns: filter coefficients, maximum IIR fit error in dB (None for FIR filters)
+    """
+    gains = 1 - np.array(absorption)
+    if fir_type == "I": return fir_type_1(center_freqs, gains, nyquist)[1], None
+    if fir_type == "II": return fir_type_2(center_freqs, gains, nyquist)[1], None
+    if fir_type == "IIR": return iir_wall_filter(center_freqs, gains, nyquist)
+    
 class EarlyReflections:
     def __init__(self, source: Point3D, mic: Point3D, image_sources: list[Point3D], image_source_walls: list[str], sim_config: SimulationConfig, room_config: RoomConfig, ism_rir, wall_center_freqs, material_absorption, material_filter=True, fir_type="I"):
         self.fs = sim_config.FS
@@ -19,7 +30,8 @@ class EarlyReflections:
         self.wall_absorption_flat = room_config.WALL_MATERIALS_FLAT
         self.wall_absorption_bands = material_absorption
         self.wall_center_freqs = wall_center_freqs
-        self.fir_type = fir_type
+        self.fir_type = fir_type # "I", "II" or "IIR" (biquad cascade)
+        self.wall_filter_errors = {} # maximum IIR fit error of each wall in dB
 
         # rendered image source method RIR
         self.ism_rir = ism_rir
@@ -38,7 +50,7 @@ class EarlyReflections:
         
         self.direct_delay = self._point_to_delay_time(self.mic, self.source)
         
-        self.tapped_delay_line = TappedDelayLine(self.delay_times, self.distance_attenuation, self.wall_filter_coeffs, self.fs, use_filter=material_filter)
+        self.tapped_delay_line = TappedDelayLine(self.delay_times, self.distance_attenuation, self.wall_filter_coeffs, self.fs, use_filter=material_filter, groups=self.image_source_walls)
             
     # TODO also return direct sound in a seperate array
     def process(self, input_signal, output_signal, type: str):
@@ -51,10 +63,17 @@ class EarlyReflections:
         
         if type == 'tdl': 
             er = self.tapped_delay_line.process(input_signal)
+        if type == 'sparse':
+            er = self.tapped_delay_line.process_sparse(input_signal)
+        if type == 'grouped':
+            er = self.tapped_delay_line.process_sparse(input_signal, grouped=True)
         if type == 'convolve':
             er = fft_convolution(input_signal, self.ism_rir)
         if type == 'multi-channel':
-            er = np.array([delay_array(input_signal, d, self.fs) * gain for d, gain in zip(self.delay_times, self.distance_attenuation)])
+            er = delay_arrays(input_signal, self.delay_times, self.fs) * self.distance_attenuation[:, None]
+        if type == 'sparse-multi-channel':
+            # taps of each image source, rendered in blocks by the consumer
+            er = SparseChannels(input_signal, self.delay_times, self.distance_attenuation, self.fs)
         
         return er, direct
                 
@@ -68,13 +87,14 @@ class EarlyReflections:
         return np.array([(1.0 - self.wall_absorption_flat[wall]) for wall in self.image_source_walls])
         
     def _make_wall_filters(self):
+        # design each distinct wall filter once
         nyquist = self.fs / 2
-        return [self._make_filter(self.wall_center_freqs, self.wall_absorption_bands[wall], nyquist, self.fir_type) for wall in self.image_source_walls]
+        filters = {wall: self._make_filter(wall, nyquist) for wall in set(self.image_source_walls)}
+        return [filters[wall] for wall in self.image_source_walls]
    
-    @staticmethod
-    def _make_filter(freqs, coefficients, nyquist, fir_type):
-        if fir_type == "I": fir, fir_min = fir_type_1(freqs, 1 - np.array(coefficients), nyquist)
-        if fir_type == "II": fir, fir_min = fir_type_2(freqs, 1 - np.array(coefficients), nyquist)
+    def _make_filter(self, wall, nyquist):
+        fir_min, error_db = wall_filter(self.fir_type, self.wall_center_freqs, self.wall_absorption_bands[wall], nyquist)
+        if error_db is not None: self.wall_filter_errors[wall] = error_db
         return fir_min
     
     def _point_to_delay_time(self, mic, point):
@@ -2,17 +2,30 @@ import pyroomacoustics as pra
 import matplotlib.pyplot as plt
 import numpy as np
 from pyroomacoustics.experimental.rt60 import measure_rt60
+from pyroomacoustics.acoustics import OctaveBandsFactory
+from scipy.signal import fftconvolve
 
 from config import RoomConfig
+from utils.absorption import Absorption
+from utils.fractional_delay import fractional_delay_kernels
+
+# wall names in the order of RoomConfig.WALL_MATERIALS
+WALLS = ["north", "south", "east", "west", "floor", "ceiling"]
+# index into WALLS of the plane at 0 and at L along each axis
+AXIS_WALLS = np.array([[3, 2], [0, 1], [4, 5]]) # x: west/east, y: north/south, z: floor/ceiling
 
 class ImageSourceMethod:
-    def __init__(self, room_config: RoomConfig, fs=44100):
+    def __init__(self, room_config: RoomConfig, fs=44100, c=343.0, absorption: Absorption=None):
         self.room_dims = room_config.ROOM_DIMS
         self.absorption = room_config.WALL_MATERIALS
         self.source = room_config.SOURCE_LOC
         self.mic = room_config.MIC_LOC
         self.order = room_config.ER_ORDER
         self.fs = fs
+        self.c = c
+        # frequency dependant wall and air absorption for the native image source method
+        if absorption is None: absorption = Absorption(room_config.WALL_MATERIALS, room_config.MATERIALS_DIR, fs)
+        self.wall_absorption = absorption
     
     
     def _make_room_shoebox(self, room_dims, max_order, source, mic):
@@ -71,68 +84,161 @@ class ImageSourceMethod:
         
     def get_source_coords(self, plot=False, direct_path=False, order=0):
         """
-        Method to find image source using pyroomacoustics C++ accelerated Image Source Method algorithm.
+        Find the image sources with the vectorised image source method.
 
-        return (list[list]): image sources in cartisian coordianates with the structure, x = image_source[0], y = image_source[1], z = image_source[2]
+        return (list[list], list[str]): image sources in cartisian coordianates with the structure, x = image_source[0], y = image_source[1], z = image_source[2]
+        and the wall associated with each image source.
         """
-        shoebox = self._configure_shoebox(order)
-        
-        # run image source method
-        shoebox.image_source_model()
-        
-        # create copy of image sources from room engine
-        image_sources = shoebox.room_engine.sources.copy()
-                        
-        # convert 2d list to list of x,y,z coords
-        image_sources = self._to_coords_list(image_sources)
-                
-        # remove the original source
-        if not direct_path:
-            image_sources = list(filter(self._drop_source, image_sources))
-            
-        image_source_walls = [self._find_associated_wall(coords) for coords in image_sources]
+        image_sources = self.image_sources(order=order, direct_path=direct_path)
         
         if plot:
+            shoebox = self._configure_shoebox(order)
+            shoebox.image_source_model()
             shoebox.plot()
         
-        return image_sources, image_source_walls
+        return image_sources['coords'].tolist(), image_sources['walls'].tolist()
 
-    def _drop_source(self, var):
+    def image_sources(self, order=0, direct_path=False):
         """
-        Remove the image source which matches the original source.
-        Due to floating point number use find items that match in small decimal range
+        Find every image source up to the reflection order of the configured source in a single pass,
+        in the same order as the pyroomacoustics room engine.
+        
+        Returns (dict): contiguous arrays
+            coords (n, 3): image source positions
+            orders (n): reflection order
+            walls (n): name of the wall associated with each image source
+            wall_sequence (n, order): index into WALLS of each wall hit from source to mic, -1 padded
+            attenuation (n, bands): wall, air and distance (1/r) attenuation at the absorption frequency bands
+            delays (n): propagation delay in seconds
         """
-        return not all(abs(a - b) < 1e-6 for a, b in zip(var, self.source))
+        image_sources = self.batch_image_sources([self.source], [self.mic], order=order, direct_path=direct_path)
+        return {key: value if key == 'orders' else value[0] for key, value in image_sources.items()}
 
-    def _to_coords_list(self, image_sources):
-        coord_list = [[image_sources[0, i], image_sources[1, i], image_sources[2, i]] for i in range(image_sources.shape[1])]
-        return coord_list
+    def batch_image_sources(self, sources, mics, order=0, direct_path=False):
+        """
+        Vectorised shoebox image source method for several source and mic positions in this room at once,
+        the image lattice is shared and every position is one more row of the same arrays.
+        
+        Params:
+        sources, mics: positions (positions, 3), pairs of source and mic
+        
+        Returns (dict): the arrays of image_sources with a leading positions axis, except orders (n) which is shared
+        """
+        if order == 0: order = self.order
+        room_dims = np.array(self.room_dims, dtype=float)
+        sources = np.array(sources, dtype=float)
+        mics = np.array(mics, dtype=float)
+        positions = len(sources)
+        
+        # lattice of image indices with |i| + |j| + |k| <= order, z outer and x inner
+        n = np.arange(-order, order + 1)
+        k, j, i = np.meshgrid(n, n, n, indexing='ij')
+        lattice = np.stack((i.ravel(), j.ravel(), k.ravel()), axis=1)
+        orders = np.sum(np.abs(lattice), axis=1)
+        keep = orders <= order
+        if not direct_path: keep &= orders > 0
+        lattice = lattice[keep]
+        orders = orders[keep]
+        
+        # even images are translated copies of the source, odd images are mirrored (positions, n, 3)
+        coords = np.where(lattice % 2 == 0, lattice * room_dims + sources[:, None, :], (lattice + 1) * room_dims - sources[:, None, :])
+        
+        distances = np.sqrt(np.sum((coords - mics[:, None, :]) ** 2, axis=2))
+        delays = distances / self.c
+        
+        # rows of every position stacked for the wall sequence
+        rows = positions * len(lattice)
+        wall_sequence = self._wall_sequence(
+            np.tile(lattice, (positions, 1)), 
+            coords.reshape(rows, 3), 
+            np.repeat(mics, len(lattice), axis=0), 
+            room_dims, 
+            order,
+        ).reshape(positions, len(lattice), -1)
+        
+        # product of the reflection factors of every wall hit, -1 indexes a row of ones
+        reflection = np.sqrt(1 - np.array([self.wall_absorption.coefficients_dict[wall] for wall in WALLS]))
+        reflection = np.vstack((reflection, np.ones(reflection.shape[1])))
+        attenuation = np.prod(reflection[wall_sequence], axis=2)
+        attenuation = attenuation * np.exp(-0.5 * self.wall_absorption.air_absorption * distances[..., None]) / distances[..., None]
+        
+        return {
+            'coords': coords,
+            'orders': orders,
+            'walls': self._associated_walls(coords.reshape(rows, 3), room_dims).reshape(positions, len(lattice)),
+            'wall_sequence': wall_sequence,
+            'attenuation': attenuation,
+            'delays': delays,
+        }
     
+    def render_rir(self, image_sources, length=None, frac_filter_N=81, norm=False):
+        """
+        Render a room impulse response from the arrays of image_sources.
+        Each frequency band is built by adding windowed sinc fractional delays at the image source delays,
+        filtered by an octave band filter and summed.
+        """
+        N = frac_filter_N
+        sample_delays = image_sources['delays'] * self.fs
+        delay_int = np.floor(sample_delays).astype(int)
+        kernels = fractional_delay_kernels(sample_delays - delay_int, N=N) # (n, N)
+        
+        octave_bands = OctaveBandsFactory(fs=self.fs)
+        band_gains = np.array([np.interp(octave_bands.centers, self.wall_absorption.freq_bands, a) for a in image_sources['attenuation']])
+        
+        # kernel taps centered on the integer delay
+        taps = delay_int[:, None] - (N - 1) // 2 + np.arange(N)
+        offset = max(0, -np.min(taps))
+        rir_length = np.max(taps) + offset + 1
+        bands = np.zeros((octave_bands.n_bands, rir_length))
+        for b in range(octave_bands.n_bands):
+            bands[b] = np.bincount((taps + offset).ravel(), weights=(kernels * band_gains[:, b, None]).ravel(), minlength=rir_length)
+        
+        rir = np.sum(fftconvolve(bands, octave_bands.filters.T, mode='same', axes=1), axis=0)[offset:]
+        
+        if length is not None: rir = np.pad(rir, (0, max(0, length - len(rir))))[:length]
+        if norm: rir = rir / np.max(rir)
+        
+        return rir
+
+    @staticmethod
+    def _wall_sequence(lattice, coords, mic, room_dims, order):
+        """
+        Order the planes crossed by the straight path from each image source to the mic (3,) or its own mic (n, 3).
+        Along an axis, an image in cell i crosses the planes m * L between it and the room,
+        which are the wall at 0 for even m and the wall at L for odd m.
+        """
+        if order == 0: return np.zeros((len(lattice), 0), dtype=int)
+        r = np.arange(order)
+        crossings = []
+        walls = []
+        for axis in range(3):
+            i = lattice[:, axis, None]
+            planes = np.where(i > 0, i - r, i + 1 + r)
+            valid = r < np.abs(i)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = (planes * room_dims[axis] - coords[:, axis, None]) / (mic[..., axis, None] - coords[:, axis, None])
+            crossings.append(np.where(valid, t, np.inf))
+            walls.append(AXIS_WALLS[axis][planes % 2])
+        crossings = np.concatenate(crossings, axis=1)
+        walls = np.concatenate(walls, axis=1)
+        
+        hit_order = np.argsort(crossings, axis=1, kind='stable')[:, :order]
+        sequence = np.take_along_axis(walls, hit_order, axis=1)
+        return np.where(np.isfinite(np.take_along_axis(crossings, hit_order, axis=1)), sequence, -1)
+
+    @staticmethod
+    def _associated_walls(coords, room_dims):
+        x, y, z = coords.T
+        Lx, Ly, Lz = room_dims
+        conditions = [x < 0, x > Lx, y < 0, y > Ly, z < 0, z > Lz]
+        return np.select(conditions, ["west", "east", "north", "south", "floor", "ceiling"], default="inside room")
+
     def _configure_shoebox(self, order):
         if(order == 0):
             return self._make_room_shoebox(self.room_dims, self.order, self.source, self.mic)
         else: # overide object wide reflection order
             return self._make_room_shoebox(self.room_dims, order, self.source, self.mic)
     
-    def _find_associated_wall(self, image_source):
-        x, y, z = image_source
-        Lx, Ly, Lz = self.room_dims
-        
-        if x < 0:
-            return "west"
-        elif x > Lx:
-            return "east"
-        elif y < 0:
-            return "north"
-        elif y > Ly:
-            return "south"
-        elif z < 0:
-            return "floor"
-        elif z > Lz:
-            return "ceiling"
-        else:
-            return "inside room"
-    
     def _find_intersection(image_source, receiver, boundary_axis, boundary_value):
         """
         Find the intersection of the path from the image source to the receiver with a given boundary.
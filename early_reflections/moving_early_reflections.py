@@ -0,0 +1,69 @@
+# early reflections of a moving source and mic.
+#
+# the image sources of every control period of a trajectory are found in one pass of
+# ImageSourceMethod.batch_image_sources, then rendered through a time varying tapped delay line.
+# the image lattice, and so the wall of each image source, is the same for every position,
+# only the delays and distance attenuation move.
+import numpy as np
+
+from early_reflections.ism import ImageSourceMethod
+from early_reflections.early_reflections import wall_filter
+from utils.delay import MovingTappedDelayLine
+from utils.geometry import control_path
+
+class MovingEarlyReflections:
+    def __init__(self, ism: ImageSourceMethod, wall_center_freqs, material_absorption, control_period=64, interpolation_taps=8, material_filter=True, fir_type="I"):
+        self.ism = ism
+        self.fs = ism.fs
+        self.c = ism.c
+        self.control_period = control_period
+        self.source = np.array(ism.source, dtype=float)
+        self.mic = np.array(ism.mic, dtype=float)
+        self.wall_filter_errors = {} # maximum IIR fit error of each wall in dB
+
+        image_sources = ism.image_sources(direct_path=True)
+        self.reflections = image_sources['orders'] > 0
+        self.image_source_walls = image_sources['walls'][self.reflections].tolist()
+
+        # design each distinct wall filter once
+        nyquist = self.fs / 2
+        filters = {}
+        for wall in set(self.image_source_walls):
+            filters[wall], error_db = wall_filter(fir_type, wall_center_freqs, material_absorption[wall], nyquist)
+            if error_db is not None: self.wall_filter_errors[wall] = error_db
+        self.wall_filter_coeffs = [filters[wall] for wall in self.image_source_walls]
+
+        # an image in cell (i, j, k) is at most (|i| + 1) room lengths from the mic along each axis,
+        # the longest path puts every reflection on the longest axis
+        dims = np.sort(np.array(ism.room_dims, dtype=float))
+        order = np.max(image_sources['orders'])
+        max_delay = np.sqrt(((order + 1) * dims[2]) ** 2 + dims[1] ** 2 + dims[0] ** 2) / self.c
+
+        self.tapped_delay_line = MovingTappedDelayLine(self.wall_filter_coeffs, self.fs, max_delay, groups=self.image_source_walls, control_period=control_period, interpolation_taps=interpolation_taps, use_filter=material_filter)
+        self.direct_line = MovingTappedDelayLine([None], self.fs, max_delay, control_period=control_period, interpolation_taps=interpolation_taps, use_filter=False)
+
+    def process(self, input_signal, source_path=None, mic_path=None):
+        """
+        Render the early reflections along a trajectory, the state is kept between calls.
+
+        Params:
+        source_path, mic_path: position at each control period of the signal (periods, 3) or a single position,
+                               the configured positions by default, positions ramp linearly over a period
+
+        Returns: early reflections, direct sound (delayed only, as EarlyReflections.process)
+        """
+        periods = int(np.ceil(len(input_signal) / self.control_period))
+        source_path = control_path(self.source if source_path is None else source_path, periods)
+        mic_path = control_path(self.mic if mic_path is None else mic_path, periods)
+        room_dims = np.array(self.ism.room_dims, dtype=float)
+        assert np.all((source_path > 0) & (source_path < room_dims)), 'source outside room'
+        assert np.all((mic_path > 0) & (mic_path < room_dims)), 'mic outside room'
+
+        image_sources = self.ism.batch_image_sources(source_path, mic_path, direct_path=True)
+        delays = image_sources['delays']
+        distance_attenuation = np.minimum(1 / (delays * self.c), 1)
+
+        er = self.tapped_delay_line.process(input_signal, delays[:, self.reflections], distance_attenuation[:, self.reflections])
+        direct = self.direct_line.process(input_signal, delays[:, ~self.reflections], np.ones((periods, 1)))
+        self.source, self.mic = source_path[-1], mic_path[-1]
+        return er, direct
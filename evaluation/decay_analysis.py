@@ -0,0 +1,120 @@
+# decay analysis of room impulse responses from the Schroeder backward integral (ISO 3382-1).
+#
+# every band of every rir is filtered once, the energy decay curves of all bands are one array
+# and each parameter is read from the same curves without filtering again.
+# times are relative to the first sample, so pre-delay should be removed for clarity and definition.
+import numpy as np
+from scipy.signal import fftconvolve
+from pyroomacoustics.acoustics import OctaveBandsFactory
+
+_filterbanks = {}
+
+def octave_filterbank(fs):
+    """
+    pyroomacoustics octave filterbank, designed once per sampling frequency.
+    """
+    if fs not in _filterbanks: _filterbanks[fs] = OctaveBandsFactory(fs=fs)
+    return _filterbanks[fs]
+
+def band_filter(h, fs, broadband=True):
+    """
+    Filter a batch of impulse responses through every octave band at once.
+
+    Returns: band signals (rirs, bands, length), the unfiltered rir is the last band if broadband, band centres
+    """
+    h = np.atleast_2d(h)
+    filterbank = octave_filterbank(fs)
+    filters = filterbank.filters.T[None, :, :]
+    # mode='same' keeps the shape of the first input on every axis
+    bands = fftconvolve(np.broadcast_to(h[:, None, :], (h.shape[0], filters.shape[1], h.shape[1])), filters, mode='same', axes=-1)
+    if broadband: bands = np.concatenate((bands, h[:, None, :]), axis=1)
+    return bands, np.array(filterbank.centers)
+
+def energy_decay_curve(x):
+    """
+    Schroeder backward integral along the last axis.
+
+    Returns: energy (linear), energy decay curve in dB relative to the total energy (-inf after the last non zero sample)
+    """
+    energy = np.cumsum(x[..., ::-1] ** 2, axis=-1)[..., ::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edc_db = 10 * np.log10(energy / energy[..., :1])
+    return energy, edc_db
+
+def decay_time(edc_db, fs, start_db=-5.0, decay_db=60.0, extrapolate_db=-60.0, limit_to_range=False):
+    """
+    Least squares line through every energy decay curve at once, from the first sample at or below start_db
+    to the first sample decay_db below it, extrapolated to extrapolate_db (as pyroomacoustics measure_rt60).
+
+    limit_to_range: shorten decay_db to the dynamic range of the curve, as measure_rt60 does for the RT60
+
+    Returns: decay times in seconds (edc_db.shape[:-1]), 0 where the curve never reaches start_db
+    """
+    length = edc_db.shape[-1]
+    index = np.arange(length)
+    finite = np.isfinite(edc_db)
+
+    if limit_to_range:
+        dynamic_range = -np.min(np.where(finite, edc_db, 0), axis=-1)
+        decay_db = np.where(dynamic_range - 5 < decay_db, dynamic_range, decay_db)
+
+    below_start = finite & (edc_db <= start_db)
+    has_start = np.any(below_start, axis=-1)
+    i_start = np.argmax(below_start, axis=-1)
+    e_start = np.take_along_axis(edc_db, i_start[..., None], axis=-1)
+
+    # the -inf tail is below any threshold
+    below_stop = ~finite | (edc_db < e_start - np.asarray(decay_db)[..., None])
+    below_stop &= index >= i_start[..., None]
+    i_stop = np.where(np.any(below_stop, axis=-1), np.argmax(below_stop, axis=-1), length)
+
+    # slope of the masked regression, time relative to the first fitted sample
+    mask = (index >= i_start[..., None]) & (index < i_stop[..., None])
+    t = (index - i_start[..., None]) / fs * mask
+    x = np.where(mask, edc_db, 0)
+    n = np.sum(mask, axis=-1)
+    St, Sx = np.sum(t, axis=-1), np.sum(x, axis=-1)
+    Stt, Stx = np.sum(t * t, axis=-1), np.sum(t * x, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * Stx - St * Sx) / (n * Stt - St ** 2)
+        return np.where(has_start, extrapolate_db / slope, 0.0)
+
+def clarity(energy, fs, time_ms):
+    """
+    Early to late energy ratio in dB, C50 for time_ms = 50 and C80 for time_ms = 80.
+    """
+    split = min(int(round(time_ms / 1000 * fs)), energy.shape[-1] - 1)
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10((energy[..., 0] - energy[..., split]) / energy[..., split])
+
+def definition(energy, fs, time_ms=50):
+    """
+    Early to total energy ratio, D50 for time_ms = 50.
+    """
+    split = min(int(round(time_ms / 1000 * fs)), energy.shape[-1] - 1)
+    return (energy[..., 0] - energy[..., split]) / energy[..., 0]
+
+def decay_analysis(h, fs, broadband=True):
+    """
+    Decay parameters of every octave band of a batch of impulse responses from one filter pass.
+
+    Params:
+    h: impulse response (length,) or batch of equal length impulse responses (rirs, length)
+    broadband: add the unfiltered rir as the last band
+
+    Returns: dict of band centres, EDC (rirs, bands, length) in dB and RT60, T20, T30, EDT, C50, C80, D50 (rirs, bands)
+    """
+    bands, centers = band_filter(h, fs, broadband=broadband)
+    energy, edc_db = energy_decay_curve(bands)
+
+    return {
+        'centers': centers,
+        'edc': edc_db,
+        'RT60': decay_time(edc_db, fs, start_db=-5.0, decay_db=60.0, limit_to_range=True),
+        'T20': decay_time(edc_db, fs, start_db=-5.0, decay_db=20.0),
+        'T30': decay_time(edc_db, fs, start_db=-5.0, decay_db=30.0),
+        'EDT': decay_time(edc_db, fs, start_db=0.0, decay_db=10.0),
+        'C50': clarity(energy, fs, 50),
+        'C80': clarity(energy, fs, 80),
+        'D50': definition(energy, fs, 50),
+    }
@@ -1,21 +1,67 @@
 import numpy as np
 from matplotlib import pyplot as plt
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.special import erfc
 
-def echo_density(rir, fs, matlab_eng, truncate_start=False, plot=False, name='', len_secs=0.25, ref_ed=[], ref_tmix=0):
+def normalized_echo_density(rirs, window=1024, hop=500):
+    """
+    Normalized echo density profile (Abel and Huang 2006), a numpy port of echoDensity.m from the fdnToolbox.
+    As in echoDensity.m the density is evaluated every hop samples and linearly interpolated,
+    samples after the last evaluated window are 0.
+
+    Params:
+    rirs: impulse response (length,) or batch of equal length impulse responses (rirs, length)
+    window: hann window length in samples, must be even
+
+    Returns: echo density (rirs, length), mixing time index (rirs,) where the echo density first reaches 1
+    """
+    rirs = np.atleast_2d(rirs)
+    length = rirs.shape[1]
+    assert length >= window, 'IR shorter than analysis window length'
+    half_window = window // 2
+    weights = np.hanning(window)
+    weights = weights / np.sum(weights)
+
+    # window of centre n covers samples n - half_window .. n + half_window - 1, zeros outside the rir add nothing
+    centres = np.arange(0, length, hop)
+    padded = np.pad(rirs, ((0, 0), (half_window, half_window)))
+    frames = sliding_window_view(padded, window, axis=1)[:, centres] # (rirs, centres, window)
+
+    # weighted fraction of samples outside the standard deviation, normalised to gaussian noise
+    std = np.sqrt(np.sum(weights * frames ** 2, axis=-1))
+    tips = np.abs(frames) > std[..., None]
+    sparse_ed = np.sum(weights * tips, axis=-1) / erfc(1 / np.sqrt(2))
+
+    # linear interpolation between the evaluated windows
+    t = np.arange(centres[-1] + 1)
+    index = np.minimum(t // hop, len(centres) - 2) if len(centres) > 1 else np.zeros_like(t)
+    frac = (t - centres[index]) / hop
+    ed = np.zeros(rirs.shape)
+    if len(centres) > 1: ed[:, :len(t)] = sparse_ed[:, index] * (1 - frac) + sparse_ed[:, index + 1] * frac
+    else: ed[:, 0] = sparse_ed[:, 0]
+
+    t_mix = np.argmax(ed >= 1.0, axis=1)
+    return ed, t_mix
+
+def echo_density(rir, fs, matlab_eng=None, truncate_start=False, plot=False, name='', len_secs=0.25, ref_ed=[], ref_tmix=0):
     # truncate to first non zero sample to remove predelay
     if truncate_start:
         none_zero = np.argmax(rir != 0.0)
         rir = rir[none_zero:]
-        
-    rir_T = rir[..., None] # np.atleast_2d(rir).T
-    
-    # call fdn toolbox 
-    t_mix, ed = matlab_eng.echoDensity(rir_T, 1024, fs, 0, nargout=2)
-    
-    ed = np.array(ed)[0]
-    ed = np.where(np.isfinite(ed), ed, 0)
     
-    t_mix = np.argmax(ed >= 1.0)
+    if matlab_eng is None:
+        ed, t_mix = normalized_echo_density(rir, window=1024)
+        ed, t_mix = ed[0], t_mix[0]
+    else:
+        rir_T = rir[..., None] # np.atleast_2d(rir).T
+        
+        # call fdn toolbox 
+        t_mix, ed = matlab_eng.echoDensity(rir_T, 1024, fs, 0, nargout=2)
+        
+        ed = np.array(ed)[0]
+        ed = np.where(np.isfinite(ed), ed, 0)
+        
+        t_mix = np.argmax(ed >= 1.0)
     
     if plot:
         plot_lim = int(len_secs * fs)
@@ -0,0 +1,71 @@
+# energy decay relief (Jot 1992), the Schroeder backward integral of every stft frequency bin.
+#
+# the stft of a rir is computed once per process and cached by content, so the metrics and the edr of
+# an evaluation share one transform. evaluations run in worker processes, so the spectrogram and edr
+# are also returned in the (on disk cached) evaluation for the plots of the report.
+import numpy as np
+import hashlib
+import librosa
+from collections import OrderedDict
+
+from evaluation.decay_analysis import decay_time
+
+_stft_cache = OrderedDict()
+STFT_CACHE_SIZE = 32
+
+def stft_magnitude(h, n_fft=2048, hop_length=512):
+    """
+    Magnitude stft of a signal (librosa defaults: centred hann frames), cached by the signal contents.
+    Several plots and metrics of the same rir reuse one transform.
+
+    Returns: magnitude (bins, frames), read only as it is shared
+    """
+    h = np.ascontiguousarray(h)
+    key = (hashlib.sha1(h.view(np.uint8)).hexdigest(), h.dtype.str, h.shape, n_fft, hop_length)
+    if key in _stft_cache:
+        _stft_cache.move_to_end(key)
+        return _stft_cache[key]
+
+    magnitude = np.abs(librosa.stft(h, n_fft=n_fft, hop_length=hop_length))
+    magnitude.setflags(write=False)
+    _stft_cache[key] = magnitude
+    if len(_stft_cache) > STFT_CACHE_SIZE: _stft_cache.popitem(last=False)
+    return magnitude
+
+def spectrogram_db(h, n_fft=2048, hop_length=512):
+    """
+    Spectrogram in dB relative to its maximum, as plotted by utils.plot.plot_spectrogram.
+    """
+    return librosa.amplitude_to_db(stft_magnitude(h, n_fft, hop_length), ref=np.max)
+
+def energy_decay_relief(h, fs, n_fft=2048, hop_length=512):
+    """
+    Energy decay relief from the cached stft of a rir.
+
+    Returns: frequencies (bins,), frame times (frames,), edr in dB relative to the total energy of each bin (bins, frames)
+    """
+    power = stft_magnitude(h, n_fft, hop_length) ** 2
+    energy = np.cumsum(power[:, ::-1], axis=1)[:, ::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edr_db = 10 * np.log10(energy / energy[:, :1])
+
+    frequencies = librosa.fft_frequencies(sr=fs, n_fft=n_fft)
+    times = librosa.frames_to_time(np.arange(power.shape[1]), sr=fs, hop_length=hop_length)
+    return frequencies, times, edr_db
+
+def edr_decay_times(edr_db, fs, hop_length=512, start_db=-5.0, decay_db=20.0):
+    """
+    Reverberation time of every frequency bin, a line fit from start_db to start_db - decay_db of the edr
+    extrapolated to -60 dB (T20 by default).
+
+    Returns: decay times in seconds (bins,), 0 where a bin never decays to start_db
+    """
+    return decay_time(edr_db, fs / hop_length, start_db=start_db, decay_db=decay_db)
+
+def edr_decay_rates(edr_db, fs, hop_length=512, start_db=-5.0, decay_db=20.0):
+    """
+    Returns: decay rate of every frequency bin in dB per second (bins,), 0 where a bin never decays to start_db
+    """
+    decay_times = edr_decay_times(edr_db, fs, hop_length, start_db, decay_db)
+    with np.errstate(divide='ignore'):
+        return np.where(decay_times > 0, 60.0 / decay_times, 0.0)
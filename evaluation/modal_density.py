@@ -1,62 +1,26 @@
 import numpy as np
 from matplotlib import pyplot as plt
-from librosa import power_to_db
 
 def modal_density(h, fs, band=-1, rt60=1, plot=False, name=''):
-    magnitude_spectrum = np.abs(np.fft.fft(h))
-
-    # only consider the first half of the spectrum (positive frequencies)
-    frequencies = np.fft.fftfreq(len(h), d=1/fs)
-    positive_freq_indices = np.where(frequencies >= 0)
-    magnitude_spectrum = magnitude_spectrum[positive_freq_indices]
-    magnitude_spectrum = power_to_db(magnitude_spectrum ** 2, ref=np.max)
-    frequencies = frequencies[positive_freq_indices]
-    
+    frequencies, magnitude_spectrum = magnitude_spectrum_db(h, fs)
+    magnitude_spectrum = magnitude_spectrum[0]
+
     if band != -1:
-        # define the octave band range
-        lower_bound = band / np.sqrt(2)
-        upper_bound = band * np.sqrt(2)
-        
-        # get frequencies for the 500 Hz octave band
-        band_indices = np.where((frequencies >= lower_bound) & (frequencies <= upper_bound))
-
-        # frequency and magnitude spectrum
-        frequencies = frequencies[band_indices]
-        magnitude_spectrum = magnitude_spectrum[band_indices]
-       
-    peaks = []
-    for i in range(len(frequencies)):
-        if i > 0 and i < len(frequencies) - 1:
-            curr = {
-                'amplitude': magnitude_spectrum[i],
-                'freq': frequencies[i]
-            }
-            prev = {
-                'amplitude': magnitude_spectrum[i - 1],
-                'freq': frequencies[i - 1]
-            }
-            next = {
-                'amplitude': magnitude_spectrum[i + 1],
-                'freq': frequencies[i + 1]
-            }
-            peak = parabolic_peak_pick(
-                curr,
-                prev,
-                next,
-            )
-            
-            if peak != None:
-                peaks.append(peak)
-    
-    peak_freq = [freq[0] for freq in peaks]
-    peak_amp = [amp[1] for amp in peaks]
-        
-    num_peaks = len(peaks)
+        # frequency and magnitude spectrum of the octave band
+        band_indices = octave_band_bins(frequencies, [band])[0]
+        frequencies = frequencies[band_indices[0]:band_indices[1]]
+        magnitude_spectrum = magnitude_spectrum[band_indices[0]:band_indices[1]]
+
+    is_peak, peak_freq, peak_amp = parabolic_peaks(magnitude_spectrum, frequencies)
+    peak_freq = peak_freq[is_peak]
+    peak_amp = peak_amp[is_peak]
+
+    num_peaks = len(peak_freq)
     frequency_range = frequencies[-1] - frequencies[0]
     modal_density = num_peaks / frequency_range
     is_shroeder_min, min_modes = shroeder_min(frequency_range, num_peaks, rt60)
-    
-    if plot:    
+
+    if plot:
         plt.figure(figsize=(10, 4))
         plt.title(f'Spectral Peak Picking {name}')
         plt.plot(frequencies, magnitude_spectrum, label='Magnitude Spectrum')
@@ -64,48 +28,95 @@ def modal_density(h, fs, band=-1, rt60=1, plot=False, name=''):
         plt.ylabel('Magnitude (Normalised dB)')
         plt.xlabel('Frequency (Hz)')
         plt.legend()
-    
+
     return num_peaks, modal_density, is_shroeder_min
 
-def parabolic_peak_pick(curr, prev, next, threshold=-40):
+def modal_densities(h, fs, bands, rt60s=1, threshold=-40):
+    """
+    Modal density of several octave bands of several impulse responses in one pass,
+    the peaks of the full spectrum are found once and counted per band with a cumulative sum.
+
+    Params:
+    h: impulse response (length,) or batch of equal length impulse responses (rirs, length)
+    bands: octave band centre frequencies
+    rt60s: reverberation time for the Schroeder minimum, broadcast to (rirs, bands)
+
+    Returns: number of peaks, modal density, Schroeder minimum met, each of shape (rirs, bands)
+    """
+    frequencies, magnitude_spectrum = magnitude_spectrum_db(h, fs)
+    is_peak, _, _ = parabolic_peaks(magnitude_spectrum, frequencies, threshold=threshold)
+
+    # peaks strictly inside each band, the first and last bin of a band have no neighbour in the band
+    band_indices = octave_band_bins(frequencies, bands)
+    peak_count = np.concatenate((np.zeros((is_peak.shape[0], 1), dtype=int), np.cumsum(is_peak, axis=-1)), axis=-1)
+    num_peaks = peak_count[:, band_indices[:, 1] - 1] - peak_count[:, band_indices[:, 0] + 1]
+
+    frequency_range = frequencies[band_indices[:, 1] - 1] - frequencies[band_indices[:, 0]]
+    min_modes = 0.15 * np.broadcast_to(rt60s, num_peaks.shape) * frequency_range
+    return num_peaks, num_peaks / frequency_range, num_peaks >= min_modes
+
+def magnitude_spectrum_db(h, fs, amin=1e-10, top_db=80.0):
+    """
+    Power spectrum in dB relative to the maximum of each impulse response (librosa power_to_db with ref=np.max).
+    The Nyquist bin of an even length rfft is dropped, as it is a negative fft frequency.
+
+    Returns: frequencies (bins,), magnitude spectrum (rirs, bins)
+    """
+    h = np.atleast_2d(h)
+    frequencies = np.fft.rfftfreq(h.shape[-1], d=1/fs)
+    power = np.abs(np.fft.rfft(h, axis=-1)) ** 2
+    if h.shape[-1] % 2 == 0:
+        frequencies = frequencies[:-1]
+        power = power[:, :-1]
+
+    magnitude_spectrum = 10 * np.log10(np.maximum(amin, power))
+    magnitude_spectrum -= 10 * np.log10(np.maximum(amin, np.max(power, axis=-1, keepdims=True)))
+    return frequencies, np.maximum(magnitude_spectrum, np.max(magnitude_spectrum, axis=-1, keepdims=True) - top_db)
+
+def octave_band_bins(frequencies, bands):
+    """
+    Returns: first and one past the last bin of each octave band (bands, 2)
+    """
+    bands = np.asarray(bands, dtype=float)
+    lower = np.searchsorted(frequencies, bands / np.sqrt(2), side='left')
+    upper = np.searchsorted(frequencies, bands * np.sqrt(2), side='right')
+    return np.stack((lower, upper), axis=1)
+
+def parabolic_peaks(magnitude_spectrum, frequencies, threshold=-40):
     """
-    Spectral peak picking via parabolic interpolation.
+    Spectral peak picking via parabolic interpolation of every bin at once.
     https://ccrma.stanford.edu/~jos/sasp/Peak_Detection_Steps_3.html
-    
-    Frequencies tend to be about twice as accurate when dB magnitude is used 
+
+    Frequencies tend to be about twice as accurate when dB magnitude is used
     rather than just linear magnitude.
-    
+
     Parameters:
-    - curr: dict with keys 'freq' and 'amplitude'
-    - prev: dict with keys 'freq' and 'amplitude'
-    - next: dict with keys 'freq' and 'amplitude'
+    - magnitude_spectrum: dB magnitudes (..., bins)
+    - frequencies: frequency of each bin (bins,)
     - threshold: Minimum amplitude (in dB) to consider a peak significant
-    
+
     Returns:
-    - A dictionary containing 'peak_frequency' and 'peak_amplitude' if a peak is found,
-      or None if no peak is found.
+    - local maxima above the threshold, interpolated peak frequency and amplitude, each of shape (..., bins)
     """
-    
-    if(
-      curr['amplitude'] > prev['amplitude'] and 
-      curr['amplitude'] > next['amplitude'] and 
-      curr['amplitude'] > threshold
-    ):
-        bin = (0.5 * (prev['amplitude'] - next['amplitude'])) / (prev['amplitude'] - 2.0 * curr['amplitude'] + next['amplitude'])
-        
-        peak_freq = curr['freq'] + 0.5 * (next['freq'] - prev['freq']) * bin
-        peak_amp  = curr['amplitude'] - 0.25 * (prev['amplitude'] - next['amplitude']) * bin
-        peak = [ 
-            peak_freq,
-            peak_amp,
-        ]
-        
-        return peak
-    
+    prev = magnitude_spectrum[..., :-2]
+    curr = magnitude_spectrum[..., 1:-1]
+    next = magnitude_spectrum[..., 2:]
+
+    is_peak = np.zeros(magnitude_spectrum.shape, dtype=bool)
+    is_peak[..., 1:-1] = (curr > prev) & (curr > next) & (curr > threshold)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bin = (0.5 * (prev - next)) / (prev - 2.0 * curr + next)
+    peak_freq = np.zeros(magnitude_spectrum.shape)
+    peak_amp = np.zeros(magnitude_spectrum.shape)
+    peak_freq[..., 1:-1] = frequencies[1:-1] + 0.5 * (frequencies[2:] - frequencies[:-2]) * bin
+    peak_amp[..., 1:-1] = curr - 0.25 * (prev - next) * bin
+    return is_peak, peak_freq, peak_amp
+
 def shroeder_min(frequnecy_resolution, num_modes, rt60):
     """
     Schroeder's formula for minimum number of modes.
-    Colorless artificial reverberation (M. R. Schroeder and B. F. Logan, 1961) 
+    Colorless artificial reverberation (M. R. Schroeder and B. F. Logan, 1961)
     """
     min_modes = (0.15 * rt60 * frequnecy_resolution)
-    return  num_modes >= min_modes, int(min_modes)
\ No newline at end of file
+    return  num_modes >= min_modes, int(min_modes)
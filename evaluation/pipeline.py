@@ -0,0 +1,155 @@
+# evaluation pipeline for rendered room impulse responses.
+#
+# rirs are evaluated in parallel worker processes and each result is stored on disk, keyed by a
+# hash of the wav file contents, so re-running a report only evaluates new or changed rirs.
+# the reference and theory values are computed once by the caller and are not part of a rir evaluation.
+import numpy as np
+import hashlib
+import pickle
+from os import path, makedirs, listdir, replace
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.signals import signal
+from evaluation.echo_density import echo_density
+from evaluation.modal_density import modal_density
+from evaluation.decay_analysis import decay_analysis
+from evaluation.energy_decay_relief import energy_decay_relief, edr_decay_times, spectrogram_db
+
+# bump when evaluate changes, so cached results are recomputed
+CACHE_VERSION = 3
+
+def get_rir(dir, file, norm=True, invert=False):
+    name = file[:len(file)-4]
+    rir, fs = signal('file', file, data_dir=dir, file_name=file)
+    if invert: rir = rir * -1
+    if norm: rir = rir / np.max(np.abs(rir))
+    return {
+        "name": name,
+        "rir": rir,
+        "fs": fs,
+        "hash": wav_hash(dir, file),
+    }
+
+def get_rirs(dir):
+    rir_files = sorted(file for file in listdir(dir) if file.endswith('.wav'))
+    return [get_rir(dir, file) for file in rir_files]
+
+def wav_hash(dir, file):
+    """
+    Returns: sha1 hex digest of the wav file contents
+    """
+    sha1 = hashlib.sha1()
+    with open(path.join(dir, file), 'rb') as wav:
+        for chunk in iter(lambda: wav.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def evaluate(fs, h, name, octave_band=4000.0):
+    """
+    Metrics of one impulse response, independent of the reference and theory values.
+
+    Returns: dict of RT60 per octave band, broadband RT60, EDT, C50, C80, D50, decay time per stft bin from the edr,
+    echo density, mixing time, modal density, and the spectrogram and edr in dB (float32) for plotting
+    """
+    # octave bands and broadband (last) decay parameters from one filter pass
+    decay = decay_analysis(h, fs, broadband=True)
+    rt60_bands = dict(zip(decay['centers'], decay['RT60'][0, :-1]))
+
+    # T20 of every stft bin from the energy decay relief
+    edr_frequencies, _, edr_db = energy_decay_relief(h, fs)
+
+    ed, t_mix = echo_density(h, fs, truncate_start=False, plot=False, name=name)
+
+    num_modes, md, is_shroeder_min = modal_density(
+        h,
+        fs,
+        name=name,
+        band=int(octave_band),
+        rt60=rt60_bands[octave_band],
+        plot=False,
+    )
+
+    return {
+        'rt60_bands': rt60_bands,
+        'RT60': decay['RT60'][0, -1],
+        'EDT': decay['EDT'][0, -1],
+        'C50': decay['C50'][0, -1],
+        'C80': decay['C80'][0, -1],
+        'D50': decay['D50'][0, -1],
+        'edr_frequencies': edr_frequencies,
+        'edr_decay_times': edr_decay_times(edr_db, fs),
+        # the stft cache lives in the worker process, the report plots these instead of transforming again
+        'spectrogram_db': spectrogram_db(h).astype(np.float32),
+        'edr_db': edr_db.astype(np.float32),
+        'echo_density': ed,
+        't_mix': t_mix,
+        f'Modal Density {int(octave_band)} Hz': md,
+        f'Total Modes {int(octave_band)} Hz': num_modes,
+        'is_shroeder_min': is_shroeder_min,
+    }
+
+class EvaluationCache:
+    """
+    On disk cache of rir evaluations, one pickle per wav content hash and evaluation settings.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not path.exists(cache_dir): makedirs(cache_dir)
+
+    def key(self, rir_hash, octave_band):
+        return f'{rir_hash}-{int(octave_band)}-v{CACHE_VERSION}'
+
+    def _path(self, key):
+        return path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, key):
+        if not path.exists(self._path(key)): return None
+        try:
+            with open(self._path(key), 'rb') as file:
+                return pickle.load(file)
+        except (pickle.UnpicklingError, EOFError): # partially written, evaluate again
+            return None
+
+    def set(self, key, evaluation):
+        # write then rename, so an interrupted run never leaves a partial entry under the key
+        temp_path = f'{self._path(key)}.tmp'
+        with open(temp_path, 'wb') as file:
+            pickle.dump(evaluation, file)
+        replace(temp_path, self._path(key))
+
+def _evaluate_rir(args):
+    fs, h, name, octave_band = args
+    return evaluate(fs, h, name, octave_band=octave_band)
+
+def evaluate_rirs(rirs, octave_band=4000.0, cache_dir=None, max_workers=None):
+    """
+    Evaluate rirs in a process pool, reusing cached evaluations of unchanged wav files.
+    The evaluation is stored in rir['evaluation'].
+
+    Params:
+    rirs: list of rir dicts from get_rir
+    cache_dir: directory of the evaluation cache, None to always evaluate
+    max_workers: number of worker processes, None for the number of cpus
+
+    Returns: rirs
+    """
+    cache = EvaluationCache(cache_dir) if cache_dir is not None else None
+
+    missing = []
+    for rir in rirs:
+        evaluation = cache.get(cache.key(rir['hash'], octave_band)) if cache is not None else None
+        if evaluation is None: missing.append(rir)
+        else: rir['evaluation'] = evaluation
+
+    if len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            evaluations = executor.map(_evaluate_rir, [(rir['fs'], rir['rir'], rir['name'], octave_band) for rir in missing])
+            evaluations = list(evaluations)
+    else:
+        evaluations = [_evaluate_rir((rir['fs'], rir['rir'], rir['name'], octave_band)) for rir in missing]
+
+    for rir, evaluation in zip(missing, evaluations):
+        rir['evaluation'] = evaluation
+        if cache is not None: cache.set(cache.key(rir['hash'], octave_band), evaluation)
+
+    return rirs
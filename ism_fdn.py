@@ -1,28 +1,37 @@
 import numpy as np
 from math import sqrt
+from concurrent.futures import Future
 
-from utils.matlab import init_matlab_eng
 from config import SimulationConfig, RoomConfig
 from early_reflections.ism import ImageSourceMethod
 from early_reflections.early_reflections import EarlyReflections
 from utils.point3D import Point3D
 from utils.reverb_time import ReverbTime
 from utils.absorption import Absorption
-from utils.filters import tone_correction
+from utils.filters import tone_correction, tone_correction_filter
+from utils.convolve import PartitionedConvolver
+from utils.performance import Performance
 from utils.primes import find_closest_primes, is_mutually_prime
-from utils.delay import delay_array
+from utils.delay import delay_array, delay_arrays, FRAC_FILTER_N
 from utils.plot import plot_comparison
+from late_reverberation import fdn
+from utils.matlab import MatlabEnginePool
 
 class ISMFDN:
-    def __init__(self, fs: float, simulation_config: SimulationConfig, room_config: RoomConfig, matlab_eng, fdn_N=-1, crossover_freq_multiple=4, processing_type='parallel', plot=False):
-        self.matlab_eng = matlab_eng
+    def __init__(self, fs: float, simulation_config: SimulationConfig, room_config: RoomConfig, matlab_eng=None, fdn_N=-1, crossover_freq_multiple=4, processing_type='parallel', fdn_engine='matlab', absorption: Absorption=None, image_sources=None, plot=False):
+        self.fdn_engine = fdn_engine # 'matlab' or 'python' (late_reverberation/fdn.py)
+        assert fdn_engine == 'python' or matlab_eng is not None, 'MATLAB FDN engine requires matlab_eng'
+        # a MatlabEnginePool or a single engine, the owner of the engines quits them
+        if isinstance(matlab_eng, MatlabEnginePool) or matlab_eng is None: self.matlab_pool = matlab_eng
+        else: self.matlab_pool = MatlabEnginePool(engine_factory=lambda: matlab_eng)
         self.fs = fs
         self.fdn_N = fdn_N # TODO: From config
         self.crossover_freq_multiple = crossover_freq_multiple
         self.processing_type = processing_type
             
-        # get the absoprtion coefficients at frequnecy bands for each wall
-        self.absorption = Absorption(room_config.WALL_MATERIALS, room_config.MATERIALS_DIR, self.fs) # pass object
+        # get the absoprtion coefficients at frequnecy bands for each wall, shared when rendering a batch
+        if absorption is None: absorption = Absorption(room_config.WALL_MATERIALS, room_config.MATERIALS_DIR, self.fs)
+        self.absorption = absorption
             
         self.absorption_coeffs = self.absorption.coefficients + self.absorption.air_absorption
         self.absorption_bands = self.absorption.freq_bands
@@ -35,11 +44,14 @@ class ISMFDN:
         self.rt60_sabine_bands_500 = self.rt60_sabine[2]
         self.tranistion_frequency = reverb_time.transition_frequency(self.rt60_sabine_bands_500, multiple=self.crossover_freq_multiple)
 
-        # find image sources up to Nth order 
-        ism = ImageSourceMethod(room_config, fs=self.fs) # pass specific config values instead
-        ism_er_rir = ism.process(norm=True) # rendering early reflections with pyroomacoustics ism
-        image_source_coords, image_source_walls = ism.get_source_coords(plot=plot)
-        image_source_points = [Point3D(image_source) for image_source in image_source_coords]
+        # find image sources up to Nth order, or use those found for a batch of positions
+        ism = ImageSourceMethod(room_config, fs=self.fs, c=simulation_config.SPEED_OF_SOUND, absorption=self.absorption)
+        if image_sources is None: image_sources = ism.image_sources(direct_path=True)
+        ism_er_rir = ism.render_rir(image_sources, norm=True) # rendering early reflections from the same image sources
+        if plot: ism.get_source_coords(plot=plot)
+        reflections = image_sources['orders'] > 0
+        image_source_points = [Point3D(image_source) for image_source in image_sources['coords'][reflections]]
+        image_source_walls = image_sources['walls'][reflections].tolist()
         source_point = Point3D(room_config.SOURCE_LOC)
         mic_point = Point3D(room_config.MIC_LOC)
 
@@ -65,8 +77,8 @@ class ISMFDN:
             self.fdn_N = len(self.fdn_delay_times)
         assert self.fdn_N <= len(self.fdn_delay_times), 'FDN order exceeds delays'
 
-        # get closest primes to image source delay times
-        self.fdn_delay_times = np.array([int(delay_sec * self.fs) for delay_sec in set(self.fdn_delay_times)])
+        # get closest primes to image source delay times, equal delays are moved to the next free prime
+        self.fdn_delay_times = np.array([int(delay_sec * self.fs) for delay_sec in self.fdn_delay_times])
         self.fdn_delay_times = find_closest_primes(self.fdn_delay_times)
 
         # if FDN order is power of two use a Hadamard otherwise use a random matrix
@@ -104,23 +116,20 @@ class ISMFDN:
         if type == 'fdn_only': return self.process_only_fdn(x)
             
     def process_only_fdn(self, x):               
-        y =  self.matlab_eng.standard_fdn(
+        return self.run_fdn(
+            'standard_fdn',
             self.fs,
             x * self.fdn_scaling_factor, 
             self.fdn_delay_times, 
             self.rt60_sabine
-        )
-        # end matlab process
-        self.matlab_eng.quit()
-        # mono
-        y = np.array([t[0] for t in y])
-        return y
+        ).result()
         
     def process_parallel(self, x, y):
-        er_tdl, direct_sound = self.early_reflections.process(x, y, type='tdl')
+        er_tdl, direct_sound = self.early_reflections.process(x, y, type='grouped')
         
 
-        lr_one_pole = self.matlab_eng.velvet_fdn_one_pole(
+        lr_one_pole = self.run_fdn(
+            'velvet_fdn_one_pole',
             self.fs, 
             x * self.fdn_scaling_factor, 
             self.fdn_delay_times, 
@@ -130,7 +139,8 @@ class ISMFDN:
             self.matrix_type
         )
         
-        lr_fir      = self.matlab_eng.velvet_fdn_fir(
+        lr_fir      = self.run_fdn(
+            'velvet_fdn_fir',
             self.fs, 
             x * self.fdn_scaling_factor, 
             self.fdn_delay_times, 
@@ -141,12 +151,12 @@ class ISMFDN:
             self.lr_fir_nyquist_decay_type
         )
 
-        lr_one_pole = np.array([t[0] for t in lr_one_pole])
-        lr_fir      = np.array([t[0] for t in lr_fir])
+        # both variants run concurrently when the pool has more than one engine
+        lr_one_pole = lr_one_pole.result()
+        lr_fir      = lr_fir.result()
 
         # align late reverb with early reflections. 
-        lr_one_pole = delay_array(lr_one_pole, self.first_er_delay, self.fs)
-        lr_fir      = delay_array(lr_fir, self.first_er_delay - self.lr_fir_group_delay, self.fs)  
+        lr_one_pole, lr_fir = delay_arrays(np.array([lr_one_pole, lr_fir]), [self.first_er_delay, self.first_er_delay - self.lr_fir_group_delay], self.fs)
 
         lr_one_pole = tone_correction(
                 lr_one_pole, 
@@ -170,11 +180,17 @@ class ISMFDN:
         return rir_one_pole, rir_fir
           
     def process_serial(self, x, y):
-        er_tdl,             direct_sound = self.early_reflections.process(x, y, type='tdl')
-        er_signal_multi,    direct_sound = self.early_reflections.process(x, y, type='multi-channel')
+        er_tdl,             direct_sound = self.early_reflections.process(x, y, type='grouped')
+        er_signal_multi,    direct_sound = self.early_reflections.process(x, y, type='sparse-multi-channel')
+
+        # the MISO FDNs feed every delay line the sum of the inputs, so MATLAB is sent the mono sum
+        # and the numpy engine renders the image source taps a block at a time
+        er_signal_sum = er_signal_multi.mixed(np.ones((1, er_signal_multi.shape[0])))
+        fdn_input_multi = er_signal_multi if self.fdn_engine == 'python' else er_signal_sum.render()
 
         # apply FDN reverberation to output of early reflection stage
-        lr_one_pole = self.matlab_eng.velvet_fdn_one_pole(
+        lr_one_pole = self.run_fdn(
+            'velvet_fdn_one_pole',
             self.fs, 
             er_tdl * self.fdn_scaling_factor, 
             self.fdn_delay_times, 
@@ -184,9 +200,10 @@ class ISMFDN:
             self.matrix_type
         )
         
-        lr_one_pole_multi = self.matlab_eng.velvet_fdn_one_pole(
+        lr_one_pole_multi = self.run_fdn(
+            'velvet_fdn_one_pole',
             self.fs, 
-            er_signal_multi * self.fdn_scaling_factor, 
+            fdn_input_multi * self.fdn_scaling_factor, 
             self.fdn_delay_times, 
             self.rt60_sabine, 
             self.absorption_bands, 
@@ -194,7 +211,8 @@ class ISMFDN:
             self.matrix_type
         )
         
-        lr_fir = self.matlab_eng.velvet_fdn_fir(
+        lr_fir = self.run_fdn(
+            'velvet_fdn_fir',
             self.fs, 
             er_tdl * self.fdn_scaling_factor, 
             self.fdn_delay_times, 
@@ -204,10 +222,9 @@ class ISMFDN:
             self.lr_fir_taps, 
             self.lr_fir_nyquist_decay_type
         )
-        # mono
-        lr_one_pole       = np.array([x[0] for x in lr_one_pole])
-        lr_one_pole_multi = np.array([x[0] for x in lr_one_pole_multi])
-        lr_fir            = np.array([x[0] for x in lr_fir])
+        lr_one_pole       = lr_one_pole.result()
+        lr_one_pole_multi = lr_one_pole_multi.result()
+        lr_fir            = lr_fir.result()
 
         # tonal correction filter (gains = average of room absorption coefficients)
         filter_taps = 200
@@ -222,13 +239,79 @@ class ISMFDN:
 
         # combine direct sound, early and late reflections to create full RIRs
         one_pole_rir                  = direct_sound + er_tdl + lr_one_pole
-        one_pole_mutli_rir            = direct_sound + np.sum(er_signal_multi, axis=0) + lr_one_pole_multi
+        one_pole_mutli_rir            = direct_sound + er_signal_sum.render()[0] + lr_one_pole_multi
         one_pole_tonal_correction_rir = direct_sound + er_tdl + lr_one_pole_tonal_correction
         fir_rir                       = direct_sound + er_tdl + lr_fir
 
         # TODO: return dict with name for plotting 
         return one_pole_tonal_correction_rir, fir_rir
         
+    def start_stream(self, block_size=256, variant='fir', seed=None):
+        """
+        Set up the stateful processor used by stream(), the late reverberation runs on the numpy FDN engine.
+
+        Params:
+        block_size: samples per block, the stream latency is block_size + stream_latency samples
+        variant: 'one_pole' or 'fir' late reverberation as in process_parallel
+        seed: seed of the random feedback matrix
+        """
+        self.stream_block_size = block_size
+        # fractional delays are centred on the integer delay, short delays look ahead up to half the longest kernel
+        # (the early reflection taps, and delay_array of the direct sound and late reverberation)
+        frac_filter_N = max(self.early_reflections.tapped_delay_line.frac_filter_N, FRAC_FILTER_N)
+        self.stream_latency = (frac_filter_N - 1) // 2
+
+        # direct sound and early reflections rendered once as an impulse response
+        filter_length = max(len(b) for b in self.early_reflections.wall_filter_coeffs)
+        early_length = self.stream_latency + int(np.ceil(max(self.early_reflections.delay_times) * self.fs)) + filter_length + frac_filter_N
+        impulse = np.zeros(early_length)
+        impulse[self.stream_latency] = 1
+        er, direct_sound = self.early_reflections.process(impulse, np.zeros_like(impulse), type='grouped')
+
+        # late reverberation alignment and tone correction are linear, so they are applied to the fdn input
+        if variant == 'one_pole':
+            self.stream_fdn = fdn.velvet_fdn_one_pole_network(self.fs, self.fdn_delay_times, self.rt60_sabine, self.absorption_bands, self.tranistion_frequency, self.matrix_type, seed=seed)
+            lr_delay = self.first_er_delay
+            tone_filter = tone_correction_filter(self.absorption_coeffs, self.absorption_bands, self.fs, taps=self.tone_correction_taps)
+        if variant == 'fir':
+            self.stream_fdn = fdn.velvet_fdn_fir_network(self.fs, self.fdn_delay_times, self.rt60_sabine, self.absorption_bands, self.matrix_type, self.lr_fir_taps, self.lr_fir_nyquist_decay_type, seed=seed)
+            lr_delay = self.first_er_delay - self.lr_fir_group_delay
+            tone_filter = np.ones(1)
+        impulse = np.zeros(self.stream_latency + int(lr_delay * self.fs) + frac_filter_N)
+        impulse[self.stream_latency] = 1
+        lr_kernel = np.convolve(delay_array(impulse, lr_delay, self.fs), tone_filter) * self.fdn_scaling_factor
+
+        kernels = np.zeros((2, max(early_length, len(lr_kernel))))
+        kernels[0, :early_length] = direct_sound + er
+        kernels[1, :len(lr_kernel)] = lr_kernel
+        self.stream_convolver = PartitionedConvolver(kernels, block_size)
+
+    def stream(self, block):
+        """
+        Process the next block of a live input, the delay line, filter and FDN states are kept between calls.
+        start_stream() must be called first, the output lags process_parallel by stream_latency samples.
+        Blocks must be block_size samples, a shorter block ends the stream.
+
+        Returns: output block (numpy array), (real time, 10x real time) deadline of the block met
+        """
+        performance = Performance(self.fs, len(block))
+        early, lr_input = self.stream_convolver.process(block)
+        output = early + self.stream_fdn.process(lr_input)[0]
+        performance.get_time()
+        return output, performance.is_real_time()
+
+    def run_fdn(self, name, *args):
+        """
+        Start one of the late reverberation FDNs with the MATLAB fdnToolbox or the numpy engine.
+
+        Returns: future, result() gives the mono output (numpy array)
+        """
+        if self.fdn_engine == 'python':
+            future = Future()
+            future.set_result(getattr(fdn, name)(*args))
+            return future
+        return _MonoFuture(self.matlab_pool.submit(name, *args))
+
     @staticmethod
     def is_power_of_2(n):
         """
@@ -236,4 +319,12 @@ class ISMFDN:
         
         Returns (bool): power of two truth.
         """
-        return n > 0 and (n & (n - 1)) == 0
\ No newline at end of file
+        return n > 0 and (n & (n - 1)) == 0
+
+class _MonoFuture:
+    # first output channel of a MATLAB FDN (length, outputs)
+    def __init__(self, future):
+        self.future = future
+
+    def result(self):
+        return self.future.result()[:, 0]
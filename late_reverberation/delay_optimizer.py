@@ -0,0 +1,150 @@
+# search for fdn delay sets from analytic proxies of the modal and echo density.
+#
+# candidate sets are sampled from a pool of primes, so every set is mutually prime, and all
+# candidates are scored at once as a (candidates, N) array:
+#
+#   modes:  an fdn has sum(m) poles, sum(m) / 2 modes below nyquist, compared with schroeder's minimum
+#   mfp:    log spread of the delays around the mean free path delay of the room, or the mean delay
+#           schroeder's minimum needs when that is longer (the modes cost can't be met below it)
+#   spacing: closest log ratio of neighbouring delays, near equal delays (e.g. twin primes)
+#           share their modes and echoes and add little density
+#   echoes: the number of recirculation paths arriving before t grows as t^N / (N! prod(m)),
+#           so the time the echo density reaches a target follows from sum(log(m)).
+#           it is compared with the mixing time estimate sqrt(V) ms.
+import numpy as np
+from scipy.special import gammaln
+
+from evaluation.modal_density import shroeder_min
+from utils.room import calc_mean_free_path
+from utils.primes import primes_below
+
+def delay_pool(min_delay, max_delay):
+    """
+    Returns: primes in [min_delay, max_delay]
+    """
+    primes = primes_below(max_delay + 1)
+    return primes[np.searchsorted(primes, min_delay):]
+
+def sample_delay_sets(pool, N, num_candidates, rng):
+    """
+    N distinct primes of the pool per candidate, log uniformly distributed (weighted sampling
+    without replacement with the Gumbel top-k trick).
+
+    Returns: sorted delay sets (num_candidates, N)
+    """
+    log_weights = -np.log(pool)
+    keys = log_weights + rng.gumbel(size=(num_candidates, len(pool)))
+    chosen = np.argpartition(-keys, N - 1, axis=1)[:, :N]
+    return np.sort(pool[chosen], axis=1)
+
+def modal_density_cost(delay_sets, fs, rt60):
+    """
+    Relative shortfall of modes below Schroeder's minimum, plus the relative excess total delay (memory and cost).
+    """
+    num_modes = np.sum(delay_sets, axis=-1) / 2
+    _, min_modes = shroeder_min(fs / 2, num_modes, rt60)
+    min_modes = max(min_modes, 1)
+    shortfall = np.maximum(min_modes - num_modes, 0) / min_modes
+    excess = np.maximum(num_modes - min_modes, 0) / min_modes
+    return 10 * shortfall + 0.1 * excess
+
+def mean_free_path_cost(delay_sets, mean_free_path_delay, spread):
+    """
+    Squared log distance of the delays' geometric mean from the mean free path delay,
+    and of their log standard deviation from the target spread.
+    """
+    log_delays = np.log(delay_sets)
+    centre = np.mean(log_delays, axis=-1) - np.log(mean_free_path_delay)
+    spread_error = np.std(log_delays, axis=-1) - spread
+    return centre ** 2 + spread_error ** 2
+
+def spacing_cost(delay_sets, min_log_ratio):
+    """
+    Relative shortfall of the closest log ratio of neighbouring (sorted) delays below min_log_ratio.
+    """
+    closest = np.min(np.diff(np.log(delay_sets), axis=-1), axis=-1)
+    return np.maximum(min_log_ratio - closest, 0) / min_log_ratio
+
+def echo_buildup_time(delay_sets, fs, echo_density=2000.0):
+    """
+    Time in seconds the expected echo density (echoes per second) of the recirculating paths reaches echo_density.
+    With P(t) ~ t^N / (N! prod(m)) paths arriving before t the density is t^(N-1) / ((N-1)! prod(m)).
+    """
+    N = delay_sets.shape[-1]
+    log_density = np.log(echo_density / fs) # echoes per sample
+    log_time = (log_density + gammaln(N) + np.sum(np.log(delay_sets), axis=-1)) / (N - 1)
+    return np.exp(log_time) / fs
+
+def echo_buildup_cost(delay_sets, fs, mixing_time, echo_density=2000.0):
+    """
+    Log ratio of the echo build up time to the mixing time, when it is later.
+    """
+    return np.maximum(np.log(echo_buildup_time(delay_sets, fs, echo_density) / mixing_time), 0)
+
+def target_delay(fs, N, rt60, mean_free_path_delay):
+    """
+    Geometric mean the delays are centred on: the mean free path delay, or the mean delay of N lines meeting
+    schroeder's minimum mode count when that is longer. Log normally spread delays have an arithmetic mean
+    above their geometric mean, so a set centred here meets the minimum.
+    """
+    _, min_modes = shroeder_min(fs / 2, 0, rt60)
+    return max(mean_free_path_delay, 2 * min_modes / N)
+
+def delay_set_cost(delay_sets, fs, rt60, mean_free_path_delay, mixing_time, spread=0.3, min_log_ratio=0.05, weights=(1.0, 1.0, 1.0, 1.0)):
+    """
+    Weighted modal density, mean free path, echo build up and spacing costs of every candidate, lower is better.
+    The delays are centred on target_delay of the mean free path delay.
+
+    Returns: cost (candidates,)
+    """
+    delay_sets = np.asarray(delay_sets, dtype=float)
+    centre_delay = target_delay(fs, delay_sets.shape[-1], rt60, mean_free_path_delay)
+    return (
+        weights[0] * modal_density_cost(delay_sets, fs, rt60)
+        + weights[1] * mean_free_path_cost(delay_sets, centre_delay, spread)
+        + weights[2] * echo_buildup_cost(delay_sets, fs, mixing_time)
+        + weights[3] * spacing_cost(delay_sets, min_log_ratio)
+    )
+
+def optimise_delays(fs, N, room_dims, rt60, c=343.0, num_candidates=8192, batch_size=1024, spread=0.3, min_log_ratio=0.05, weights=(1.0, 1.0, 1.0, 1.0), reference=None, seed=None):
+    """
+    Search for a mutually prime delay set of N delay lines for a room.
+
+    Params:
+    room_dims: [ length, width, height ] in meters
+    rt60: reverberation time used for Schroeder's minimum mode count, a single value or the bands (the maximum is used)
+    num_candidates: number of candidate sets scored
+    spread: target standard deviation of the log delays
+    min_log_ratio: closest log ratio of neighbouring delays before the spacing cost applies
+    weights: weights of the modal density, mean free path, echo build up and spacing costs
+    reference: known good delay set (N,), returned instead when no candidate scores lower
+
+    Returns: delays in samples (N,), cost
+    """
+    rng = np.random.default_rng(seed)
+    rt60 = float(np.max(rt60))
+    V = room_dims[0] * room_dims[1] * room_dims[2]
+    L, W, H = room_dims
+    S = 2 * (L * H + W * H + L * W)
+    mean_free_path_delay = calc_mean_free_path(V, S) / c * fs
+    mixing_time = np.sqrt(V) / 1000 # sqrt(V) ms
+
+    # the pool covers the target spread around the delay the cost is centred on
+    centre_delay = target_delay(fs, N, rt60, mean_free_path_delay)
+    max_delay = centre_delay * np.exp(3 * spread)
+    min_delay = max(centre_delay * np.exp(-3 * spread), 2)
+    pool = delay_pool(int(min_delay), int(np.ceil(max_delay)))
+    assert len(pool) >= N, 'not enough primes in the delay range for N delays'
+
+    best_delays, best_cost = None, np.inf
+    if reference is not None:
+        best_delays = np.sort(np.asarray(reference))
+        best_cost = delay_set_cost(best_delays[None], fs, rt60, mean_free_path_delay, mixing_time, spread, min_log_ratio, weights)[0]
+    for start in range(0, num_candidates, batch_size):
+        delay_sets = sample_delay_sets(pool, N, min(batch_size, num_candidates - start), rng)
+        cost = delay_set_cost(delay_sets, fs, rt60, mean_free_path_delay, mixing_time, spread, min_log_ratio, weights)
+        best = np.argmin(cost)
+        if cost[best] < best_cost:
+            best_delays, best_cost = delay_sets[best], cost[best]
+
+    return best_delays, best_cost
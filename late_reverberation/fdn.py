@@ -0,0 +1,352 @@
+# feedback delay network engine, a numpy port of the fdnToolbox functions used by
+# velvet_fdn_one_pole.m, velvet_fdn_fir.m and standard_fdn.m.
+#
+# the delay lines are the rows of one 2D ring buffer, a block of samples is processed at once
+# as long as it is not longer than the shortest delay, as every sample read from the delay lines
+# inside the block was written by a previous block.
+#
+# the paraunitary feedback matrix is kept in its cascaded form, orthogonal matrices separated by
+# per channel delays, so a sample costs a few N x N products instead of a full FIR matrix.
+import numpy as np
+from scipy.linalg import hadamard
+from scipy.signal import firwin2, lfilter
+
+from utils.delay import SparseChannels
+
+MAX_BLOCK_SIZE = 2 ** 12
+
+def rt60_to_slope(rt60, fs):
+    """
+    Decay in dB per sample for a reverberation time in seconds.
+    """
+    with np.errstate(divide='ignore'):
+        return -60 / (np.asarray(rt60, dtype=float) * fs)
+
+def db_to_mag(db):
+    return 10 ** (np.asarray(db) / 20)
+
+def one_pole_absorption(rt_dc, rt_ny, delays, fs):
+    """
+    One pole absorption filters for a decay of rt_dc at DC and rt_ny at Nyquist (Jot and Chaigne 1991).
+
+    Returns: b (N, 1), a (N, 2)
+    """
+    delays = np.asarray(delays, dtype=float)
+    h_dc = db_to_mag(delays * rt60_to_slope(rt_dc, fs))
+    h_ny = db_to_mag(delays * rt60_to_slope(rt_ny, fs))
+    r = h_dc / h_ny
+    a1 = (1 - r) / (1 + r)
+    b = ((1 - a1) * h_ny)[:, None]
+    a = np.stack((np.ones_like(a1), a1), axis=1)
+    return b, a
+
+def first_order_absorption(rt_dc, rt_ny, crossover_frequency, delays, fs):
+    """
+    First order shelving absorption filters for a decay of rt_dc at DC and rt_ny at Nyquist (Jot 2015).
+
+    Returns: b (N, 2), a (N, 2)
+    """
+    delays = np.asarray(delays, dtype=float)
+    h_dc = db_to_mag(delays * rt60_to_slope(rt_dc, fs))
+    h_ny = db_to_mag(delays * rt60_to_slope(rt_ny, fs))
+
+    # a crossover above fs/4 makes the filter unstable
+    crossover_frequency = min(crossover_frequency, fs / 5)
+    t = np.tan(2 * np.pi * crossover_frequency / fs)
+    k = np.sqrt(h_dc / h_ny)
+    b = np.stack(((t * k + 1) * h_ny, (t * k - 1) * h_ny), axis=1)
+    a = np.stack((t / k + 1, t / k - 1), axis=1)
+    return b, a
+
+def fir_absorption(frequency, target_rt60, filter_order, delays, fs):
+    """
+    FIR absorption filters with a decay of target_rt60 (frequencies, N) at each frequency,
+    the first and last frequency must be 0 and fs/2. The filter group delay is included in the decay.
+
+    Returns: b (N, filter_order + 1), a (N, 1)
+    """
+    delays = np.asarray(delays, dtype=float)
+    target_rt60 = np.asarray(target_rt60, dtype=float)
+    b = np.zeros((len(delays), filter_order + 1))
+    for ch, delay in enumerate(delays):
+        delay = delay + np.ceil(filter_order / 2)
+        target_amplitude = db_to_mag(delay * rt60_to_slope(target_rt60[:, ch], fs))
+        b[ch] = firwin2(filter_order + 1, frequency, target_amplitude, nfreqs=513, fs=fs)
+    return b, np.ones((len(delays), 1))
+
+def hadamard_matrix(N):
+    return hadamard(N) / np.sqrt(N)
+
+def random_orthogonal(N, rng):
+    Q, R = np.linalg.qr(rng.standard_normal((N, N)))
+    return Q * np.sign(np.diag(R))
+
+def _generate_matrix(N, matrix_type, rng):
+    if matrix_type == 'Hadamard': return hadamard_matrix(N)
+    if matrix_type == 'random': return random_orthogonal(N, rng)
+    raise ValueError(f'Matrix type {matrix_type} not defined')
+
+def _delay_channels(block, state, delays):
+    """
+    Delay each channel of a block (N, n) by an integer number of samples.
+    state holds the last max(delays) samples of each channel and is updated in place.
+    """
+    max_delay = state.shape[1]
+    if max_delay == 0: return block
+    n = block.shape[1]
+    extended = np.concatenate((state, block), axis=1)
+    index = max_delay - delays[:, None] + np.arange(n)[None, :]
+    delayed = np.take_along_axis(extended, index, axis=1)
+    state[:] = extended[:, -max_delay:]
+    return delayed
+
+class ParaunitaryMatrix:
+    """
+    Cascaded paraunitary FIR feedback matrix (Schlecht and Habets, Scattering in Feedback Delay Networks).
+    A(z) = diag(z^-output_delays) R_K D_K(z) ... R_1 D_1(z) R_0 diag(z^-input_delays)
+    """
+    def __init__(self, N, stages, sparsity=1, matrix_type='Hadamard', max_shift=0, rng=None):
+        if rng is None: rng = np.random.default_rng()
+        self.N = N
+
+        # each stage delays the channels and mixes them, the first stage only mixes
+        self.matrices = [_generate_matrix(N, matrix_type, rng)]
+        self.stage_delays = [np.zeros(N, dtype=int)]
+        sparsity_vector = [sparsity] + [1] * (stages - 1)
+        pulse_size = 1
+        for stage_sparsity in sparsity_vector:
+            shift = np.floor(stage_sparsity * (np.arange(N) + rng.random(N) * 0.99)).astype(int)
+            self.stage_delays.append(shift * int(pulse_size))
+            self.matrices.append(_generate_matrix(N, matrix_type, rng))
+            pulse_size = pulse_size * N * stage_sparsity
+
+        # random shift of the matrix rows and columns
+        if max_shift >= N:
+            left = rng.permutation(max_shift)[:N] + 1
+            right = rng.permutation(max_shift)[:N] + 1
+        elif max_shift <= 0:
+            left = np.zeros(N, dtype=int)
+            right = np.zeros(N, dtype=int)
+        else:
+            left = rng.integers(1, max_shift + 1, N)
+            right = rng.integers(1, max_shift + 1, N)
+        self.output_delays = left - np.min(left)
+        self.stage_delays[0] = right - np.min(right) # input delays
+
+        self.degree = int(np.sum([np.max(d) for d in self.stage_delays]) + np.max(self.output_delays))
+        self.reset()
+
+    def reset(self):
+        self.stage_states = [np.zeros((self.N, np.max(d))) for d in self.stage_delays]
+        self.output_state = np.zeros((self.N, np.max(self.output_delays)))
+
+    def process(self, block):
+        """
+        Filter a block (N, n) through the matrix, the state is kept between calls.
+        """
+        for delays, state, matrix in zip(self.stage_delays, self.stage_states, self.matrices):
+            block = matrix @ _delay_channels(block, state, delays)
+        return _delay_channels(block, self.output_state, self.output_delays)
+
+    def polynomial(self):
+        """
+        Returns: FIR matrix (N, N, degree + 1), entry [i, j, k] maps input j to output i with a delay of k samples
+        """
+        impulses = np.zeros((self.N, self.N, self.degree + 1))
+        impulses[np.arange(self.N), np.arange(self.N), 0] = 1
+        impulses = impulses.transpose(1, 0, 2) # (channel, input, time)
+        for delays, matrix in zip(self.stage_delays, self.matrices):
+            impulses = np.einsum('ij,jkt->ikt', matrix, self._shift(impulses, delays))
+        return self._shift(impulses, self.output_delays)
+
+    @staticmethod
+    def _shift(x, delays):
+        shifted = np.zeros_like(x)
+        for channel, delay in enumerate(delays):
+            shifted[channel, :, delay:] = x[channel, :, :x.shape[2] - delay]
+        return shifted
+
+def matrix_delay_approximation(polynomial, n_freqs=512):
+    """
+    Rank one outer sum approximation of the mean group delay of each FIR matrix entry.
+
+    Returns: group delay per channel (N,)
+    """
+    taps = polynomial.shape[2]
+    n_fft = 2 * n_freqs * int(np.ceil(taps / (2 * n_freqs)))
+    step = n_fft // (2 * n_freqs)
+    B = np.fft.rfft(polynomial, n_fft, axis=2)[:, :, :n_fft // 2:step]
+    Br = np.fft.rfft(polynomial * np.arange(taps), n_fft, axis=2)[:, :, :n_fft // 2:step]
+    singular = np.abs(B) < 10 * np.finfo(float).eps
+    group_delay = np.real(Br / np.where(singular, 1, B))
+    group_delay[singular] = np.nan
+    matrix_delay = np.nanmean(group_delay, axis=2)
+
+    max_delay = np.max(matrix_delay)
+    U, S, Vt = np.linalg.svd(np.exp(matrix_delay / max_delay))
+    u = np.log(np.abs(U[:, 0] * np.sqrt(S[0]))) * max_delay
+    v = np.log(np.abs(Vt[0] * np.sqrt(S[0]))) * max_delay
+    return u + v
+
+class FDN:
+    """
+    Feedback delay network processed in blocks of at most the shortest delay.
+
+    Params:
+    delays: delay line lengths in samples (N,)
+    feedback_matrix: scalar matrix (N, N) or a ParaunitaryMatrix
+    input_gains: (N, inputs), output_gains: (outputs, N), direct: (outputs, inputs)
+    absorption: per delay line filters (b, a) each of shape (N, order + 1), None for a lossless network
+    absorption_position: 'post' filters the matrix output, 'pre' the matrix input
+    transposed: take the output from the matrix instead of the delay lines
+    """
+    def __init__(self, delays, feedback_matrix, input_gains, output_gains, direct, absorption=None, absorption_position='post', transposed=True):
+        self.delays = np.asarray(delays, dtype=int)
+        self.N = len(self.delays)
+        self.feedback_matrix = feedback_matrix
+        self.input_gains = np.asarray(input_gains, dtype=float)
+        self.output_gains = np.asarray(output_gains, dtype=float)
+        self.direct = np.asarray(direct, dtype=float)
+        self.absorption = absorption
+        self.absorption_position = absorption_position
+        self.transposed = transposed
+
+        assert np.min(self.delays) > 0, 'delay lines must be at least one sample'
+        self.block_size = int(min(np.min(self.delays), MAX_BLOCK_SIZE))
+        self.buffer_length = int(np.max(self.delays) + self.block_size)
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the delay lines and filter states.
+        """
+        self.buffer = np.zeros((self.N, self.buffer_length))
+        self.time = 0
+        if isinstance(self.feedback_matrix, ParaunitaryMatrix): self.feedback_matrix.reset()
+        if self.absorption is not None:
+            b, a = self.absorption
+            self.absorption_zi = np.zeros((self.N, max(b.shape[1], a.shape[1]) - 1))
+
+    def process(self, x):
+        """
+        Process a signal (length,) or (inputs, length) in blocks, the state is kept between calls.
+        A SparseChannels input is rendered one block at a time.
+
+        Returns: output signal (outputs, length)
+        """
+        sparse = isinstance(x, SparseChannels)
+        if not sparse: x = np.atleast_2d(x)
+        y = np.zeros((self.output_gains.shape[0], x.shape[1]))
+        for start in range(0, x.shape[1], self.block_size):
+            stop = min(start + self.block_size, x.shape[1])
+            y[:, start:stop] = self.process_block(x.render(start, stop) if sparse else x[:, start:stop])
+        return y
+
+    def process_block(self, block):
+        n = block.shape[1]
+        L = self.buffer_length
+        t = self.time + np.arange(n)
+        write_index = t % L
+        delay_output = self.buffer[np.arange(self.N)[:, None], (t[None, :] - self.delays[:, None]) % L]
+
+        if self.transposed:
+            matrix_input = self.input_gains @ block + delay_output
+            if self.absorption_position == 'pre': matrix_input = self._absorb(matrix_input)
+            matrix_output = self._feedback(matrix_input)
+            if self.absorption_position == 'post': matrix_output = self._absorb(matrix_output)
+            self.buffer[:, write_index] = matrix_output
+            output = self.output_gains @ matrix_output
+        else:
+            delay_output = self._absorb(delay_output)
+            self.buffer[:, write_index] = self.input_gains @ block + self._feedback(delay_output)
+            output = self.output_gains @ delay_output
+
+        self.time += n
+        return output + self.direct @ block
+
+    def _feedback(self, block):
+        if isinstance(self.feedback_matrix, ParaunitaryMatrix):
+            return self.feedback_matrix.process(block)
+        return self.feedback_matrix @ block
+
+    def _absorb(self, block):
+        if self.absorption is None: return block
+        b, a = self.absorption
+        filtered = np.empty_like(block)
+        for i in range(self.N):
+            filtered[i], self.absorption_zi[i] = lfilter(b[i], a[i], block[i], zi=self.absorption_zi[i])
+        return filtered
+
+def _velvet_matrix(N, matrix_type, rng):
+    # settings of velvet_fdn_one_pole.m and velvet_fdn_fir.m
+    return ParaunitaryMatrix(N, stages=2, sparsity=2, matrix_type=matrix_type, max_shift=30, rng=rng)
+
+def _fdn_output(fdn, x):
+    # all delay lines are fed the sum of the input channels and a single output is taken
+    if isinstance(x, SparseChannels): return fdn.process(x.mixed(np.ones((1, x.shape[0]))))[0]
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    return fdn.process(np.sum(x, axis=0, keepdims=True))[0]
+
+def velvet_fdn_one_pole_network(fs, delay_times, rt60s, rt60_bands, crossover_frequency, matrix_type, seed=None):
+    """
+    Transposed FDN with a velvet paraunitary feedback matrix and first order absorption filters.
+
+    Returns: FDN
+    """
+    rng = np.random.default_rng(seed)
+    delays = np.asarray(delay_times, dtype=int)
+    N = len(delays)
+    assert len(rt60_bands) == len(rt60s), 'RT60 bands and times arrays must be equal length.'
+
+    feedback_matrix = _velvet_matrix(N, matrix_type, rng)
+    approximation = matrix_delay_approximation(feedback_matrix.polynomial())
+    absorption = first_order_absorption(rt60s[0], rt60s[-1], crossover_frequency, delays + approximation, fs)
+
+    return FDN(delays, feedback_matrix, np.ones((N, 1)), np.ones((1, N)), np.zeros((1, 1)), absorption=absorption)
+
+def velvet_fdn_fir_network(fs, delay_times, rt60s, rt60_bands, matrix_type, filter_order, nyquist_decay_type, seed=None):
+    """
+    Transposed FDN with a velvet paraunitary feedback matrix and FIR absorption filters fit to rt60s at rt60_bands.
+
+    Returns: FDN
+    """
+    rng = np.random.default_rng(seed)
+    delays = np.asarray(delay_times, dtype=int)
+    N = len(delays)
+    assert len(rt60_bands) == len(rt60s), 'RT60 bands and times arrays must be equal length.'
+
+    feedback_matrix = _velvet_matrix(N, matrix_type, rng)
+    approximation = matrix_delay_approximation(feedback_matrix.polynomial())
+
+    frequency = np.concatenate(([0], rt60_bands, [fs / 2]))
+    if nyquist_decay_type == 'nyquist_zero': nyquist_rt60 = 0
+    if nyquist_decay_type == 'nyquist_RT60': nyquist_rt60 = rt60s[-1]
+    target_rt60 = np.concatenate(([rt60s[0]], rt60s, [nyquist_rt60]))[:, None] * np.ones((1, N))
+    absorption = fir_absorption(frequency, target_rt60, int(filter_order), delays + approximation, fs)
+
+    # the absorption filters are convolved into the matrix input
+    return FDN(delays, feedback_matrix, np.ones((N, 1)), np.ones((1, N)), np.zeros((1, 1)), absorption=absorption, absorption_position='pre')
+
+def standard_fdn_network(fs, delay_times, rt60s, seed=None):
+    """
+    FDN with a Hadamard feedback matrix and one pole absorption filters,
+    a random orthogonal matrix is used when N is not a power of two.
+
+    Returns: FDN
+    """
+    delays = np.asarray(delay_times, dtype=int)
+    N = len(delays)
+    feedback_matrix = hadamard_matrix(N) if N & (N - 1) == 0 else random_orthogonal(N, np.random.default_rng(seed))
+    absorption = one_pole_absorption(rt60s[0], rt60s[-1], delays, fs)
+    return FDN(delays, feedback_matrix, np.ones((N, 1)), np.ones((1, N)), np.ones((1, 1)), absorption=absorption, transposed=False)
+
+# same arguments as the MATLAB functions in late_reverberation/, returning the mono output
+
+def velvet_fdn_one_pole(fs, input, delay_times, rt60s, rt60_bands, crossover_frequency, matrix_type, seed=None):
+    return _fdn_output(velvet_fdn_one_pole_network(fs, delay_times, rt60s, rt60_bands, crossover_frequency, matrix_type, seed), input)
+
+def velvet_fdn_fir(fs, input, delay_times, rt60s, rt60_bands, matrix_type, filter_order, nyquist_decay_type, seed=None):
+    return _fdn_output(velvet_fdn_fir_network(fs, delay_times, rt60s, rt60_bands, matrix_type, filter_order, nyquist_decay_type, seed), input)
+
+def standard_fdn(fs, input, delay_times, rt60s, seed=None):
+    return _fdn_output(standard_fdn_network(fs, delay_times, rt60s, seed), input)
@@ -7,7 +7,7 @@ from utils.signals import signal
 from ism_fdn import ISMFDN
 from utils.room import Room
 from utils.convolve import fft_convolution
-from utils.matlab import init_matlab_eng
+from utils.matlab import MatlabEnginePool
 
 # create instances of config classes
 simulation_config = SimulationConfig()
@@ -29,7 +29,7 @@ unit_impulse, _ = signal(
         fs,
 )
 
-matlab_eng = init_matlab_eng()
+matlab_eng = MatlabEnginePool(size=2) # one-pole and FIR FDNs run concurrently
     
 one_pole_rir, fir_rir = ISMFDN(
         fs, 
@@ -3,7 +3,7 @@ import numpy as np
 from config import SimulationConfig, RoomConfig, TestConfig, OutputConfig
 from utils.signals import signal
 from utils.file import write_array_to_wav
-from utils.matlab import init_matlab_eng
+from utils.matlab import MatlabEnginePool
 
 from ism_fdn import ISMFDN
 from sdn import SDN
@@ -26,7 +26,7 @@ def rirs_config(fs):
         file_name=test_config.FILE_NAME,
     )
     
-    matlab_eng = init_matlab_eng()
+    matlab_eng = MatlabEnginePool(size=2) # one-pole and FIR FDNs run concurrently
     fdn_N_delays = 16
     """
     Process RIR:
@@ -0,0 +1,190 @@
+# block processing scattering delay network.
+#
+# every propigation line is a row of one preallocated 2D ring buffer:
+#   row 0                  -> input signal (read by the source lines and the direct path)
+#   rows 1 .. E            -> junction -> junction lines, the edges of the sparse connection matrix
+#   rows E+1 .. end        -> junction -> mic lines
+#
+# edges are ordered by their start junction, so the out lines of junction i are the
+# contiguous edges indptr[i]:indptr[i+1] and per junction sums are a single reduceat.
+#
+# a block can be processed at once as long as it is shorter than the shortest
+# junction -> junction loop, as every sample read by the scattering junctions
+# inside the block was written by a previous block.
+#
+# the first block_size samples of the ring are mirrored after its end, so the block read
+# from any line is one contiguous window and is gathered from a strided view without index arithmetic.
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.signal import lfilter
+
+from .reflection_nodes import connection_matrix
+from utils.filters import fir_type_1, iir_wall_filter, apply_filter, filter_state, impulse_response_of, peak_gain
+
+class BlockNetwork:
+    def __init__(self, early_reflections, source_location, mic_location, fs, band_absorption, center_freqs, flat_absorption, enable_direct_path, c=343.0, block_size=256, wall_filter_type='fir', connections=None, source_distances=None):
+        self.M = len(early_reflections)
+        # sparse junction adjacency (Room.connections), every junction pair by default
+        if connections is None: connections = connection_matrix([1] * self.M)
+        connections = connections.tocsr()
+        connections.sort_indices()
+        self.fs = fs
+        self.c = c
+        self.enable_direct_path = enable_direct_path
+
+        source = np.array(source_location.to_list(), dtype=float)
+        mic = np.array(mic_location.to_list(), dtype=float)
+        junctions = np.array([r.to_list() for r in early_reflections], dtype=float)
+
+        # direct path
+        direct_distance = self._distance(source, mic)
+        self.direct_delay = self._distance_to_delay(direct_distance)
+        self.direct_attenuation = min(1 / direct_distance, 1)
+
+        # source -> junction and junction -> mic lines, a source line follows the image path (Room.node_source_distances)
+        if source_distances is None: source_distances = self._distance(source[None, :], junctions)
+        mic_distances = self._distance(junctions, mic[None, :])
+        self.source_delays = self._distance_to_delay(source_distances)
+        self.source_attenuation = np.minimum(1 / source_distances, 1)
+        self.mic_delays = self._distance_to_delay(mic_distances)
+        self.mic_attenuation = np.minimum(1 / (1 + (mic_distances / source_distances)), 1)
+
+        # junction -> junction lines, edge e runs from junction edge_start[e] to its neighbour edge_end[e]
+        self.indptr = connections.indptr.astype(int)
+        self.K = np.diff(self.indptr) # neighbours of each junction
+        assert np.all(self.K > 0), "every junction needs a neighbour"
+        self.E = int(self.indptr[-1])
+        self.edge_start = np.repeat(np.arange(self.M), self.K)
+        self.edge_end = connections.indices.astype(int)
+        junction_distances = self._distance(junctions[self.edge_start], junctions[self.edge_end])
+        self.junction_delays = self._distance_to_delay(junction_distances) # (E,) out lines
+
+        # the out slot of edge i -> n scatters the wave that arrived on the reverse edge n -> i.
+        # rows of the lines read by each slot and the delay seen by the reader,
+        # Network updates junctions in order so a line from a later junction is read one sample late
+        keys = self.edge_start * self.M + self.edge_end
+        self.reverse_edges = np.searchsorted(keys, self.edge_end * self.M + self.edge_start)
+        assert np.all(keys[np.minimum(self.reverse_edges, self.E - 1)] == self.edge_end * self.M + self.edge_start), "connections must be symmetric"
+        self.line_rows = 1 + np.arange(self.E)
+        self.in_rows = self.line_rows[self.reverse_edges]
+        self.in_delays = self.junction_delays[self.reverse_edges] + (self.edge_end > self.edge_start)
+        self.mic_rows = 1 + self.E + np.arange(self.M)
+
+        assert np.min(self.in_delays) > 0, "junctions too close for block processing"
+        self.block_size = int(min(block_size, np.min(self.in_delays)))
+
+        # isotropic scattering of every out slot, 2/K * sum(p) - p
+        self.scattering_gains = (2 / self.K)[self.edge_start]
+
+        # frequency independant or dependant wall absorption
+        self.absorption = np.sqrt(1 - flat_absorption)
+        nyquist = fs / 2
+        if wall_filter_type == 'iir':
+            # biquad cascades (fir taps where the fit is poor), wall_filters holds their truncated impulse responses for the transfer function
+            designs = [iir_wall_filter(center_freqs, 1 - band_absorption[i], nyquist) for i in range(self.M)]
+            self.wall_sos = [sos for sos, _ in designs]
+            self.wall_filter_errors = [error_db for _, error_db in designs]
+            responses = [impulse_response_of(sos) for sos in self.wall_sos]
+            self.wall_filters = np.array([np.pad(h, (0, max(map(len, responses)) - len(h))) for h in responses])
+        else:
+            self.wall_filters = np.array([fir_type_1(center_freqs, 1 - band_absorption[i], nyquist)[1] for i in range(self.M)])
+            self.wall_sos = None
+        wall_peaks = [peak_gain(f) for f in (self.wall_sos if self.wall_sos is not None else self.wall_filters)]
+        assert max(wall_peaks) < 1, "wall filter gain above unity, the network would not decay"
+
+        max_delay = max(self.direct_delay, np.max(self.source_delays), np.max(self.mic_delays), np.max(self.in_delays))
+        self.buffer_length = int(max_delay + self.block_size + 1)
+        self.mirror_length = self.block_size
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the ring buffer and filter states.
+        """
+        self.buffer = np.zeros((1 + self.E + self.M, self.buffer_length + self.mirror_length))
+        if self.wall_sos is not None: self.wall_filter_zi = [filter_state(sos) for sos in self.wall_sos]
+        else: self.wall_filter_zi = np.zeros((self.M, self.wall_filters.shape[1] - 1))
+        self.time = 0
+
+    def process(self, signal_in):
+        """
+        Process a signal of any length in blocks, the state is kept between calls.
+
+        Returns: output signal (numpy array)
+        """
+        signal_out = np.zeros(len(signal_in))
+        for start in range(0, len(signal_in), self.block_size):
+            stop = min(start + self.block_size, len(signal_in))
+            signal_out[start:stop] = self.process_block(signal_in[start:stop])
+        return signal_out
+
+    def process_block(self, block):
+        n = len(block)
+        assert n <= self.block_size, "block exceeds shortest junction loop"
+        lines = slice(1, 1 + self.E)
+        mics = slice(1 + self.E, 1 + self.E + self.M)
+        # window (row, start) of the ring holds the n samples from start on
+        windows = as_strided(self.buffer, shape=(self.buffer.shape[0], self.buffer_length, n), strides=self.buffer.strides + self.buffer.strides[1:])
+
+        # input and source -> junction lines
+        self._write(slice(0, 1), block[None, :])
+        source_samples = windows[0, self._read_start(self.source_delays)] * self.source_attenuation[:, None]
+
+        # read neighbour junctions and scatter (E, n)
+        samples_in = windows[self.in_rows, self._read_start(self.in_delays)]
+        samples_in = samples_in + 0.5 * source_samples[self.edge_start]
+        samples_sum = np.add.reduceat(samples_in, self.indptr[:-1], axis=0)
+        samples_out = self.scattering_gains[:, None] * samples_sum[self.edge_start] - samples_in
+        samples_to_mic = (2 / self.K)[:, None] * np.add.reduceat(samples_out, self.indptr[:-1], axis=0)
+
+        samples_out = self._wall_absorption(samples_out)
+
+        # write junction -> junction and junction -> mic lines
+        self._write(lines, samples_out)
+        self._write(mics, samples_to_mic)
+
+        mic_samples = windows[self.mic_rows, self._read_start(self.mic_delays)] * self.mic_attenuation[:, None]
+        output = np.sum(mic_samples, axis=0)
+        if self.enable_direct_path:
+            output = output + windows[0, self._read_start(self.direct_delay)] * self.direct_attenuation
+
+        self.time += n
+        return output
+
+    def _read_start(self, delays):
+        return (self.time - delays) % self.buffer_length
+
+    def _write(self, rows, samples):
+        """
+        Write a block (rows, n) at the current time, wrapping around the ring and into its mirrored start.
+        """
+        n = samples.shape[1]
+        L = self.buffer_length
+        start = self.time % L
+        first = min(n, L - start)
+        self.buffer[rows, start:start + first] = samples[:, :first]
+        self.buffer[rows, :n - first] = samples[:, first:]
+        # the mirror repeats buffer[:, :mirror_length] after the ring
+        if start < self.mirror_length: self.buffer[rows, L + start:L + min(start + first, self.mirror_length)] = samples[:, :min(first, self.mirror_length - start)]
+        if n > first: self.buffer[rows, L:L + n - first] = samples[:, first:]
+
+    def _wall_absorption(self, samples_out):
+        """
+        Absorb the junction out lines of a block (E, n), by the flat absorption or the wall filter of each junction.
+        """
+        if self.absorption != 0: return samples_out * self.absorption
+        # a junction filters its out lines in turn through a single filter state
+        n = samples_out.shape[1]
+        for i in range(self.M):
+            lines = slice(self.indptr[i], self.indptr[i + 1])
+            wall_filter = self.wall_sos[i] if self.wall_sos is not None else self.wall_filters[i]
+            interleaved, self.wall_filter_zi[i] = apply_filter(wall_filter, samples_out[lines].T.ravel(), zi=self.wall_filter_zi[i])
+            samples_out[lines] = interleaved.reshape(n, self.K[i]).T
+        return samples_out
+
+    def _distance_to_delay(self, distance):
+        return np.floor(self.fs * (distance / self.c)).astype(int)
+
+    @staticmethod
+    def _distance(start, end):
+        return np.sqrt(np.sum((start - end) ** 2, axis=-1))
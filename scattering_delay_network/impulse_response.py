@@ -0,0 +1,119 @@
+# closed form impulse response of the scattering delay network.
+#
+# the network is linear and time invariant, so its transfer function can be evaluated directly
+# from the topology of a BlockNetwork. with o the vector of all junction -> junction line outputs:
+#
+# o has one entry per edge of the sparse connection matrix:
+#
+#   o = F(z) A (P(z) o + 0.5 s(z))      =>      (I - F A P) o = 0.5 F A s
+#
+#   P(z): propigation delays z^-d from each line into the junction reading it
+#   A:    isotropic scattering matrix 2/K - I of every junction, K its number of neighbours
+#   F(z): wall absorption, a scalar gain or the junction wall filter. a junction runs its
+#         out lines through one filter state in turn, so the filter is a K x K polyphase matrix.
+#   s(z): source -> junction lines
+#
+# the mic lines sum (2/K) * A (P o + 0.5 s) of every junction. the linear system is solved
+# once per frequency bin, so the cost depends on the rir length and network size only
+# (the cube of the number of edges, which grows quickly with the reflection order).
+#
+# the inverse fft wraps the response after n_fft onto its start. the transfer function is evaluated on
+# the circle |z| = r > 1, which is the rfft of h[n] r^-n, so every wrapped copy of the tail is damped by
+# r^-n_fft whether or not the network decays. the damping is undone after the inverse fft, which scales
+# rounding errors by at most r^length.
+import numpy as np
+
+from .block_network import BlockNetwork
+
+def impulse_response(network: BlockNetwork, length, oversample=2, aliasing_db=-120, chunk_size=2048, max_chunk_elements=1 << 23):
+    """
+    Render the impulse response of a network from its transfer function.
+
+    Params:
+    network: BlockNetwork with the topology to render
+    length: length of the impulse response in samples
+    oversample: fft length as a multiple of the rir length, a longer fft amplifies rounding errors less
+    aliasing_db: damping of the tail wrapped onto the rir, relative to the response n_fft samples earlier
+    chunk_size: number of frequency bins solved at once
+    max_chunk_elements: bound on the size of the systems solved at once, limits chunk_size for large networks
+
+    Returns: impulse response (numpy array)
+    """
+    n_fft = int(2 ** np.ceil(np.log2(length * oversample)))
+    radius = 10 ** (-aliasing_db / (20 * n_fft))
+    H = transfer_function(network, n_fft, radius=radius, chunk_size=chunk_size, max_chunk_elements=max_chunk_elements)
+    return np.fft.irfft(H, n_fft)[:length] * radius ** np.arange(length)
+
+def transfer_function(network: BlockNetwork, n_fft, radius=1.0, chunk_size=2048, max_chunk_elements=1 << 23):
+    """
+    Evaluate the network transfer function at the bins of an n_fft point rfft, on the circle |z| = radius.
+
+    Returns: complex frequency response (numpy array)
+    """
+    M, K, size = network.M, network.K, network.E
+    indptr = network.indptr
+    # z = e^s at each bin, a delay of d samples is e^(-s d)
+    laplace = np.log(radius) + 1j * 2 * np.pi * np.arange(n_fft // 2 + 1) / n_fft
+    chunk_size = max(1, min(chunk_size, max_chunk_elements // (size * size)))
+
+    # line read by each out slot as an index into o
+    in_lines = network.in_rows - 1
+    wall_filter_taps = _polyphase_wall_filters(network)
+    identity = np.eye(size)
+
+    H = np.zeros(len(laplace), dtype=complex)
+    for start in range(0, len(laplace), chunk_size):
+        s = laplace[start:start + chunk_size]
+        bins = len(s)
+
+        # source -> junction (bins, M)
+        source = network.source_attenuation * np.exp(-s[:, None] * network.source_delays)
+
+        # F A P: slot e reads line in_lines[e] delayed by in_delays[e]
+        phase = np.exp(-s[:, None] * network.in_delays) # (bins, E)
+        system = np.zeros((bins, size, size), dtype=complex)
+        rhs = np.zeros((bins, size), dtype=complex)
+        for i in range(M):
+            slots = slice(indptr[i], indptr[i + 1])
+            # F A of the junction (bins, K, K), A = 2/K - I so F A = 2/K * rowsum(F) - F
+            if network.absorption != 0:
+                FA = np.broadcast_to(network.absorption * ((2 / K[i]) * np.ones((K[i], K[i])) - np.eye(K[i])), (bins, K[i], K[i]))
+            else:
+                z = np.exp(-s[:, None] * np.arange(wall_filter_taps[i].shape[-1]))
+                F = np.einsum('krd,bd->bkr', wall_filter_taps[i], z)
+                FA = (2 / K[i]) * np.sum(F, axis=2, keepdims=True) - F
+            system[:, slots, in_lines[slots]] = -FA * phase[:, None, slots]
+            rhs[:, slots] = 0.5 * source[:, i, None] * np.sum(FA, axis=2) # F A (0.5 s 1)
+        system += identity
+
+        o = np.linalg.solve(system, rhs[:, :, None])[:, :, 0]
+
+        # junction inputs, the mic line of a junction is 2/K * sum(A p) = 2/K * sum(p)
+        p = phase * o[:, in_lines] + 0.5 * source[:, network.edge_start]
+        to_mic = (2 / K) * np.add.reduceat(p, indptr[:-1], axis=1)
+        mic = network.mic_attenuation * np.exp(-s[:, None] * network.mic_delays)
+        H[start:start + bins] = np.sum(mic * to_mic, axis=1)
+
+        if network.enable_direct_path:
+            H[start:start + bins] += network.direct_attenuation * np.exp(-s * network.direct_delay)
+
+    return H
+
+def _polyphase_wall_filters(network: BlockNetwork):
+    """
+    Split each junction filter into a K x K matrix of delayed taps.
+    Tap m of out slot k filters the sample of slot (k - m) mod K, floor((k - m) / K) samples earlier.
+
+    Returns: taps of every junction [(K, K, max delay + 1)]
+    """
+    taps = network.wall_filters.shape[1]
+    m = np.arange(taps)
+    polyphase = []
+    for i in range(network.M):
+        K = network.K[i]
+        max_delay = (taps - 1 + K - 1) // K
+        junction_taps = np.zeros((K, K, max_delay + 1))
+        for k in range(K):
+            np.add.at(junction_taps[k], ((k - m) % K, -((k - m) // K)), network.wall_filters[i])
+        polyphase.append(junction_taps)
+    return polyphase
@@ -2,17 +2,16 @@
 # and models microphone directivity pattern
 
 from utils.point3D import Point3D
-from .propigation_line import PropigationLine
 
 class Mic:  
     def __init__(self, location: Point3D):
-        self.propigation_lines: list[PropigationLine] = [] # junction -> mic
-        self.direct_path: PropigationLine = None # source -> mic
+        self.propigation_lines: list[int] = [] # junction -> mic, indices into the network PropigationLines
+        self.direct_path: int = None # source -> mic
         self.location = location
     
-    def add_from_junction(self, prop_line: PropigationLine):
+    def add_from_junction(self, prop_line: int):
         self.propigation_lines.append(prop_line)
     
-    def add_direct_path(self, prop_line: PropigationLine):
+    def add_direct_path(self, prop_line: int):
         self.direct_path = prop_line
         
\ No newline at end of file
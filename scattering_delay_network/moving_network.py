@@ -0,0 +1,167 @@
+# block processing scattering delay network with a moving source and mic.
+#
+# the node positions and every line delay and attenuation are recomputed at a control rate
+# and ramp linearly over each control period, lines are read at fractional delays with
+# Lagrange interpolation. the topology, wall filters and ring buffer layout are those of BlockNetwork,
+# the nodes of every geometry correspond as reflection_nodes keeps the same image lattice.
+# only first order networks move: higher order nodes of images along one axis meet the walls within
+# a sample of each other, and which of them merge (Room min_node_distance) changes with the geometry.
+#
+# a block is processed at once while it is shorter than the shortest junction loop less the
+# interpolation taps read after the delay, at either end of the control period.
+#
+# interpolation runs inside the junction loops, so its high frequency loss builds up over the tail.
+# a line whose delay does not change over a control period settles on the integer delay of BlockNetwork
+# (a Lagrange read at an integer delay is exact), so a still scene renders as the static network and
+# only moving lines are filtered, 8 taps keep the loss of a moving scene small.
+import numpy as np
+
+from .block_network import BlockNetwork
+from .reflection_nodes import reflection_nodes
+from .room import Room
+from utils.delay import interpolated_read
+from utils.geometry import control_path
+
+class MovingNetwork(BlockNetwork):
+    def __init__(self, room: Room, fs, band_absorption, center_freqs, flat_absorption, enable_direct_path, c=343.0, block_size=256, wall_filter_type='fir', control_period=64, interpolation_taps=8):
+        assert room.reflection_order == 1, "moving networks are first order only, higher order nodes would have to be merged as the geometry changes"
+        assert room.min_node_distance is None, "merged nodes would change with the geometry"
+        super().__init__(room.early_reflections, room.source, room.mic, fs, band_absorption, center_freqs, flat_absorption, enable_direct_path, c=c, block_size=block_size, wall_filter_type=wall_filter_type, connections=room.connections, source_distances=room.node_source_distances)
+        self.room_dims = np.array(room.dims, dtype=float)
+        self.reflection_order = room.reflection_order
+        self.control_period = control_period
+        self.interpolation_taps = interpolation_taps
+        self.block_size = int(block_size) # limited for each control period instead of by the first geometry
+
+        # every line is inside the room, so the diagonal bounds the delays of any geometry
+        diagonal = np.sqrt(np.sum(self.room_dims ** 2))
+        self.buffer_length = int(np.ceil(fs * diagonal / c)) + 2 + self.block_size + interpolation_taps
+        self.mirror_length = 0 # fractional reads index the ring sample by sample
+        self.source_location = np.array(room.source.to_list(), dtype=float)
+        self.mic_location = np.array(room.mic.to_list(), dtype=float)
+        self.reset()
+
+        # a still scene reads every line at the delays of BlockNetwork
+        min_delay = interpolation_taps // 2
+        static_delays = {'direct_delay': self.direct_delay, 'source_delays': self.source_delays, 'mic_delays': self.mic_delays, 'in_delays': self.in_delays}
+        assert all(np.array_equal(self.geometry[key], np.maximum(value, min_delay)) for key, value in static_delays.items()), "static delays differ from BlockNetwork"
+
+    def reset(self):
+        """
+        Clear the ring buffer and filter states, the geometry returns to the last positions.
+        """
+        super().reset()
+        if hasattr(self, 'source_location'):
+            self.last_target = self._geometry(self.source_location, self.mic_location)
+            self.geometry = self._settle(self.last_target, self.last_target)
+
+    def process(self, signal_in, source_path=None, mic_path=None):
+        """
+        Process a signal along a trajectory in blocks, the state is kept between calls.
+
+        Params:
+        source_path, mic_path: position at each control period of the signal (periods, 3) or a single position,
+                               the last positions by default, the geometry ramps linearly over a period
+
+        Returns: output signal (numpy array)
+        """
+        periods = int(np.ceil(len(signal_in) / self.control_period))
+        source_path = control_path(self.source_location if source_path is None else source_path, periods)
+        mic_path = control_path(self.mic_location if mic_path is None else mic_path, periods)
+
+        signal_out = np.zeros(len(signal_in))
+        for period, start in enumerate(range(0, len(signal_in), self.control_period)):
+            stop = min(start + self.control_period, len(signal_in))
+            target = self._geometry(source_path[period], mic_path[period])
+            target, self.last_target = self._settle(target, self.last_target), target
+            ramp = (np.arange(stop - start) + 1) / self.control_period
+
+            # the delays ramp linearly, so the shortest loop of the period is at one of its ends
+            shortest_loop = min(np.min(self.geometry['in_delays']), np.min(target['in_delays']))
+            block_size = min(self.block_size, int(np.floor(shortest_loop)) - self.interpolation_taps // 2)
+            assert block_size > 0, "junctions too close for block processing"
+
+            for block_start in range(start, stop, block_size):
+                block_stop = min(block_start + block_size, stop)
+                block_ramp = ramp[block_start - start:block_stop - start]
+                geometry = {key: value[..., None] + (target[key] - value)[..., None] * block_ramp for key, value in self.geometry.items()}
+                signal_out[block_start:block_stop] = self.process_moving_block(signal_in[block_start:block_stop], geometry)
+
+            # a partial period only ramps part of the way
+            self.geometry = {key: value[..., -1] for key, value in geometry.items()}
+        self.source_location, self.mic_location = source_path[-1], mic_path[-1]
+        return signal_out
+
+    def process_moving_block(self, block, geometry):
+        """
+        Process a block with the delays and attenuations of each line at each sample (lines, n).
+
+        Returns: output block
+        """
+        n = len(block)
+        L = self.buffer_length
+        N = self.interpolation_taps
+        t = self.time + np.arange(n)
+        write_index = t % L
+
+        # input and source -> junction lines
+        self.buffer[0, write_index] = block
+        source_samples = interpolated_read(self.buffer, 0, t - geometry['source_delays'], N) * geometry['source_attenuation']
+
+        # read neighbour junctions and scatter (E, n)
+        samples_in = interpolated_read(self.buffer, self.in_rows[:, None], t - geometry['in_delays'], N)
+        samples_in = samples_in + 0.5 * source_samples[self.edge_start]
+        samples_sum = np.add.reduceat(samples_in, self.indptr[:-1], axis=0)
+        samples_out = self.scattering_gains[:, None] * samples_sum[self.edge_start] - samples_in
+        samples_to_mic = (2 / self.K)[:, None] * np.add.reduceat(samples_out, self.indptr[:-1], axis=0)
+        samples_out = self._wall_absorption(samples_out)
+
+        # write junction -> junction and junction -> mic lines
+        self.buffer[self.line_rows[:, None], write_index[None, :]] = samples_out
+        self.buffer[self.mic_rows[:, None], write_index[None, :]] = samples_to_mic
+
+        mic_samples = interpolated_read(self.buffer, self.mic_rows[:, None], t - geometry['mic_delays'], N) * geometry['mic_attenuation']
+        output = np.sum(mic_samples, axis=0)
+        if self.enable_direct_path:
+            output = output + interpolated_read(self.buffer, 0, t - geometry['direct_delay'], N) * geometry['direct_attenuation']
+
+        self.time += n
+        return output
+
+    @staticmethod
+    def _settle(target, last_target):
+        """
+        Floor the delays of the lines that did not move since the last control period,
+        the line ramps onto its integer delay over the period and is then read without interpolation.
+        """
+        settled = dict(target)
+        for key in ('direct_delay', 'source_delays', 'mic_delays', 'in_delays'):
+            settled[key] = np.where(target[key] == last_target[key], np.floor(target[key]), target[key])
+        return settled
+
+    def _geometry(self, source, mic):
+        """
+        Fractional delays in samples and attenuations of every line for a source and mic position,
+        as the integer delays and attenuations of BlockNetwork.
+        """
+        assert np.all((source > 0) & (source < self.room_dims)), 'source outside room'
+        assert np.all((mic > 0) & (mic < self.room_dims)), 'mic outside room'
+        junctions, _, _, source_distances = reflection_nodes(self.room_dims, source, mic, self.reflection_order)
+        assert len(junctions) == self.M
+
+        direct_distance = self._distance(source, mic)
+        mic_distances = self._distance(junctions, mic[None, :])
+        junction_delays = self.fs * (self._distance(junctions[self.edge_start], junctions[self.edge_end]) / self.c)
+
+        # the samples after a delay must be written when it is read
+        min_delay = self.interpolation_taps // 2
+        return {
+            'direct_delay': np.maximum(np.asarray(self.fs * (direct_distance / self.c)), min_delay),
+            'direct_attenuation': np.asarray(min(1 / direct_distance, 1)),
+            'source_delays': np.maximum(self.fs * (source_distances / self.c), min_delay),
+            'source_attenuation': np.minimum(1 / source_distances, 1),
+            'mic_delays': np.maximum(self.fs * (mic_distances / self.c), min_delay),
+            'mic_attenuation': np.minimum(1 / (1 + (mic_distances / source_distances)), 1),
+            # Network updates junctions in order, so a line from a later junction is read one sample late
+            'in_delays': junction_delays[self.reverse_edges] + (self.edge_end > self.edge_start),
+        }
@@ -1,81 +1,105 @@
+import numpy as np
+
 from .source import Source
 from .mic import Mic
-from .propigation_line import PropigationLine
+from .propigation_line import PropigationLines
 from .scattering_junction import ScatteringJunction
-from utils.filters import fir_type_1, fir_type_2
+from .reflection_nodes import connection_matrix
+from utils.filters import fir_type_1, fir_type_2, iir_wall_filter, peak_gain
 
 
 class Network:
-    def __init__(self, early_reflections, source_location, mic_location,fs, band_absorption, center_freqs, flat_absorption,  enable_direct_path):
+    def __init__(self, early_reflections, source_location, mic_location,fs, band_absorption, center_freqs, flat_absorption,  enable_direct_path, wall_filter_type='fir', connections=None, source_distances=None):
         self.M = len(early_reflections)
+        # sparse junction adjacency (Room.connections), every junction pair by default
+        if connections is None: connections = connection_matrix([1] * self.M)
         self.source = Source(source_location)
         self.mic = Mic(mic_location)
         
+        # every propigation line lives in one array backed bank:
+        #   line 0                -> direct path
+        #   lines 1 .. M          -> source -> junction i
+        #   lines M+1 .. 2M       -> junction i -> mic
+        #   lines 2M+1 .. end     -> junction i -> junction j, the edges of the connection matrix in order
+        source = np.array(source_location.to_list(), dtype=float)
+        mic = np.array(mic_location.to_list(), dtype=float)
+        junctions = np.array([r.to_list() for r in early_reflections], dtype=float)
+        edge_start = np.repeat(np.arange(self.M), np.diff(connections.indptr))
+        edge_end = connections.indices
+        starts = np.vstack((source, np.repeat(source[None, :], self.M, axis=0), junctions, junctions[edge_start]))
+        ends = np.vstack((mic, junctions, np.repeat(mic[None, :], self.M, axis=0), junctions[edge_end]))
+        self.source_lines = 1 + np.arange(self.M)
+        # a source line follows the image path of its junction (Room.node_source_distances)
+        distances = np.sqrt(np.sum((starts - ends) ** 2, axis=-1))
+        if source_distances is not None: distances[self.source_lines] = source_distances
+        self.lines = PropigationLines(starts, ends, fs, distances=distances)
+        self.mic_lines = 1 + self.M + np.arange(self.M)
+        junction_lines = 1 + 2 * self.M + np.arange(len(edge_start))
+        
         # create direct path
         self.enable_direct_path = enable_direct_path
-        self.direct_path = PropigationLine(start=self.source, end=self.mic, fs=fs)
-        self.direct_path.attenuation = min(1 / self.direct_path.distance, 1)
+        self.direct_path = 0
+        self.lines.attenuations[self.direct_path] = min(1 / self.lines.distances[self.direct_path], 1)
         self.source.add_direct_path(self.direct_path)
         self.mic.add_direct_path(self.direct_path)  
         self.junctions: list[ScatteringJunction] = []
         
         nyquist = fs / 2
+        self.wall_filter_errors = [] # maximum fit error of each IIR junction filter in dB
                     
         # for each refelection create a scattering junction
         for i in range(self.M):
             junction_loc = early_reflections[i]
             gains = 1 - band_absorption[i]
-            _, junction_filter_min_coeffs = fir_type_1(center_freqs, gains, nyquist) # currently only type_1 filter works
-            junction = ScatteringJunction(junction_loc, self.source, self.mic, alpha=flat_absorption, filter_coeffs=junction_filter_min_coeffs)
+            if wall_filter_type == 'iir':
+                junction_filter_min_coeffs, error_db = iir_wall_filter(center_freqs, gains, nyquist) # fir taps where the fit is poor
+                self.wall_filter_errors.append(error_db)
+            else:
+                _, junction_filter_min_coeffs = fir_type_1(center_freqs, gains, nyquist) # currently only type_1 filter works
+            assert peak_gain(junction_filter_min_coeffs) < 1, "wall filter gain above unity, the network would not decay"
+            junction = ScatteringJunction(junction_loc, self.source, self.mic, alpha=flat_absorption, filter_coeffs=junction_filter_min_coeffs, lines=self.lines)
             self.junctions.append(junction)
         
-        # connect the scattering junctions with waveguides (bidirectional delay lines)
+        # source -> junction and junction -> mic attenuation
+        source_distances = self.lines.distances[self.source_lines]
+        mic_distances = self.lines.distances[self.mic_lines]
+        self.lines.attenuations[self.source_lines] = np.minimum(1 / source_distances, 1) # set the gain to 1 if > 1
+        self.lines.attenuations[self.mic_lines] = np.minimum(1 / (1 + (mic_distances / source_distances)), 1)
         for i in range(self.M):
-            # connect source to junction
-            source_line = PropigationLine(start=self.source, end=self.junctions[i], fs=fs)
-            source_attenuation = 1 / source_line.distance
-            source_line.attenuation = min(source_attenuation, 1) # set the gain to 1 if > 1
-            self.source.add_to_junction(source_line)
-            
-            # connect junction to mic
-            mic_line = PropigationLine(start=self.junctions[i], end=self.mic, fs=fs)
-            mic_attenuation = 1 / (1 + (mic_line.distance / source_line.distance))
-            mic_line.attenuation = min(mic_attenuation, 1)
-            self.mic.add_from_junction(mic_line)
-            
-            # connect junctions to all other junctions via propigations lines
-            for j in range(self.M):
-                # ignore diagonal - dont connect node to itself
-                if i == j: continue
-                # create the connection: junction i --propigation line--> junction j
-                prop_line = PropigationLine(start=self.junctions[i], end=self.junctions[j], fs=fs)
-                # append in/out line
-                self.junctions[i].add_out(prop_line)
-                self.junctions[j].add_in(prop_line)
+            self.source.add_to_junction(self.source_lines[i])
+            self.mic.add_from_junction(self.mic_lines[i])
+        
+        # connect the scattering junctions with waveguides (bidirectional delay lines),
+        # edges are sorted by start then end junction, so in and out lines of a junction list its neighbours in the same order.
+        # the out lines of junction i are the csr row indptr[i]:indptr[i+1], a stable sort by end groups the in lines the same way
+        in_order = np.argsort(edge_end, kind='stable')
+        in_indptr = np.concatenate(([0], np.cumsum(np.bincount(edge_end, minlength=self.M))))
+        for i in range(self.M):
+            # junction i --propigation line--> junction j
+            self.junctions[i].add_out(junction_lines[connections.indptr[i]:connections.indptr[i + 1]])
+            self.junctions[i].add_in(junction_lines[in_order[in_indptr[i]:in_indptr[i + 1]]])
             
     def process(self, sample_in):
-        # add sample to direct path
-        self.direct_path.sample_in(sample_in)
-        samples_out = [] # use array instead for mic pattern model
+        # add sample to direct path and source lines
+        self.lines.sample_in(self.direct_path, sample_in)
+        self.lines.sample_in(self.source_lines, sample_in)
+        source_samples = self.lines.sample_out(self.source_lines).tolist()
+        samples_to_mic = np.zeros(self.M)
             
+        # junctions update in order, a junction reads the lines of earlier junctions one sample sooner
         for i in range(self.M):
-            # push sample to source prop line
-            self.source.propigation_lines[i].sample_in(sample_in) 
-            # get sample from source propline
-            source_sample = self.source.propigation_lines[i].sample_out()
             # apply scattering
-            junction_samples, sample_to_mic = self.junctions[i].scatter_in(source_sample)
+            junction_samples, samples_to_mic[i] = self.junctions[i].scatter_in(source_samples[i])
             self.junctions[i].scatter_out(junction_samples)
-            # push scattered sample to microphone prop line
-            self.mic.propigation_lines[i].sample_in(sample_to_mic)
-            # collect output samples
-            mic_sample = self.mic.propigation_lines[i].sample_out()
-            samples_out.append(mic_sample)
+        
+        # push scattered samples to microphone prop lines and collect output samples
+        self.lines.sample_in(self.mic_lines, samples_to_mic)
+        samples_out = self.lines.sample_out(self.mic_lines)
         
         # model microphone directivity pattern here
         # mic_out = mic.process(samples_out)
         
         output_summed = sum(samples_out) # * (2 / (self.M - 1))
-        if(self.enable_direct_path): return output_summed + self.direct_path.sample_out()
+        if(self.enable_direct_path): return output_summed + self.lines.sample_out(self.direct_path)
         else: return output_summed
-        
\ No newline at end of file
+        
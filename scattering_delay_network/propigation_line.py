@@ -3,6 +3,7 @@
 #                                  --[wall filter]->[send sample to receiver]->[delay]->[add-sample from source]-->
 #             <scattering junction>                                                                                 <scattering junction>
 #                                  <--[add sample from source]<-[delay]<-[send sample to receiver]<-[wall filter]--
+import numpy as np
 from utils.delay import DelayLine
 from utils.point3D import Point3D
 from math import sqrt, floor
@@ -18,7 +19,8 @@ class PropigationLine:
         self.distance = self.euclid_dist()
         self.offset = offset
         self.attenuation = 1.0
-        self.delay_line = DelayLine(self.distance_to_delay() * 2)
+        self.delay = self.distance_to_delay() + self.offset
+        self.delay_line = DelayLine(self.delay + 1)
                 
         # filter for frequnecy dependant air absorption
             
@@ -26,8 +28,7 @@ class PropigationLine:
         self.delay_line.push(sample)
         
     def sample_out(self) -> float:
-        delay = self.distance_to_delay()
-        return self.delay_line.read(delay + self.offset) * self.attenuation 
+        return self.delay_line.read(self.delay) * self.attenuation
     
     # get the euclidean distance between the start and end junctions
     def euclid_dist(self):
@@ -45,4 +46,48 @@ class PropigationLine:
         z_diff = point_a.z - point_b.z
         return Point3D([x_diff, y_diff, z_diff])
     
-    # def update_distance()
\ No newline at end of file
+    # def update_distance()
+
+class PropigationLines:
+    """
+    Every propigation line of a network in parallel arrays, addressed by line index.
+    The ring buffers of all lines are packed into one contiguous buffer, each one sample longer than its delay,
+    so memory follows the total delay. The oldest sample of a ring is the one pushed delay samples ago,
+    so a line reads at its write index.
+    """
+    def __init__(self, starts, ends, fs, c=343.0, offsets=0, distances=None):
+        """
+        Params:
+        starts, ends: start and end positions of every line (lines, 3)
+        offsets: extra delay in samples of every line
+        distances: path length of every line, the distance from start to end when None
+        """
+        self.fs = fs
+        self.c = c
+        if distances is None: distances = np.sqrt(np.sum((np.asarray(starts, dtype=float) - np.asarray(ends, dtype=float)) ** 2, axis=-1))
+        self.distances = np.asarray(distances, dtype=float)
+        # delays are fixed at construction
+        self.delays = np.floor(fs * (self.distances / c)).astype(int) + offsets
+        self.attenuations = np.ones(len(self.distances))
+        self.buffer_ends = np.cumsum(self.delays + 1)
+        self.buffer_starts = self.buffer_ends - (self.delays + 1)
+        self.buffer = np.zeros(int(self.buffer_ends[-1]) if len(self.delays) else 0)
+        self.write_indices = self.buffer_starts.copy() # into buffer
+
+    def __len__(self):
+        return len(self.distances)
+
+    def sample_in(self, lines, samples):
+        """
+        Push a sample to each line, lines is an index or an array of distinct indices.
+        """
+        write_indices = self.write_indices[lines]
+        self.buffer[write_indices] = samples
+        write_indices = write_indices + 1
+        self.write_indices[lines] = np.where(write_indices == self.buffer_ends[lines], self.buffer_starts[lines], write_indices)
+
+    def sample_out(self, lines):
+        """
+        Attenuated sample pushed delay samples before the last push of each line.
+        """
+        return self.buffer[self.write_indices[lines]] * self.attenuations[lines]
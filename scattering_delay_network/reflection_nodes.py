@@ -0,0 +1,105 @@
+# scattering node positions and connections of first and higher order scattering delay networks.
+#
+# a node is placed where the path of an image source to the mic last meets a wall, so a network
+# of order N renders the reflection paths of every image source up to order N at the right delay.
+# the source line of a node is as long as the image path up to the node, for a higher order node it
+# is longer than the straight source to node distance (the path reflects off the earlier walls).
+# image sources are found on the shoebox lattice in one pass, as in early_reflections/ism.py.
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+def image_lattice(reflection_order):
+    """
+    Image source cells with 1 <= |i| + |j| + |k| <= reflection_order, by order and then in the
+    order of reflect_source (x = 0, x = L, y = 0, y = L, z = 0, z = L) for the first order.
+
+    Returns: lattice (n, 3), orders (n,)
+    """
+    n = np.arange(-reflection_order, reflection_order + 1)
+    k, j, i = np.meshgrid(n, n, n, indexing='ij')
+    lattice = np.stack((i.ravel(), j.ravel(), k.ravel()), axis=1)
+    orders = np.sum(np.abs(lattice), axis=1)
+    keep = (orders >= 1) & (orders <= reflection_order)
+    lattice, orders = lattice[keep], orders[keep]
+
+    i, j, k = np.abs(lattice).T
+    sort = np.lexsort((lattice[:, 2], -k, lattice[:, 1], -j, lattice[:, 0], -i, orders))
+    return lattice[sort], orders[sort]
+
+def reflection_nodes(room_dim, source, receiver, reflection_order, min_distance=None):
+    """
+    Find the node positions of every image source up to the reflection order in one vectorised pass.
+    Paths of images along one axis meet the wall close together, a node within min_distance of a
+    lower order node is merged into it (a delay line between them would be shorter than a sample).
+    With no min_distance every node is kept, so the nodes of any two geometries correspond.
+
+    Returns: node positions (n, 3), reflection order of each node (n,),
+             wall of each node (n,) in the order of reflect_source (x = 0, x = L, y = 0, y = L, z = 0, z = L),
+             source distance of each node (n,), the length of the image path from the source to the node
+    """
+    room_dim = np.array(room_dim, dtype=float)
+    source = np.array(source, dtype=float)
+    receiver = np.array(receiver, dtype=float)
+    lattice, orders = image_lattice(reflection_order)
+
+    # even images are translated copies of the source, odd images are mirrored
+    image_sources = np.where(lattice % 2 == 0, lattice * room_dim + source, (lattice + 1) * room_dim - source)
+
+    # the last plane crossed along an axis is the wall of the room on the image side, the path
+    # last meets a wall at the latest of these crossings (t = 0 at the image, t = 1 at the mic)
+    walls = np.where(lattice > 0, room_dim, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (walls - image_sources) / (receiver - image_sources)
+    t = np.where(lattice != 0, t, -np.inf)
+    axis = np.argmax(t, axis=1)
+    t = t[np.arange(len(t)), axis]
+    nodes = image_sources + t[:, None] * (receiver - image_sources)
+    walls = 2 * axis + (lattice[np.arange(len(axis)), axis] > 0)
+
+    # the last wall met is exactly on the wall, rounding can leave it a hair outside
+    nodes = np.clip(nodes, 0, room_dim)
+    source_distances = np.linalg.norm(nodes - image_sources, axis=1)
+
+    # the source and mic lines of every node add up to the image source distance of the ism
+    image_distances = np.linalg.norm(receiver - image_sources, axis=1)
+    assert np.allclose(source_distances + np.linalg.norm(receiver - nodes, axis=1), image_distances), 'node off the image source path'
+    if min_distance is None: return nodes, orders, walls, source_distances
+
+    # nodes are sorted by order, so a node is kept when it is far enough from every kept node before it.
+    # close pairs (i < j) come from a KD-tree, in order of j every earlier node is already decided
+    pairs = cKDTree(nodes).query_pairs(min_distance, output_type='ndarray')
+    keep = np.ones(len(nodes), dtype=bool)
+    for i, j in pairs[np.argsort(pairs[:, 1], kind='stable')].tolist():
+        if keep[i]: keep[j] = False
+    return nodes[keep], orders[keep], walls[keep], source_distances[keep]
+
+def connection_matrix(orders, connectivity='full'):
+    """
+    Sparse adjacency of the scattering nodes, entry (i, j) is the line from node i to node j.
+
+    Params:
+    orders: reflection order of each node
+    connectivity: 'full' connects every pair of nodes as in the first order SDN,
+                  'order' only connects nodes whose reflection orders differ by at most one
+
+    Returns: csr_matrix (n, n) of bools, rows sorted by column
+    """
+    orders = np.asarray(orders)
+    n = len(orders)
+    if connectivity == 'order':
+        # every pair of nodes within adjacent order bands, the bands are listed once
+        bands = {order: np.flatnonzero(orders == order) for order in np.unique(orders).tolist()}
+        band_pairs = [(bands[a], bands[b]) for a in bands for b in (a - 1, a, a + 1) if b in bands]
+        rows = np.concatenate([np.repeat(a, len(b)) for a, b in band_pairs])
+        cols = np.concatenate([np.tile(b, len(a)) for a, b in band_pairs])
+        rows, cols = rows[rows != cols], cols[rows != cols]
+    else:
+        assert connectivity == 'full', f'unknown connectivity {connectivity}'
+        # every other node of each row, column c of row i skips i
+        rows = np.repeat(np.arange(n), n - 1)
+        cols = np.tile(np.arange(n - 1), n)
+        cols = cols + (cols >= rows)
+    connections = csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n, n))
+    connections.sort_indices()
+    return connections
@@ -2,18 +2,23 @@
 # and its frequency dependant and independant wall absorption coefficients
 
 from utils.point3D import Point3D
-from .first_order_reflections import find_reflections
+from .reflection_nodes import reflection_nodes, connection_matrix
 
 class Room:
-    def __init__(self, dims: list[float], source: Point3D, mic: Point3D, reflection_order: int): 
+    def __init__(self, dims: list[float], source: Point3D, mic: Point3D, reflection_order: int, connectivity='full', min_node_distance=None): 
         # only shoebox for now        
         self.dims = dims
         self.valid_shape()
         self.source = source
         self.mic = mic
         self.valid_source_mic()
-        er = find_reflections(self.dims, self.source.to_list(), self.mic.to_list(), reflection_order)
+        self.reflection_order = reflection_order
+        self.connectivity = connectivity
+        self.min_node_distance = min_node_distance
+        er, self.node_orders, self.node_walls, self.node_source_distances = reflection_nodes(self.dims, self.source.to_list(), self.mic.to_list(), reflection_order, min_node_distance)
         self.early_reflections = [Point3D(r) for r in er]
+        # sparse node adjacency, (i, j) is the line from node i to node j
+        self.connections = connection_matrix(self.node_orders, connectivity)
         
         # wall attenuation values array
         
@@ -27,4 +32,5 @@ class Room:
         assert self.mic.less_than(self.dims[0], self.dims[1], self.dims[2])
     
     def update_reflections(self):
-        self.early_reflections = find_reflections(self.dims, self.source)
\ No newline at end of file
+        er, _, _, self.node_source_distances = reflection_nodes(self.dims, self.source.to_list(), self.mic.to_list(), self.reflection_order, self.min_node_distance)
+        self.early_reflections = [Point3D(r) for r in er]
@@ -2,22 +2,27 @@ import numpy as np
 from math import sqrt
 from scipy.signal import lfilter, lfilter_zi, lfiltic
 
+from utils.filters import apply_filter, filter_state, is_sos
+
 from utils.point3D import Point3D
 from .source import Source
 from .mic import Mic
 
 class ScatteringJunction:    
     # add arg types
-    def __init__(self, location: Point3D, source: Source, mic: Mic, alpha=1.0, filter_coeffs=None):
-        self.propigation_in = []
-        self.propigation_out = []
+    def __init__(self, location: Point3D, source: Source, mic: Mic, alpha=1.0, filter_coeffs=None, lines=None):
+        self.lines = lines # PropigationLines of the network
+        self.propigation_in = np.zeros(0, dtype=int) # line indices
+        self.propigation_out = np.zeros(0, dtype=int)
         self.location = location
         self.source = source
         self.mic = mic
         self.absorption = sqrt(1-alpha)
-        self.wall_filter_numer = filter_coeffs
-        self.wall_filter_denom = [1.0]
-        self.wall_filter_zi = np.zeros(len(self.wall_filter_numer) - 1)
+        self.wall_filter = filter_coeffs # FIR taps or second order sections
+        self.wall_filter_zi = filter_state(self.wall_filter)
+        # biquads run as scalar python, cheaper than an lfilter call per sample
+        self.wall_sections = [tuple(section) for section in self.wall_filter] if is_sos(self.wall_filter) else None
+        self.wall_sections_state = [[0.0, 0.0] for _ in self.wall_sections] if self.wall_sections is not None else None
 
     # get the sample from neigbour junctions
     # output an array of scattered values
@@ -27,7 +32,7 @@ class ScatteringJunction:
         # scale source
         source_sample_scaled = source_sample * 0.5
         # read samples in from neighbours
-        samples_in = [prop_line.sample_out() for prop_line in self.propigation_in]
+        samples_in = self.lines.sample_out(self.propigation_in).tolist()
         # output samples
         sample_to_mic = 0.0
         samples_out = np.zeros(M)
@@ -45,8 +50,10 @@ class ScatteringJunction:
             # create output to neighbour junctions
             if self.absorption != 0:
                 samples_out[i] = sample_out * self.absorption #frequency independant absorption
+            elif self.wall_sections is not None:
+                samples_out[i] = self._biquad_cascade(sample_out)
             else:
-                filter_out, zf = lfilter(self.wall_filter_numer, self.wall_filter_denom, [sample_out], zi=self.wall_filter_zi)# samples_out[i] =  #frequnecy dependant absorption
+                filter_out, zf = apply_filter(self.wall_filter, [sample_out], zi=self.wall_filter_zi) #frequnecy dependant absorption
                 self.wall_filter_zi = zf
                 samples_out[i] = filter_out[0]
 
@@ -55,15 +62,23 @@ class ScatteringJunction:
                     
         return samples_out, sample_to_mic
     
+    def _biquad_cascade(self, x):
+        # transposed direct form II of every section in turn
+        for (b0, b1, b2, _, a1, a2), state in zip(self.wall_sections, self.wall_sections_state):
+            y = b0 * x + state[0]
+            state[0] = b1 * x - a1 * y + state[1]
+            state[1] = b2 * x - a2 * y
+            x = y
+        return x
+    
     def scatter_out(self, samples):
-        M = len(self.propigation_out)
-        assert len(samples) == M
-        for i in range(M):
-            self.propigation_out[i].sample_in(samples[i])
+        assert len(samples) == len(self.propigation_out)
+        self.lines.sample_in(self.propigation_out, samples)
     
     def add_in(self, prop_in):
-        self.propigation_in.append(prop_in)
+        # a line index or an array of line indices
+        self.propigation_in = np.concatenate((self.propigation_in, np.atleast_1d(prop_in)))
         
     def add_out(self, prop_out):
-        self.propigation_out.append(prop_out)
+        self.propigation_out = np.concatenate((self.propigation_out, np.atleast_1d(prop_out)))
         
\ No newline at end of file
@@ -3,16 +3,38 @@ import numpy as np
 # classes and utilites
 from utils.point3D import Point3D
 from .network import Network
+from .block_network import BlockNetwork
+from .moving_network import MovingNetwork
+from .impulse_response import impulse_response
+from utils.convolve import fft_convolution
+from utils.geometry import control_path
 from .room import Room
 from .performance import Performance
 
-def run_sdn_simulation(signal_in, room_dims, source_loc, mic_loc, er_order, fs,  absorption_coefficients=None, absorption_freqs=None, flat_absorption=1.0, direct_path=True):
+def run_sdn_simulation(signal_in, room_dims, source_loc, mic_loc, er_order, fs,  absorption_coefficients=None, absorption_freqs=None, flat_absorption=1.0, direct_path=True, engine='block', block_size=256, wall_filter_type='fir', connectivity='full'):
     signal_out = np.zeros_like(signal_in)
     # setup the delay network
     source_location = Point3D(source_loc)
     mic_location = Point3D(mic_loc)
-    room = Room(room_dims, source_location, mic_location, er_order)
-    sdn = Network(room.early_reflections, source_location, mic_location, fs, absorption_coefficients, absorption_freqs, flat_absorption, direct_path) 
+    # nodes closer than a sample of propagation (343 m/s as the networks) are merged
+    room = Room(room_dims, source_location, mic_location, er_order, connectivity, min_node_distance=343.0 / fs)
+    # every node absorbs as the wall it lies on, higher order nodes repeat the wall coefficients
+    if absorption_coefficients is not None: absorption_coefficients = np.asarray(absorption_coefficients)[room.node_walls]
+    
+    # vectorised engine, processes blocks up to the shortest junction loop
+    if engine == 'block':
+        sdn = BlockNetwork(room.early_reflections, source_location, mic_location, fs, absorption_coefficients, absorption_freqs, flat_absorption, direct_path, block_size=block_size, wall_filter_type=wall_filter_type, connections=room.connections, source_distances=room.node_source_distances)
+        signal_out[:] = sdn.process(signal_in)
+        return signal_out
+    
+    # render the impulse response from the network transfer function and convolve once
+    if engine == 'impulse':
+        sdn = BlockNetwork(room.early_reflections, source_location, mic_location, fs, absorption_coefficients, absorption_freqs, flat_absorption, direct_path, block_size=block_size, wall_filter_type=wall_filter_type, connections=room.connections, source_distances=room.node_source_distances)
+        h = impulse_response(sdn, len(signal_in))
+        signal_out[:] = fft_convolution(signal_in, h)
+        return signal_out
+    
+    sdn = Network(room.early_reflections, source_location, mic_location, fs, absorption_coefficients, absorption_freqs, flat_absorption, direct_path, wall_filter_type=wall_filter_type, connections=room.connections, source_distances=room.node_source_distances) 
 
     # run the simulation
     for s in range(len(signal_in)):
@@ -24,4 +46,20 @@ def run_sdn_simulation(signal_in, room_dims, source_loc, mic_loc, er_order, fs,
         # print(f"processing sample: {s}")
     
     return signal_out
+
+def run_moving_sdn_simulation(signal_in, room_dims, source_path, mic_path, er_order, fs, absorption_coefficients=None, absorption_freqs=None, flat_absorption=1.0, direct_path=True, block_size=256, wall_filter_type='fir', connectivity='full', control_period=64, interpolation_taps=8):
+    """
+    Render a signal along a source and mic trajectory in one streaming pass,
+    source_path and mic_path hold the position at each control period (periods, 3) or a single position.
+    er_order must be 1, higher order nodes come closer than a sample and can't be merged the same way at every position.
+    """
+    assert er_order == 1, "moving sdn simulation supports er_order=1 only, render higher orders with run_sdn_simulation"
+    source_location = Point3D(control_path(source_path, 1)[0])
+    mic_location = Point3D(control_path(mic_path, 1)[0])
+    # every node is kept, so the nodes of each position correspond
+    room = Room(room_dims, source_location, mic_location, er_order, connectivity)
+    if absorption_coefficients is not None: absorption_coefficients = np.asarray(absorption_coefficients)[room.node_walls]
     
+    sdn = MovingNetwork(room, fs, absorption_coefficients, absorption_freqs, flat_absorption, direct_path, block_size=block_size, wall_filter_type=wall_filter_type, control_period=control_period, interpolation_taps=interpolation_taps)
+    return sdn.process(signal_in, source_path, mic_path)
+
@@ -1,6 +1,6 @@
 from config import SimulationConfig, RoomConfig, TestConfig, OutputConfig
 from utils.absorption import Absorption
-from scattering_delay_network.simulation import run_sdn_simulation
+from scattering_delay_network.simulation import run_sdn_simulation, run_moving_sdn_simulation
 
 # create instances of config classes
 simulation_config = SimulationConfig()
@@ -9,12 +9,15 @@ test_config = TestConfig()
 output_config = OutputConfig()
 
 class SDN:
-    def __init__(self, fs: float, simulation_config: SimulationConfig, room_config: RoomConfig):
+    def __init__(self, fs: float, simulation_config: SimulationConfig, room_config: RoomConfig, reflection_order=1, connectivity='full'):
         # get the absoprtion coefficients at frequnecy bands for each wall
         self.fs = fs
         absorption = Absorption(room_config.WALL_MATERIALS, room_config.MATERIALS_DIR, simulation_config.FS)
         self.absorption_coeffs = absorption.coefficients + absorption.air_absorption
         self.absorption_bands = absorption.freq_bands
+        # scattering nodes up to the reflection order, 'order' only connects nodes of adjacent orders
+        self.reflection_order = reflection_order
+        self.connectivity = connectivity
 
     def process(self, x):
         print(f'SDN Processing...')
@@ -23,11 +26,33 @@ class SDN:
                 room_config.ROOM_DIMS, 
                 room_config.SOURCE_LOC, 
                 room_config.MIC_LOC,
-                er_order=1,
+                er_order=self.reflection_order,
                 fs=self.fs,
                 absorption_coefficients=self.absorption_coeffs,
                 absorption_freqs=self.absorption_bands,
                 flat_absorption=1,
-                direct_path=True
+                direct_path=True,
+                connectivity=self.connectivity
         )                
-        return y
\ No newline at end of file
+        return y
+    
+    def process_moving(self, x, source_path, mic_path=None, control_period=64):
+        """
+        Render along a trajectory, source_path and mic_path hold the position at each control period of x (periods, 3).
+        Moving networks are first order only (reflection_order=1).
+        """
+        print(f'SDN Processing moving source...')
+        return run_moving_sdn_simulation(
+                x,
+                room_config.ROOM_DIMS,
+                source_path,
+                room_config.MIC_LOC if mic_path is None else mic_path,
+                er_order=self.reflection_order,
+                fs=self.fs,
+                absorption_coefficients=self.absorption_coeffs,
+                absorption_freqs=self.absorption_bands,
+                flat_absorption=1,
+                direct_path=True,
+                connectivity=self.connectivity,
+                control_period=control_period
+        )
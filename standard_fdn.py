@@ -1,14 +1,18 @@
 import numpy as np
 from math import sqrt
 
-from utils.matlab import init_matlab_eng
 from utils.reverb_time import ReverbTime
 from utils.absorption import Absorption
 from config import RoomConfig
+from late_reverberation import fdn
+from late_reverberation.delay_optimizer import optimise_delays
+from utils.matlab import shared_engine_pool
 
 class StandardFDN:
-    def __init__(self, fs: float, room_config: RoomConfig):
+    def __init__(self, fs: float, room_config: RoomConfig, fdn_engine='matlab', matlab_pool=None, optimise_delay_times=False, seed=None):
         self.fs = fs
+        self.fdn_engine = fdn_engine # 'matlab' or 'python' (late_reverberation/fdn.py)
+        self.matlab_pool = matlab_pool # shared warm engines are used when not given
 
         # get the absoprtion coefficients at frequnecy bands for each wall
         absorption = Absorption(room_config.WALL_MATERIALS, room_config.MATERIALS_DIR, self.fs)
@@ -20,18 +24,17 @@ class StandardFDN:
 
         # log distributed mutual primes from paper (Feedback Delay Network Optimization G. D. Santo et al. 2024)
         self.fdn_delay_times = np.array([809, 877, 937, 1049, 1151, 1249, 1373, 1499])
+        if optimise_delay_times:
+            # same order, delays searched for this room (late_reverberation/delay_optimizer.py), the paper's set is kept when no candidate scores lower
+            self.fdn_delay_times, _ = optimise_delays(self.fs, len(self.fdn_delay_times), room_config.ROOM_DIMS, self.rt60_sabine, reference=self.fdn_delay_times, seed=seed)
 
         self.scaling_factor = 1 / sqrt(len(self.fdn_delay_times))
 
     def process(self, x):
         print('Standard FDN Processing...')
-        # start matlab process
-        matlab_eng = init_matlab_eng()
+        if self.fdn_engine == 'python':
+            return fdn.standard_fdn(self.fs, x * self.scaling_factor, self.fdn_delay_times, self.rt60_sabine)
 
-        y =  matlab_eng.standard_fdn(self.fs, x * self.scaling_factor, self.fdn_delay_times, self.rt60_sabine)
-        y = np.array([t[0] for t in y])
-
-        # end matlab process
-        matlab_eng.quit()
-                
-        return y
\ No newline at end of file
+        matlab_pool = self.matlab_pool if self.matlab_pool is not None else shared_engine_pool()
+        y = matlab_pool.call('standard_fdn', self.fs, x * self.scaling_factor, self.fdn_delay_times, self.rt60_sabine)
+        return y[:, 0]
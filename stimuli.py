@@ -4,7 +4,7 @@ from random import shuffle
 from config import SimulationConfig, RoomConfig, TestConfig, OutputConfig
 from utils.signals import signal
 from utils.file import write_array_to_wav
-from utils.convolve import fft_convolution
+from utils.convolve import PartitionedConvolver
 
 from rirs import rirs_config
 
@@ -45,6 +45,10 @@ def get_rirs(fs):
         'name': "Small Hallway",
         'rir': real_rir,
     })
+    
+    # partition spectra of each rir are computed once and reused for every anechoic file
+    for rir in rirs:
+        if not isinstance(rir['rir'], tuple): rir['convolver'] = PartitionedConvolver(rir['rir'])
     return rirs
 
 rirs = get_rirs(prev_fs)
@@ -68,14 +72,13 @@ for file in anechoic_files:
     # for audio files
     for rir, i in zip(rirs,  range(0, len(rirs))):
         name = rir['name']
-        rir  = rir['rir']
         
-        if isinstance(rir, tuple):
+        if isinstance(rir['rir'], tuple):
             print('not signal')
             continue
         
         # apply rir to recording
-        stimulus = fft_convolution(anechoic_audio, rir, norm=True)
+        stimulus = rir['convolver'].convolve(anechoic_audio, norm=True)
         
         # normalise loudness (db)
         
@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.fft import fft, ifft
+from scipy.fft import fft, ifft, rfft, irfft
 
 def fft_convolution(x, ir, norm=False):
     y = np.zeros_like(x)
@@ -24,4 +24,156 @@ def fft_convolution(x, ir, norm=False):
     if norm: convolved_signal = convolved_signal / np.max(np.abs(convolved_signal))
     
     # output signal in the correct shape
-    return convolved_signal[:len(y)]
\ No newline at end of file
+    return convolved_signal[:len(y)]
+
+class PartitionedConvolver:
+    """
+    Uniformly partitioned overlap-save convolution with one or more impulse responses.
+    Each impulse response is split into partitions of block_size samples whose spectra are computed once,
+    the spectrum of every input block enters a frequency-domain delay line and meets each partition in turn.
+    Memory is bounded by the impulse response length, and the spectra are reused for every input.
+    """
+    def __init__(self, ir, block_size=4096):
+        self.single = np.ndim(ir) == 1
+        ir = np.atleast_2d(ir)
+        self.block_size = block_size
+        self.partitions = int(np.ceil(ir.shape[1] / block_size))
+
+        partitions = np.zeros((ir.shape[0], self.partitions * block_size))
+        partitions[:, :ir.shape[1]] = ir
+        partitions = partitions.reshape(ir.shape[0], self.partitions, block_size)
+        self.ir_spectra = rfft(partitions, 2 * block_size, axis=-1) # (irs, partitions, block_size + 1)
+        self.reset()
+
+    def reset(self):
+        self.input_buffer = np.zeros(2 * self.block_size)
+        self.fdl = np.zeros((self.partitions, self.block_size + 1), dtype=complex)
+        self.fdl_index = 0
+        self.ended = False
+
+    def process(self, block):
+        """
+        Convolve the next input block, the state is kept between calls.
+        Blocks must be block_size samples, a shorter block ends the stream.
+
+        Returns: output block, (irs, len(block)) for more than one impulse response
+        """
+        n = len(block)
+        B = self.block_size
+        assert n <= B and not self.ended, 'blocks must be block_size samples, a shorter block ends the stream'
+        if n < B: self.ended = True
+
+        # overlap-save, the previous block and the new one
+        self.input_buffer[:B] = self.input_buffer[B:]
+        self.input_buffer[B:] = 0
+        self.input_buffer[B:B + n] = block
+
+        # partition p meets the input spectrum from p blocks ago
+        self.fdl_index = (self.fdl_index - 1) % self.partitions
+        self.fdl[self.fdl_index] = rfft(self.input_buffer)
+        delayed = self.fdl[(self.fdl_index + np.arange(self.partitions)) % self.partitions]
+        y = irfft(np.einsum('kpf,pf->kf', self.ir_spectra, delayed), 2 * B)[:, B:B + n]
+        return y[0] if self.single else y
+
+    def convolve(self, x, norm=False):
+        """
+        Convolve a whole signal from a cleared state, the output has the length of x as in fft_convolution.
+        """
+        self.reset()
+        y = np.concatenate([self.process(x[start:start + self.block_size]) for start in range(0, len(x), self.block_size)], axis=-1)
+        if norm: y = y / np.max(np.abs(y))
+        return y
+
+class NonUniformConvolver:
+    """
+    Low latency non-uniform partitioned convolution, the latency is one block of block_sizes[0] samples.
+    The impulse response head, direct sound and early reflections, is convolved with small partitions
+    and the tail with partitions that grow with block_sizes.
+
+    A tail level of block size B collects B input samples, then spreads its frequency-domain products
+    over the next B / block_sizes[0] blocks so the work per block stays flat. Its result is needed 2B - b
+    samples after the block started, so level i starts at 2 * block_sizes[i] - block_sizes[0] in the impulse response.
+    """
+    def __init__(self, ir, block_sizes=(64, 1024, 8192)):
+        b = block_sizes[0]
+        assert all(B % b == 0 for B in block_sizes), 'block sizes must be multiples of the first'
+        self.block_size = b
+        self.length = len(ir)
+
+        # level i covers ir[starts[i]:starts[i + 1]]
+        starts = [0] + [2 * B - b for B in block_sizes[1:]] + [len(ir)]
+        self.head = PartitionedConvolver(ir[:starts[1]], b)
+        self.levels = []
+        for B, start, stop in zip(block_sizes[1:], starts[1:-1], starts[2:]):
+            if start >= len(ir): break
+            level = PartitionedConvolver(ir[start:max(start, stop)], B)
+            level.start = start
+            level.slices = np.array_split(np.arange(B + 1), B // b)
+            self.levels.append(level)
+
+        self.output_length = 2 * (starts[len(self.levels)] + max(block_sizes))
+        self.reset()
+
+    def reset(self):
+        self.head.reset()
+        for level in self.levels:
+            level.reset()
+            level.job = None # (block start time, input spectrum, output spectrum, next slice)
+        self.output = np.zeros(self.output_length)
+        self.time = 0
+
+    def process(self, block):
+        """
+        Convolve the next block of block_sizes[0] samples, the state is kept between calls.
+
+        Returns: output block (numpy array)
+        """
+        b = self.block_size
+        assert len(block) == b, 'blocks must be block_sizes[0] samples'
+        for level in self.levels:
+            B = level.block_size
+            # one slice of the pending block, then queue this block once the level input is complete
+            if level.job is not None: self._run_slice(level)
+            position = (self.time % B) + b
+            level.input_buffer[B + position - b:B + position] = block
+            if position == B:
+                self._start_job(level, self.time + b - B)
+                level.input_buffer[:B] = level.input_buffer[B:]
+
+        # a finished level block is due from this block on
+        output_index = (self.time + np.arange(b)) % self.output_length
+        y = self.head.process(block) + self.output[output_index]
+        self.output[output_index] = 0
+        self.time += b
+        return y
+
+    def convolve(self, x, norm=False):
+        """
+        Convolve a whole signal from a cleared state, the output has the length of x as in fft_convolution.
+        """
+        self.reset()
+        b = self.block_size
+        padded = np.pad(x, (0, -len(x) % b))
+        y = np.concatenate([self.process(padded[start:start + b]) for start in range(0, len(padded), b)])[:len(x)]
+        if norm: y = y / np.max(np.abs(y))
+        return y
+
+    @staticmethod
+    def _start_job(level, block_start):
+        level.fdl_index = (level.fdl_index - 1) % level.partitions
+        level.job = [block_start, level.input_buffer.copy(), np.zeros(level.block_size + 1, dtype=complex), 0]
+
+    def _run_slice(self, level):
+        block_start, input_buffer, spectrum, s = level.job
+        B = level.block_size
+        if s == 0: level.fdl[level.fdl_index] = rfft(input_buffer)
+        bins = level.slices[s]
+        delayed = level.fdl[(level.fdl_index + np.arange(level.partitions)) % level.partitions][:, bins]
+        spectrum[bins] = np.einsum('pf,pf->f', level.ir_spectra[0][:, bins], delayed)
+        level.job[3] = s + 1
+        if s + 1 < len(level.slices): return
+
+        # the block output starts start samples into the impulse response
+        y = irfft(spectrum, 2 * B)[B:]
+        self.output[(block_start + level.start + np.arange(B)) % self.output_length] += y
+        level.job = None
@@ -1,6 +1,12 @@
 import numpy as np
-from utils.fractional_delay import fractional_delay
-from scipy.signal import lfilter
+from utils.fractional_delay import fractional_delay_kernels, lagrange
+from utils.convolve import fft_convolution
+from scipy.signal import lfilter, oaconvolve
+from numpy.lib.stride_tricks import sliding_window_view
+from utils.filters import apply_filter, filter_state, is_sos
+
+# taps of the windowed sinc fractional delay kernels, a kernel looks (N - 1) // 2 samples ahead of its delay
+FRAC_FILTER_N = 81
 
 class DelayLine:
     """
@@ -20,7 +26,7 @@ class DelayLine:
         read_index = (self.index - delay - 1) % self.size
         return self.buffer[read_index]
     
-def delay_array(x, delay, fs, frac_filter_N=81):
+def delay_array(x, delay, fs, frac_filter_N=FRAC_FILTER_N):
     """
     Delay an array via zero padding
     
@@ -36,17 +42,145 @@ def delay_array(x, delay, fs, frac_filter_N=81):
     # apply integer delay
     delayed_signal = np.pad(x, (delay_int, 0), 'constant')[:len(x)]
     # apply fractional delay
-    frac_filter = fractional_delay(delay_frac, N=frac_filter_N)
+    frac_filter = fractional_delay_kernels(delay_frac, N=frac_filter_N)
     fractional_delayed_signal = np.convolve(delayed_signal, frac_filter, mode='same')
                     
     return fractional_delayed_signal[:len(output_signal)]
 
+def delay_arrays(x, delays, fs, frac_filter_N=FRAC_FILTER_N):
+    """
+    Delay many signals by different delays in one vectorised call, as delay_array of each row.
+    Every row is convolved with its fractional delay kernel in one batched overlap-add convolution,
+    then read from its integer delay.
+    
+    Params:
+    x: signals (channels, length), or one signal (length,) delayed by every delay
+    delays: delay time in seconds of each channel (channels,)
+    fs: sampling frequnecy
+    
+    Returns: delayed signals (channels, length)
+    """
+    delays = np.asarray(delays, dtype=float) * fs
+    x = np.atleast_2d(x)
+    length = x.shape[1]
+    delay_int = delays.astype(int)
+    kernels = fractional_delay_kernels(delays - delay_int, N=frac_filter_N)
+    
+    full = oaconvolve(x, kernels, axes=1) # (channels, length + N - 1)
+    
+    # the kernel is centred on the integer delay, as np.convolve(mode='same'), so channel c starts at (N - 1) / 2 - delay
+    starts = (frac_filter_N - 1) // 2 - delay_int
+    output_signals = np.zeros((len(full), length))
+    for c, start in enumerate(starts):
+        if start >= 0: output_signals[c] = full[c, start:start + length]
+        elif -start < length: output_signals[c, -start:] = full[c, :length + start]
+    return output_signals
+
+def interpolated_read(buffer, rows, times, N=4):
+    """
+    Read ring buffers (rows, length), indexed by sample time modulo length, at fractional sample times
+    with N tap Lagrange interpolation.
+
+    Params:
+    rows: buffer row of each read, broadcast against times
+    times: sample times to read, the N samples around each must be written and not yet overwritten
+
+    Returns: samples with the shape of times
+    """
+    base = np.floor(times).astype(int)
+    taps = base[..., None] - (N // 2 - 1) + np.arange(N)
+    samples = buffer[np.asarray(rows)[..., None], taps % buffer.shape[-1]]
+    return np.sum(lagrange(times - base, N) * samples, axis=-1)
+
+class SparseChannels:
+    """
+    Multi-channel signal kept as the taps of one input, channel c is the input delayed by delays[c]
+    and scaled by gains[c] (as delay_arrays(x, delays, fs) * gains[:, None]), rendered a block at a time
+    so memory grows with the block instead of channels times length.
+    Mixed channels (weights @ channels) are rendered through one sparse input filter per output,
+    the kernels of every channel scattered at their delays, instead of a convolution per channel.
+    """
+    def __init__(self, x, delays, gains, fs, frac_filter_N=FRAC_FILTER_N, weights=None):
+        """
+        Params:
+        x: input signal (length,)
+        delays: delay time in seconds of each channel (channels,)
+        gains: gain of each channel (channels,)
+        weights: mixing matrix (outputs, channels), None to render every channel
+        """
+        self.x = np.asarray(x, dtype=float)
+        self.delays = np.asarray(delays, dtype=float)
+        self.gains = np.asarray(gains, dtype=float)
+        self.fs = fs
+        self.frac_filter_N = frac_filter_N
+        self.weights = None if weights is None else np.atleast_2d(weights)
+
+        delays = self.delays * fs
+        delays_int = delays.astype(int)
+        self.kernels = fractional_delay_kernels(delays - delays_int, N=frac_filter_N) * self.gains[:, None]
+        # np.convolve(mode='same') centres the kernel on the integer delay, tap k of channel c reads x[t - starts[c] - k]
+        self.starts = delays_int - (frac_filter_N - 1) // 2
+        # nonzero samples of x before each index, a block reading only zeros is skipped
+        self.nonzero = np.concatenate(([0], np.cumsum(self.x != 0)))
+
+        if self.weights is not None:
+            self.filter_start = np.min(self.starts)
+            filter_length = np.max(self.starts) - self.filter_start + frac_filter_N
+            self.filters = np.array([TappedDelayLine._scatter(self.kernels * w[:, None], self.starts - self.filter_start, filter_length) for w in self.weights])
+        self.shape = (len(self.delays) if self.weights is None else len(self.weights), len(self.x))
+
+    def __mul__(self, gain):
+        return SparseChannels(self.x, self.delays, self.gains * gain, self.fs, self.frac_filter_N, self.weights)
+
+    __rmul__ = __mul__
+
+    def mixed(self, weights):
+        """
+        Returns: SparseChannels of the mixed channels, weights (outputs, channels)
+        """
+        weights = np.atleast_2d(weights)
+        if self.weights is not None: weights = weights @ self.weights
+        return SparseChannels(self.x, self.delays, self.gains, self.fs, self.frac_filter_N, weights)
+
+    def render(self, start=0, stop=None):
+        """
+        Render the samples start to stop of every channel.
+
+        Returns: block (channels, stop - start)
+        """
+        if stop is None: stop = self.shape[1]
+        n = stop - start
+        if self.weights is not None:
+            filter_length = self.filters.shape[1]
+            first = start - self.filter_start - (filter_length - 1)
+            if not self._any_nonzero(first, first + n + filter_length - 1): return np.zeros((len(self.filters), n))
+            window = self._gather(first + np.arange(n + filter_length - 1))
+            return oaconvolve(window[None, :], self.filters, mode='valid', axes=1)
+
+        N = self.frac_filter_N
+        first = start - self.starts - (N - 1)
+        active = self._any_nonzero(first, first + n + N - 1)
+        block = np.zeros((len(self.starts), n))
+        if not np.any(active): return block
+        windows = self._gather(first[active, None] + np.arange(n + N - 1))
+        block[active] = np.einsum('cnk,ck->cn', sliding_window_view(windows, N, axis=1), self.kernels[active, ::-1])
+        return block
+
+    def _any_nonzero(self, lo, hi):
+        length = len(self.x)
+        return self.nonzero[np.clip(hi, 0, length)] > self.nonzero[np.clip(lo, 0, length)]
+
+    def _gather(self, index):
+        valid = (index >= 0) & (index < len(self.x))
+        return np.where(valid, self.x[np.clip(index, 0, len(self.x) - 1)], 0.0)
+
 class TappedDelayLine:
-    def __init__(self, delays, gains, filter_coeffs, fs, frac_filter_N=81, use_filter=True):
+    def __init__(self, delays, gains, filter_coeffs, fs, frac_filter_N=FRAC_FILTER_N, use_filter=True, groups=None):
         self.delays = delays  # delay times in seconds
         self.gains = gains  # gain values for each delay
         self.fs = fs
         self.filter_coeffs = filter_coeffs
+        self.groups = groups if groups is not None else list(range(len(delays))) # taps sharing a filter
         self.use_filter = use_filter
         self.frac_filter_N = frac_filter_N
         self.group_delay = (frac_filter_N - 1) // 2
@@ -59,7 +193,7 @@ class TappedDelayLine:
             # apply integer delay
             delayed_signal = np.pad(input_signal, (delay_int, 0), 'constant')[:len(input_signal)]
             # apply fractional delay
-            frac_filter = fractional_delay(delay_frac, N=self.frac_filter_N)
+            frac_filter = fractional_delay_kernels(delay_frac, N=self.frac_filter_N)
             fractional_delayed_signal = np.convolve(delayed_signal, frac_filter, mode='same')
             
             # correct for the group delay of the fractional delay filter
@@ -67,9 +201,154 @@ class TappedDelayLine:
             #     (np.zeros(self.group_delay), fractional_delayed_signal)
             # )
             
-            if(self.use_filter): fractional_delayed_signal = lfilter(filter_coeffs, [1], fractional_delayed_signal)
+            if(self.use_filter): fractional_delayed_signal = apply_filter(filter_coeffs, fractional_delayed_signal)
             output_signal += (gain * fractional_delayed_signal)
         
         return output_signal[:len(output_signal)]
+    
+    def process_sparse(self, input_signal, grouped=False):
+        """
+        Render the tapped delay line as a sparse impulse response and apply it with a single fft convolution.
+        Matches process except for the last (frac_filter_N - 1) / 2 samples, which process truncates.
+        """
+        ir, offset = self.impulse_response(len(input_signal), grouped=grouped)
+        output_signal = fft_convolution(np.pad(input_signal, (0, offset)), ir)
+        return output_signal[offset:offset + len(input_signal)].astype(input_signal.dtype)
 
+    def impulse_response(self, length, grouped=False):
+        """
+        Scatter add the kernel of each tap (fractional delay convolved with the wall filter) into an impulse response.
+        Cost grows with the number of taps times the kernel length.
+        
+        grouped: sum the taps of each group into a bus and run the group filter once per bus instead of once per tap
+        
+        Returns: impulse response, offset (samples before time zero, from fractional delays shorter than the group delay)
+        """
+        delays = np.array(self.delays) * self.fs
+        delays_int = delays.astype(int)
+        kernels = fractional_delay_kernels(delays - delays_int, N=self.frac_filter_N) * np.array(self.gains)[:, None]
+        
+        # np.convolve(mode='same') centres the fractional delay on the integer delay
+        starts = delays_int - self.group_delay
+        offset = max(0, -np.min(starts))
+        ir_length = length + offset
+        
+        # an IIR wall filter has no finite kernel, the taps of a group are filtered as one bus
+        if self.use_filter and (grouped or is_sos(self.filter_coeffs[0])):
+            return self._grouped_impulse_response(kernels, starts + offset, ir_length), offset
+        
+        # convolve every fractional delay with its wall filter
+        if self.use_filter:
+            filter_coeffs = np.array(self.filter_coeffs)
+            kernel_length = kernels.shape[1] + filter_coeffs.shape[1] - 1
+            n_fft = 2 ** int(np.ceil(np.log2(kernel_length)))
+            kernels = np.fft.irfft(np.fft.rfft(kernels, n_fft) * np.fft.rfft(filter_coeffs, n_fft), n_fft)[:, :kernel_length]
+        
+        return self._scatter(kernels, starts + offset, ir_length), offset
+    
+    def _grouped_impulse_response(self, kernels, starts, ir_length):
+        ir = np.zeros(ir_length)
+        _, first_taps, group_index = np.unique(np.array(self.groups), return_index=True, return_inverse=True)
+        for group, first_tap in enumerate(first_taps):
+            members = group_index == group
+            bus = self._scatter(kernels[members], starts[members], ir_length)
+            filter_coeffs = self.filter_coeffs[first_tap]
+            if is_sos(filter_coeffs):
+                filtered = apply_filter(filter_coeffs, bus)
+            else:
+                # the bus only needs to be filtered up to its last tap
+                bus = bus[:np.max(starts[members]) + kernels.shape[1]]
+                filtered = np.convolve(bus, filter_coeffs)[:ir_length]
+            ir[:len(filtered)] += filtered
+        return ir
+    
+    @staticmethod
+    def _scatter(kernels, starts, ir_length):
+        taps = starts[:, None] + np.arange(kernels.shape[1])
+        in_range = taps < ir_length
+        return np.bincount(taps[in_range], weights=kernels[in_range], minlength=ir_length)
+
+class MovingTappedDelayLine:
+    """
+    Streaming tapped delay line with time varying delays and gains, for moving sources and listeners.
+    Delays and gains are given at a control rate and ramp linearly over each control period.
+    The taps of a group share a wall filter, which runs once per group on the input, and each tap
+    reads its group's filtered signal at a fractional delay with Lagrange interpolation.
+    """
+    def __init__(self, filter_coeffs, fs, max_delay, groups=None, control_period=64, interpolation_taps=8, use_filter=True):
+        """
+        Params:
+        filter_coeffs: wall filter of each tap, FIR taps or second order sections
+        max_delay: longest delay in seconds of any control frame
+        groups: taps sharing a filter, every tap filtered on its own by default
+        """
+        self.fs = fs
+        self.control_period = control_period
+        self.interpolation_taps = interpolation_taps
+        self.use_filter = use_filter
+        if groups is None: groups = list(range(len(filter_coeffs)))
+        if not use_filter: groups = [0] * len(filter_coeffs) # every tap reads the input
+        _, first_taps, self.tap_groups = np.unique(np.array(groups), return_index=True, return_inverse=True)
+        self.group_filters = [filter_coeffs[tap] for tap in first_taps]
+        
+        # ring buffer of every group's filtered input, a tap reads up to N / 2 samples either side of its delay
+        self.max_delay = int(np.ceil(max_delay * fs)) + interpolation_taps
+        self.buffer_length = self.max_delay + control_period + 1
+        self.reset()
+    
+    def reset(self):
+        """
+        Clear the ring buffer, filter states and the last control frame.
+        """
+        self.buffer = np.zeros((len(self.group_filters), self.buffer_length))
+        self.group_filter_zi = [filter_state(coeffs) for coeffs in self.group_filters] if self.use_filter else None
+        self.delays = None # samples, at the end of the last control period
+        self.gains = None
+        self.time = 0
+    
+    def process(self, input_signal, delays, gains):
+        """
+        Process a signal in control periods, the state is kept between calls.
+        
+        Params:
+        delays: delay times in seconds of each tap at each control period of the signal (periods, taps),
+                the delays ramp from the previous period to these, a missing period holds the last row
+        gains: gain of each tap (periods, taps)
+        
+        Returns: output signal (numpy array)
+        """
+        delays = np.atleast_2d(delays) * self.fs
+        gains = np.atleast_2d(gains)
+        N = self.interpolation_taps
+        # the samples after a tap must be written when it is read
+        delays = np.maximum(delays, N // 2)
+        assert np.max(delays) <= self.max_delay - N, "delay exceeds max_delay"
+        if self.delays is None: self.delays, self.gains = delays[0], gains[0]
+        
+        output_signal = np.zeros(len(input_signal))
+        for period, start in enumerate(range(0, len(input_signal), self.control_period)):
+            stop = min(start + self.control_period, len(input_signal))
+            frame = min(period, len(delays) - 1)
+            ramp = (np.arange(stop - start) + 1) / self.control_period
+            t = self.time + np.arange(stop - start)
+            
+            # filter the block of every group into the ring buffer
+            block = input_signal[start:stop]
+            for g, coeffs in enumerate(self.group_filters):
+                if self.use_filter: filtered, self.group_filter_zi[g] = apply_filter(coeffs, block, zi=self.group_filter_zi[g])
+                else: filtered = block
+                self.buffer[g, t % self.buffer_length] = filtered
+            
+            # taps (taps, n) ramped from the last control frame
+            tap_delays = self.delays[:, None] + (delays[frame] - self.delays)[:, None] * ramp
+            tap_gains = self.gains[:, None] + (gains[frame] - self.gains)[:, None] * ramp
+            samples = interpolated_read(self.buffer, self.tap_groups[:, None], t - tap_delays, N)
+            output_signal[start:stop] = np.sum(tap_gains * samples, axis=0)
+            
+            # a partial period only ramps part of the way
+            self.delays = tap_delays[:, -1]
+            self.gains = tap_gains[:, -1]
+            self.time += stop - start
+        
+        return output_signal
 
@@ -1,19 +1,99 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.signal import firwin2, freqz, minimum_phase, lfilter
+import hashlib
+import zipfile
+from os import path, makedirs, replace, getpid
+from functools import wraps
+from collections import OrderedDict
+from scipy.signal import firwin2, freqz, sosfreqz, minimum_phase, lfilter, sosfilt
 from librosa import power_to_db
 
 from .convolve import fft_convolution
 from .plot import plot_spectrogram
 
-def fir_type_1(freqs, gains, nyquist, numtaps=201):
+class FilterDesignCache:
     """
-    Create an asymmetrical FIR filter with frequnecy response fit to frequency bands and gains.
-    DC and Nyquist gains extraploated from values at maximum and minimum indexes of gains.
+    LRU cache of designed FIR and IIR filters keyed on the design parameters, the same few material and
+    sample rate combinations are designed once per process, or once per machine with a cache directory.
+
+    Params:
+    max_size: number of designs kept in memory
+    cache_dir: directory of the optional on disk store, None to keep designs in memory only
     """
-    assert len(freqs) == len(gains)
-    assert freqs[-1] < nyquist
-    assert numtaps % 2 != 0
+    def __init__(self, max_size=256, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.designs = OrderedDict()
+
+    @staticmethod
+    def key(fir_type, freqs, gains, nyquist, numtaps):
+        return (
+            fir_type,
+            np.asarray(freqs, dtype=float).tobytes(),
+            np.asarray(gains, dtype=float).tobytes(),
+            float(nyquist),
+            int(numtaps),
+        )
+
+    # file prefix and array names on disk of each design type, FIR (linear, minimum phase) or IIR (sos, fit error)
+    storage = {'I': ('fir_I', ('linear', 'minimum')), 'II': ('fir_II', ('linear', 'minimum')), 'IIR': ('iir', ('sos', 'error_db'))}
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return path.join(self.cache_dir, f'{self.storage[key[0]][0]}_{digest}.npz')
+
+    def get(self, key):
+        if key in self.designs:
+            self.designs.move_to_end(key)
+            return self.designs[key]
+        if self.cache_dir is not None and path.exists(self._path(key)):
+            try:
+                with np.load(self._path(key)) as design:
+                    filters = tuple(design[name] for name in self.storage[key[0]][1])
+            except (zipfile.BadZipFile, EOFError, KeyError, ValueError): # unreadable entry, design again
+                return None
+            self._store(key, filters)
+            return filters
+        return None
+
+    def set(self, key, filters):
+        self._store(key, filters)
+        if self.cache_dir is not None:
+            makedirs(self.cache_dir, exist_ok=True)
+            # write then rename, worker processes designing the same filter never read a partial entry
+            temp_path = f'{self._path(key)}.{getpid()}.tmp'
+            with open(temp_path, 'wb') as file:
+                np.savez(file, **dict(zip(self.storage[key[0]][1], filters)))
+            replace(temp_path, self._path(key))
+
+    def _store(self, key, filters):
+        self.designs[key] = filters
+        self.designs.move_to_end(key)
+        if len(self.designs) > self.max_size: self.designs.popitem(last=False)
+
+    def clear(self):
+        self.designs.clear()
+
+filter_design_cache = FilterDesignCache()
+
+def cached_design(fir_type):
+    """
+    Look up a filter design function in filter_design_cache before designing, copies are returned so the cache can't be changed.
+    """
+    def decorator(design):
+        @wraps(design)
+        def cached(freqs, gains, nyquist, numtaps):
+            key = filter_design_cache.key(fir_type, freqs, gains, nyquist, numtaps)
+            filters = filter_design_cache.get(key)
+            if filters is None:
+                filters = design(freqs, gains, nyquist, numtaps)
+                filter_design_cache.set(key, filters)
+            return filters[0].copy(), filters[1].copy()
+        return cached
+    return decorator
+
+@cached_design('I')
+def _design_type_1(freqs, gains, nyquist, numtaps):
     normalized_freqs = np.concatenate(([0], freqs / nyquist, [1]))
     gains_min = gains[0]
     gains_max = gains[-1]
@@ -21,6 +101,24 @@ def fir_type_1(freqs, gains, nyquist, numtaps=201):
     linear_fir = firwin2(numtaps, normalized_freqs, gains)
     min_fir = minimum_phase(linear_fir)
     return linear_fir, min_fir
+
+@cached_design('II')
+def _design_type_2(freqs, gains, nyquist, numtaps):
+    normalized_freqs = np.concatenate(([0], freqs / nyquist, [1]))
+    gains = np.concatenate(([1], gains, [0])) # repeat the first and last gain for the full spectrum
+    linear_fir = firwin2(numtaps, normalized_freqs, gains)
+    min_fir = minimum_phase(linear_fir, method='hilbert')
+    return linear_fir, min_fir
+
+def fir_type_1(freqs, gains, nyquist, numtaps=201):
+    """
+    Create an asymmetrical FIR filter with frequnecy response fit to frequency bands and gains.
+    DC and Nyquist gains extraploated from values at maximum and minimum indexes of gains.
+    """
+    assert len(freqs) == len(gains)
+    assert freqs[-1] < nyquist
+    assert numtaps % 2 != 0
+    return _design_type_1(np.asarray(freqs), np.asarray(gains), nyquist, numtaps)
     
 def fir_type_2(freqs, gains, nyquist, numtaps=200):
     """
@@ -30,11 +128,155 @@ def fir_type_2(freqs, gains, nyquist, numtaps=200):
     assert len(freqs) == len(gains)
     assert freqs[-1] < nyquist
     assert numtaps % 2 == 0
-    normalized_freqs = np.concatenate(([0], freqs / nyquist, [1]))
-    gains = np.concatenate(([1], gains, [0])) # repeat the first and last gain for the full spectrum
-    linear_fir = firwin2(numtaps, normalized_freqs, gains)
-    min_fir = minimum_phase(linear_fir, method='hilbert')
-    return linear_fir, min_fir
+    return _design_type_2(np.asarray(freqs), np.asarray(gains), nyquist, numtaps)
+
+def biquad(kind, f0, gain_db, fs, bandwidth=1.0):
+    """
+    Peaking or shelving biquad (Audio EQ Cookbook, R. Bristow-Johnson).
+
+    Params:
+    kind: 'peak', 'low_shelf' or 'high_shelf'
+    f0: centre or shelf midpoint frequency (Hz)
+    bandwidth: in octaves, of the peak or the shelf slope
+
+    Returns: second order section [b0, b1, b2, 1, a1, a2]
+    """
+    A = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * f0 / fs
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) * np.sinh(np.log(2) / 2 * bandwidth * w0 / np.sin(w0))
+    if kind == 'peak':
+        b = [1 + alpha * A, -2 * cos_w0, 1 - alpha * A]
+        a = [1 + alpha / A, -2 * cos_w0, 1 - alpha / A]
+    else:
+        sign = 1 if kind == 'low_shelf' else -1
+        root = 2 * np.sqrt(A) * alpha
+        b = [A * ((A + 1) - sign * (A - 1) * cos_w0 + root), sign * 2 * A * ((A - 1) - sign * (A + 1) * cos_w0), A * ((A + 1) - sign * (A - 1) * cos_w0 - root)]
+        a = [(A + 1) + sign * (A - 1) * cos_w0 + root, -sign * 2 * ((A - 1) + sign * (A + 1) * cos_w0), (A + 1) + sign * (A - 1) * cos_w0 - root]
+    return np.concatenate((b, a)) / a[0]
+
+def _graphic_eq_sections(freqs, gains_db, fs, bandwidth):
+    # low shelf below the first band, peaks at the inner bands and a high shelf above the last band
+    edges = [np.sqrt(freqs[0] * freqs[1]), np.sqrt(freqs[-2] * freqs[-1])]
+    sections = [biquad('low_shelf', edges[0], gains_db[0], fs, bandwidth)]
+    sections += [biquad('peak', f, g, fs, bandwidth) for f, g in zip(freqs[1:-1], gains_db[1:-1])]
+    sections += [biquad('high_shelf', edges[1], gains_db[-1], fs, bandwidth)]
+    return np.array(sections)
+
+def _sos_response_db(sos, freqs, fs):
+    """
+    Returns: magnitude response of each section in dB (freqs, sections)
+    """
+    z = np.exp(-1j * 2 * np.pi * np.asarray(freqs)[:, None] / fs)
+    numerator = sos[:, 0] + sos[:, 1] * z + sos[:, 2] * z ** 2
+    denominator = sos[:, 3] + sos[:, 4] * z + sos[:, 5] * z ** 2
+    return 20 * np.log10(np.abs(numerator / denominator))
+
+# largest magnitude response of an IIR wall filter, a fit overshooting unity would let a scattering network grow
+IIR_MAX_GAIN = 0.999
+# fit error in dB above which wall filters fall back to the minimum phase fir_type_1 filter
+IIR_MAX_ERROR_DB = 1.5
+
+def peak_gain(filter_coeffs, worN=8192):
+    """
+    Returns: maximum magnitude response of FIR taps or second order sections between 0 Hz and nyquist
+    """
+    _, h = sosfreqz(filter_coeffs, worN=worN) if is_sos(filter_coeffs) else freqz(filter_coeffs, worN=worN)
+    return np.max(np.abs(h))
+
+@cached_design('IIR')
+def _design_iir(freqs, gains, nyquist, sections):
+    fs = 2 * nyquist
+    gains_db = 20 * np.log10(np.maximum(gains, 1e-3))
+    band_freqs = freqs[np.round(np.linspace(0, len(freqs) - 1, sections)).astype(int)]
+    bandwidth = np.log2(band_freqs[1] / band_freqs[0])
+
+    # the response is fit at the bands and the geometric midpoints between them
+    fit_freqs = np.sort(np.concatenate((freqs, np.sqrt(freqs[1:] * freqs[:-1]))))
+    fit_target = np.interp(np.log(fit_freqs), np.log(freqs), gains_db)
+
+    # least squares section gains from the interaction of unit gain sections, then again at the fitted gains,
+    # the dB responses of the sections add and scale almost linearly with their gain (Välimäki and Liski 2017)
+    section_gains = np.interp(np.log(band_freqs), np.log(freqs), gains_db)
+    for _ in range(2):
+        prototype_gains = np.where(np.abs(section_gains) > 0.1, section_gains, -1.0)
+        interaction = _sos_response_db(_graphic_eq_sections(band_freqs, prototype_gains, fs, bandwidth), fit_freqs, fs) / prototype_gains
+        section_gains = np.linalg.lstsq(interaction, fit_target, rcond=None)[0]
+
+    sos = _graphic_eq_sections(band_freqs, section_gains, fs, bandwidth)
+    # a poor fit overshoots between the bands, the cascade is scaled down so it never amplifies
+    peak = peak_gain(sos)
+    if peak > IIR_MAX_GAIN: sos[0, :3] *= IIR_MAX_GAIN / peak
+    error_db = np.max(np.abs(np.sum(_sos_response_db(sos, freqs, fs), axis=1) - gains_db))
+    return sos, np.array(error_db)
+
+def iir_filter(freqs, gains, nyquist, sections=None):
+    """
+    Low order IIR filter with a magnitude response fit to frequency bands and gains, a graphic equaliser cascade
+    of a low shelf, peaking filters and a high shelf. A cheaper alternative to the minimum phase fir_type_1 filter.
+
+    Params:
+    sections: number of biquads, at least 2, defaults to one per band
+
+    Returns: second order sections (sections, 6) with a peak gain of at most IIR_MAX_GAIN, maximum fit error at the bands in dB
+    """
+    assert len(freqs) == len(gains)
+    assert freqs[-1] < nyquist
+    sections = len(freqs) if sections is None else sections
+    assert 2 <= sections <= len(freqs)
+    sos, error_db = _design_iir(np.asarray(freqs, dtype=float), np.asarray(gains, dtype=float), nyquist, sections)
+    return sos, float(error_db)
+
+def iir_wall_filter(freqs, gains, nyquist, max_error_db=IIR_MAX_ERROR_DB):
+    """
+    iir_filter of a wall, or the minimum phase fir_type_1 filter when the IIR fit error is above max_error_db
+    (strongly frequency dependant absorbers a graphic equaliser cascade can't follow).
+
+    Returns: second order sections or FIR taps, maximum IIR fit error at the bands in dB
+    """
+    sos, error_db = iir_filter(freqs, gains, nyquist)
+    if error_db <= max_error_db: return sos, error_db
+    return fir_type_1(freqs, gains, nyquist)[1], error_db
+
+def is_sos(filter_coeffs):
+    return np.ndim(filter_coeffs) == 2 and np.shape(filter_coeffs)[1] == 6
+
+def apply_filter(filter_coeffs, x, zi=None):
+    """
+    Run a wall filter given as FIR taps or second order sections.
+
+    Returns: filtered signal, or the filtered signal and final state when zi is given
+    """
+    if is_sos(filter_coeffs):
+        return sosfilt(filter_coeffs, x) if zi is None else sosfilt(filter_coeffs, x, zi=zi)
+    return lfilter(filter_coeffs, [1.0], x) if zi is None else lfilter(filter_coeffs, [1.0], x, zi=zi)
+
+def filter_state(filter_coeffs):
+    """
+    Returns: zero initial state for apply_filter
+    """
+    if is_sos(filter_coeffs): return np.zeros((len(filter_coeffs), 2))
+    return np.zeros(len(filter_coeffs) - 1)
+
+def impulse_response_of(filter_coeffs, tolerance=1e-12, max_length=1 << 16):
+    """
+    Impulse response of a wall filter, an IIR filter is truncated once its tail is below tolerance.
+    """
+    if not is_sos(filter_coeffs): return np.asarray(filter_coeffs)
+    # filter in blocks and stop at the first block below tolerance, the tail would run into slow denormals
+    block_size = 1024
+    x = np.zeros(block_size)
+    x[0] = 1.0
+    zi = filter_state(filter_coeffs)
+    blocks = []
+    for _ in range(max_length // block_size):
+        block, zi = sosfilt(filter_coeffs, x, zi=zi)
+        blocks.append(block)
+        x = np.zeros(block_size)
+        if np.max(np.abs(block)) < tolerance: break
+    h = np.concatenate(blocks)
+    above = np.flatnonzero(np.abs(h) > tolerance)
+    return h[:above[-1] + 1]
 
 def plot_fir(x, freqs, gains, fs, db=False, y_scale='linear', plot_spec=False, numtaps=200, title=''):
     """
@@ -127,9 +369,14 @@ def filter_sample_by_sample(x, b, y):
     
     return y
 
-def tone_correction(x, absorption_coeffs, absorption_bands, fs, taps=200, plot=False):
+def tone_correction_filter(absorption_coeffs, absorption_bands, fs, taps=200):
     avg_gain = np.mean(1 - absorption_coeffs, axis=0)
     b, b_min = fir_type_2(absorption_bands, avg_gain, fs, numtaps=taps)
+    return b_min
+
+def tone_correction(x, absorption_coeffs, absorption_bands, fs, taps=200, plot=False):
+    avg_gain = np.mean(1 - absorption_coeffs, axis=0)
+    b_min = tone_correction_filter(absorption_coeffs, absorption_bands, fs, taps=taps)
     tonal_correction = lfilter(b_min, [1], x) 
     if plot: plot_fir(x=None, freqs=absorption_bands, gains=avg_gain, fs=fs, numtaps=taps, title='Tonal Filter')
     return tonal_correction  
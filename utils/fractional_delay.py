@@ -44,4 +44,70 @@ def fractional_delay(t0, N=81):
     if isinstance(t0, np.ndarray) and t0.ndim == 1:
         t0 = t0[:, None]
 
-    return np.hanning(N) * np.sinc(np.arange(N) - (N - 1) / 2 - t0)
\ No newline at end of file
+    return np.hanning(N) * np.sinc(np.arange(N) - (N - 1) / 2 - t0)
+
+# kernels per sample of the fractional delay tables
+FRACTIONAL_DELAY_RESOLUTION = 1024
+_kernel_tables = {}
+
+def fractional_delay_table(N=81, resolution=FRACTIONAL_DELAY_RESOLUTION):
+    """
+    Windowed sinc kernels of the fractional delays 0, 1 / resolution, ..., 1,
+    computed once per (N, resolution) and shared by every caller.
+
+    Returns
+    -------
+    numpy array
+        Read only table of kernels (resolution + 1, N).
+    """
+    key = (N, resolution)
+    if key not in _kernel_tables:
+        table = fractional_delay(np.arange(resolution + 1) / resolution, N=N)
+        table.setflags(write=False)
+        _kernel_tables[key] = table
+    return _kernel_tables[key]
+
+def fractional_delay_kernels(t0, N=81, resolution=FRACTIONAL_DELAY_RESOLUTION):
+    """
+    Fractional delay filters looked up in the kernel table, the delay is rounded
+    to the nearest 1 / resolution of a sample.
+
+    Parameters
+    ----------
+    t0: float or numpy array
+        The delays in fraction of sample, between 0 and 1.
+
+    Returns
+    -------
+    numpy array
+        Filters with a trailing axis of length N, as fractional_delay.
+    """
+    index = np.rint(np.asarray(t0) * resolution).astype(int)
+    assert np.all((index >= 0) & (index <= resolution)), "fractional delay outside [0, 1]"
+    return fractional_delay_table(N, resolution)[index]
+
+def lagrange(t0, N=4):
+    """
+    Lagrange interpolation filter of N taps (order N - 1), short enough to evaluate for
+    every sample of a time varying delay.
+
+    Parameters
+    ----------
+    t0: float or numpy array
+        Fractional position in [0, 1) after the sample at floor(t).
+    N: int
+        Number of taps, applied to the samples floor(t) - (N // 2 - 1) .. floor(t) + N // 2.
+
+    Returns
+    -------
+    numpy array
+        Filter taps with a trailing axis of length N.
+    """
+    x = np.asarray(t0, dtype=float)[..., None] + (N // 2 - 1) # position after the first tap
+    n = np.arange(N)
+    taps = np.ones(x.shape[:-1] + (N,))
+    for k in range(N):
+        others = np.delete(n, k)
+        taps[..., k] = np.prod((x - others) / (k - others), axis=-1)
+    return taps
+
@@ -1,3 +1,4 @@
+import numpy as np
 from math import sqrt
 from utils.point3D import Point3D
 
@@ -15,4 +16,11 @@ def vector_diff(point_a: Point3D, point_b: Point3D):
     x_diff = point_a.x - point_b.x
     y_diff = point_a.y - point_b.y
     z_diff = point_a.z - point_b.z
-    return Point3D([x_diff, y_diff, z_diff])
\ No newline at end of file
+    return Point3D([x_diff, y_diff, z_diff])
+
+# positions of a trajectory at each control period (periods, 3),
+# a single position is held throughout and a short trajectory holds its last position
+def control_path(path, periods):
+    path = np.atleast_2d(np.asarray(path, dtype=float))
+    return path[np.minimum(np.arange(periods), len(path) - 1)]
+
@@ -1,10 +1,112 @@
-import matlab.engine as matlab
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+
+try:
+    import matlab
+    import matlab.engine
+except ImportError: # the numpy engines and LocalEngine run without MATLAB
+    matlab = None
 
 def init_matlab_eng():
-    matlab_eng = matlab.start_matlab()
+    assert matlab is not None, 'MATLAB engine for python is not installed'
+    matlab_eng = matlab.engine.start_matlab()
     s = matlab_eng.genpath(r'_fdnToolbox')
     matlab_eng.addpath(s, nargout=0)
     s = matlab_eng.genpath(r'_output')
     matlab_eng.addpath(s, nargout=0)
     matlab_eng.cd(r'late_reverberation', nargout=0)
-    return matlab_eng # TODO: refactor so functions that need this take it as an argument
\ No newline at end of file
+    return matlab_eng
+
+def to_matlab(arg):
+    """
+    Pass numeric arrays to MATLAB as matlab.double built from the array buffer instead of nested lists.
+    """
+    if matlab is None or not isinstance(arg, np.ndarray): return arg
+    return matlab.double(np.ascontiguousarray(arg, dtype=float))
+
+class MatlabEnginePool:
+    """
+    Pool of warm MATLAB engines kept alive across renders.
+    Calls are dispatched round robin as background futures, so calls on different engines run concurrently.
+
+    Params:
+    size: number of engines to start
+    engine_factory: callable returning an engine, init_matlab_eng or a LocalEngine stand-in
+    """
+    def __init__(self, size=1, engine_factory=init_matlab_eng):
+        self.engines = [engine_factory() for _ in range(size)]
+        self._next_engine = cycle(self.engines)
+
+    def submit(self, name, *args, nargout=1):
+        """
+        Start a MATLAB function on the next engine.
+
+        Returns: EngineFuture, result() gives numpy arrays
+        """
+        engine = next(self._next_engine)
+        future = getattr(engine, name)(*[to_matlab(arg) for arg in args], nargout=nargout, background=True)
+        return EngineFuture(future)
+
+    def call(self, name, *args, nargout=1):
+        return self.submit(name, *args, nargout=nargout).result()
+
+    def quit(self):
+        for engine in self.engines:
+            engine.quit()
+        self.engines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.quit()
+
+class EngineFuture:
+    def __init__(self, future):
+        self.future = future
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        result = self.future.result()
+        if isinstance(result, tuple): return tuple(np.asarray(r) for r in result)
+        return np.asarray(result)
+
+class LocalEngine:
+    """
+    Stand-in for a MATLAB engine running python functions, e.g. the late_reverberation.fdn module.
+    1D outputs are returned as column vectors like MATLAB.
+    """
+    def __init__(self, functions, max_workers=2):
+        self.functions = functions
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __getattr__(self, name):
+        function = getattr(self.functions, name)
+        def call(*args, nargout=1, background=False):
+            future = self.executor.submit(self._run, function, nargout, *args)
+            return future if background else future.result()
+        return call
+
+    @staticmethod
+    def _run(function, nargout, *args):
+        args = [np.asarray(arg) if matlab is not None and isinstance(arg, matlab.double) else arg for arg in args]
+        result = function(*args)
+        if nargout == 1 and np.ndim(result) == 1: return np.asarray(result)[:, None]
+        return result
+
+    def quit(self):
+        self.executor.shutdown()
+
+_shared_pool = None
+
+def shared_engine_pool(size=1, engine_factory=init_matlab_eng):
+    """
+    Engine pool shared by every render in the process, started on first use.
+    """
+    global _shared_pool
+    if _shared_pool is None or len(_shared_pool.engines) == 0:
+        _shared_pool = MatlabEnginePool(size, engine_factory)
+    return _shared_pool
@@ -2,6 +2,9 @@ import numpy as np
 from matplotlib import pyplot as plt
 from math import floor
 import librosa
+import librosa.display
+
+from evaluation.energy_decay_relief import spectrogram_db, energy_decay_relief
 
 def plot_signal(signal, title="", fs=44100, plot_time=True, xlim=None):
     plt.figure(figsize=(10, 4))
@@ -54,16 +57,28 @@ def linear_to_dB(x):
     x_max = np.max(x)
     return 20 * np.log10((x + epsilon) / x_max)
 
-def plot_spectrogram(y, sr, y_scale='linear', title="Spectrogram", xlim=None):    
+def plot_spectrogram(y, sr, y_scale='linear', title="Spectrogram", xlim=None, spectrogram=None):
+    # spectrogram: precomputed spectrogram_db of y, e.g. from a cached evaluation, computed from y when None
     fig = plt.figure(figsize=(10, 4))
     plt.title(f'{title}')
-    D = librosa.amplitude_to_db(np.abs(librosa.stft(y)), ref=np.max)
+    D = spectrogram_db(y) if spectrogram is None else spectrogram
     img = librosa.display.specshow(D, y_axis=y_scale.lower(), x_axis='time', sr=sr)
     plt.ylabel(f"{y_scale} Frequency (Hz)")
     plt.xlabel("Time (secs)")
     plt.xlim(xlim)
     fig.colorbar(img, format="%+2.f dB")
 
+def plot_energy_decay_relief(y, sr, y_scale='linear', title="Energy Decay Relief", xlim=None, min_db=-80, edr_db=None):
+    # edr_db: precomputed energy decay relief of y, e.g. from a cached evaluation, computed from y when None
+    fig = plt.figure(figsize=(10, 4))
+    plt.title(f'{title}')
+    if edr_db is None: _, _, edr_db = energy_decay_relief(y, sr)
+    img = librosa.display.specshow(np.maximum(edr_db, min_db), y_axis=y_scale.lower(), x_axis='time', sr=sr)
+    plt.ylabel(f"{y_scale} Frequency (Hz)")
+    plt.xlabel("Time (secs)")
+    plt.xlim(xlim)
+    fig.colorbar(img, format="%+2.f dB")
+
 def show_plots():
     plt.show()
     
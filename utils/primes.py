@@ -1,5 +1,52 @@
 import numpy as np
-from sympy import nextprime, isprime
+
+from config import SimulationConfig
+
+# primes of the segmented sieve, extended a segment at a time when a larger prime is needed
+SEGMENT_SIZE = 1 << 16
+_primes = np.zeros(0, dtype=np.int64)
+_sieve_limit = 0 # every prime below the limit is in _primes
+
+def _sieve_segment(low, high):
+    """
+    Primes in [low, high) crossed off with the cached primes up to sqrt(high).
+    """
+    is_prime = np.ones(high - low, dtype=bool)
+    if low < 2: is_prime[:2 - low] = False
+    base_primes = _primes if low > 0 else _small_primes(int(np.sqrt(high)) + 1)
+    for p in base_primes[base_primes * base_primes < high]:
+        first = max(p * p, (low + p - 1) // p * p)
+        is_prime[first - low::p] = False
+    return np.flatnonzero(is_prime).astype(np.int64) + low
+
+def _small_primes(limit):
+    is_prime = np.ones(limit, dtype=bool)
+    is_prime[:2] = False
+    for p in range(2, int(np.sqrt(limit)) + 1):
+        if is_prime[p]: is_prime[p * p::p] = False
+    return np.flatnonzero(is_prime).astype(np.int64)
+
+def primes_below(limit=SimulationConfig.MAX_DELAY):
+    """
+    Sorted primes below limit from the cached sieve, the first call sieves up to SimulationConfig.MAX_DELAY.
+    """
+    global _primes, _sieve_limit
+    limit = int(limit)
+    while _sieve_limit < max(limit, SimulationConfig.MAX_DELAY):
+        # the first segment covers sqrt of every later segment
+        high = _sieve_limit + SEGMENT_SIZE if _sieve_limit > 0 else max(limit, SimulationConfig.MAX_DELAY, SEGMENT_SIZE)
+        _primes = np.concatenate((_primes, _sieve_segment(_sieve_limit, high)))
+        _sieve_limit = high
+    return _primes[:np.searchsorted(_primes, limit)]
+
+def next_primes(points):
+    """
+    Smallest prime greater than each point (sympy nextprime of every point at once).
+    """
+    points = np.asarray(points, dtype=np.int64)
+    # bertrand's postulate, there is a prime between n and 2n
+    primes = primes_below(2 * np.max(points, initial=0) + 3)
+    return primes[np.searchsorted(primes, points, side='right')]
 
 def calculate_log_range(center, percentage):
     offset = center * (percentage / 100)
@@ -11,32 +58,50 @@ def log_distributed_primes(center, percentage, count):
     start, end = calculate_log_range(center, percentage)
     # logarithmic spaced points
     log_points = np.logspace(np.log10(start), np.log10(end), count)
-    
+
     primes = primes_in_range(count, log_points)
-    
+
     return primes
 
 def primes_in_range(count, points):
-    primes = []
-    seen = set()
-    for point in points:
-        prime = nextprime(int(point))
-        while prime in seen:
-            prime = nextprime(prime + 1)
-        if isprime(prime):
-            primes.append(prime)
-            seen.add(prime)
-        if len(primes) == count:
-            break
-        
-    return primes
+    """
+    Next prime after each point, points that land on the same prime take the following free primes.
+    Colliding points are resolved in ascending order, so the set of primes matches resolving them one by one.
+    """
+    points = np.asarray(points, dtype=float).astype(np.int64)[:count]
+    if len(points) == 0: return []
+    primes = primes_below(2 * np.max(points) + 3)
+
+    # index of the next prime of each point, then shift collisions up to the next free index
+    order = np.argsort(points, kind='stable')
+    index = np.searchsorted(primes, points[order], side='right')
+    offsets = np.arange(len(index))
+    index = np.maximum.accumulate(index - offsets) + offsets
+    while index[-1] >= len(primes):
+        primes = primes_below(2 * primes[-1])
+
+    resolved = np.empty(len(points), dtype=np.int64)
+    resolved[order] = primes[index]
+    return resolved.tolist()
+
+def is_mutually_prime(numbers, chunk_size=1024):
+    """
+    Pairwise coprimality of a set of delays, gcd of every pair in blocks of rows.
+    """
+    numbers = np.asarray(numbers, dtype=np.int64)
+    if len(numbers) < 2: return True
 
-def is_mutually_prime(numbers):
-    from math import gcd
-    from itertools import combinations
-    for a, b in combinations(numbers, 2):
-        if gcd(a, b) != 1:
-            return False
+    # distinct primes are always coprime
+    primes = primes_below(np.max(numbers) + 1)
+    if len(np.unique(numbers)) == len(numbers) and np.all(primes[np.minimum(np.searchsorted(primes, numbers), len(primes) - 1)] == numbers):
+        return True
+
+    for start in range(0, len(numbers), chunk_size):
+        rows = numbers[start:start + chunk_size]
+        gcds = np.gcd.outer(rows, numbers)
+        # only pairs above the diagonal
+        above = np.arange(len(numbers))[None, :] > np.arange(start, start + len(rows))[:, None]
+        if np.any(gcds[above] != 1): return False
     return True
 
 def find_log_mutual_primes(center, count, percentage=50):
@@ -44,9 +109,9 @@ def find_log_mutual_primes(center, count, percentage=50):
     for p in range(percentage, 99):
         primes = log_distributed_primes(center, p, count)
         is_valid_set = (is_mutually_prime(primes) and len(primes) == count)
-        
+
         if(is_valid_set): return primes
-      
+
 def find_closest_primes(points):
     primes = primes_in_range(len(points), points)
     return np.array(primes)
@@ -12,8 +12,8 @@ import numpy as np
 from matplotlib import pyplot as plt
 from math import sqrt
 from pyroomacoustics.experimental.rt60 import measure_rt60
-from pyroomacoustics.acoustics import OctaveBandsFactory
 from config import RoomConfig
+from evaluation.decay_analysis import decay_analysis
 
 class ReverbTime:
     def __init__(self, room_config: RoomConfig):
@@ -163,16 +163,6 @@ class ReverbTime:
     
     def analyse_rt60_bands(self, h, fs):
         """Use octave filterbank to measure rt60 a octave bands"""
-        octave_bands = OctaveBandsFactory(fs=fs)
-        bands = octave_bands.analysis(h)
-        centers = octave_bands.centers
-        
-        rt60s = {} 
-         
-        for i in range(len(centers)):
-            band = np.array([sample[i] for sample in bands])
-            rt60 = measure_rt60(band, fs)
-            rt60s[centers[i]] = rt60
-        
-        return rt60s
+        decay = decay_analysis(h, fs, broadband=False)
+        return dict(zip(decay['centers'], decay['RT60'][0]))
         
\ No newline at end of file
@@ -10,6 +10,13 @@ from utils.absorption import Absorption
 from utils.reverb_time import ReverbTime
 from utils.plot import plot_room
 
+def calc_mean_free_path(V, S):
+    """
+    V: Room volume
+    S: Surface area, total or of each wall
+    """
+    return (4 * V) / np.sum(S)
+
 # TODO: intergrate into room simulation algorithms
 class Room:
     def __init__(self, fs, room_config: RoomConfig, plot=False):
@@ -50,8 +57,4 @@ class Room:
         assert np.all(np.array(self.mic) > np.array([0, 0, 0])), "Mic position must be greater than (0, 0, 0)."
     
     def calc_mean_free_path(self):
-        """
-        V: Room volume
-        S: Total surface area
-        """
-        return (4 * self.V) / self.S
\ No newline at end of file
+        return calc_mean_free_path(self.V, self.S)
\ No newline at end of file